@@ -0,0 +1,101 @@
+# This file is part of PyOP2
+#
+# PyOP2 is Copyright (c) 2012, Imperial College London and
+# others. Please see the AUTHORS file in the main source directory for
+# a full list of copyright holders.  All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions
+# are met:
+#
+#     * Redistributions of source code must retain the above copyright
+#       notice, this list of conditions and the following disclaimer.
+#     * Redistributions in binary form must reproduce the above copyright
+#       notice, this list of conditions and the following disclaimer in the
+#       documentation and/or other materials provided with the distribution.
+#     * The name of Imperial College London or that of other
+#       contributors may not be used to endorse or promote products
+#       derived from this software without specific prior written
+#       permission.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTERS
+# ''AS IS'' AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT
+# LIMITED TO, THE IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS
+# FOR A PARTICULAR PURPOSE ARE DISCLAIMED. IN NO EVENT SHALL THE
+# COPYRIGHT HOLDERS OR CONTRIBUTORS BE LIABLE FOR ANY DIRECT,
+# INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES
+# (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR
+# SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION)
+# HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT,
+# STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE)
+# ARISING IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED
+# OF THE POSSIBILITY OF SUCH DAMAGE.
+
+"""PyOP2 Dat layout benchmark
+
+Measures the mean time of a direct and an indirect :func:`par_loop` over
+vector-valued :class:`Dat`\s with 4 and 9 components per element stored in
+array-of-structures (AoS) and structure-of-arrays (SoA) order, and reports
+the layout ``soa="auto"`` chooses for each.
+"""
+
+from __future__ import print_function
+from pyop2 import op2, utils
+from pyop2.base import _trace
+import numpy as np
+from time import time
+
+parser = utils.parser(group=True, description=__doc__)
+parser.add_argument('-s', '--size',
+                    action='store',
+                    default=100000,
+                    type=int,
+                    help='number of set elements (default 100000)')
+parser.add_argument('-r', '--repeat',
+                    action='store',
+                    default=100,
+                    type=int,
+                    help='number of repetitions per loop (default 100)')
+
+opt = vars(parser.parse_args())
+size = opt.pop('size')
+repeat = opt.pop('repeat')
+op2.init(**opt)
+
+nodes = op2.Set(size, "nodes")
+cells = op2.Set(size, "cells")
+cell2node = op2.Map(cells, nodes, 1, np.random.permutation(size), "cell2node")
+
+# Kernels index the components of direct arguments of Dats in SoA order
+# with OP2_STRIDE, and see those of indirect arguments contiguously
+axpy = """void axpy(double *y, const double *x) {
+  for (int c = 0; c < %(dim)d; ++c) %(y)s = 0.5 * %(x)s + %(y)s;
+}"""
+
+
+def timeit(loop):
+    """Mean time of loop including the evaluation of the computation it
+    enqueued, after a first call to generate and compile the code."""
+    loop()
+    _trace.evaluate_all()
+    t = time()
+    for _ in range(repeat):
+        loop()
+    _trace.evaluate_all()
+    return (time() - t) / repeat
+
+
+print("%-4s %-6s %-6s %16s %16s" % ("dim", "layout", "auto", "direct [s]", "indirect [s]"))
+for dim in (4, 9):
+    auto = op2.Dat(nodes ** dim, soa="auto").soa
+    for soa in (False, True):
+        cmpt = "OP2_STRIDE(%s, c)" if soa else "%s[c]"
+        k = op2.Kernel(axpy % {'dim': dim, 'y': cmpt % 'y', 'x': cmpt % 'x'}, "axpy")
+        k_ind = op2.Kernel(axpy % {'dim': dim, 'y': cmpt % 'y', 'x': 'x[c]'}, "axpy")
+        xc = op2.Dat(cells ** dim, np.random.rand(size, dim), np.float64, soa=soa)
+        x = op2.Dat(nodes ** dim, np.random.rand(size, dim), np.float64, soa=soa)
+        y = op2.Dat(cells ** dim, np.random.rand(size, dim), np.float64, soa=soa)
+        direct = timeit(lambda: op2.par_loop(k, cells, y(op2.RW), xc(op2.READ)))
+        indirect = timeit(lambda: op2.par_loop(k_ind, cells, y(op2.RW), x(op2.READ, cell2node[0])))
+        print("%-4d %-6s %-6s %16.6f %16.6f" % (dim, "SoA" if soa else "AoS",
+                                                "SoA" if auto else "AoS", direct, indirect))
@@ -0,0 +1,112 @@
+# This file is part of PyOP2
+#
+# PyOP2 is Copyright (c) 2012, Imperial College London and
+# others. Please see the AUTHORS file in the main source directory for
+# a full list of copyright holders.  All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions
+# are met:
+#
+#     * Redistributions of source code must retain the above copyright
+#       notice, this list of conditions and the following disclaimer.
+#     * Redistributions in binary form must reproduce the above copyright
+#       notice, this list of conditions and the following disclaimer in the
+#       documentation and/or other materials provided with the distribution.
+#     * The name of Imperial College London or that of other
+#       contributors may not be used to endorse or promote products
+#       derived from this software without specific prior written
+#       permission.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTERS
+# ''AS IS'' AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT
+# LIMITED TO, THE IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS
+# FOR A PARTICULAR PURPOSE ARE DISCLAIMED. IN NO EVENT SHALL THE
+# COPYRIGHT HOLDERS OR CONTRIBUTORS BE LIABLE FOR ANY DIRECT,
+# INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES
+# (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR
+# SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION)
+# HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT,
+# STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE)
+# ARISING IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED
+# OF THE POSSIBILITY OF SUCH DAMAGE.
+
+"""PyOP2 Dat linear algebra benchmark
+
+Measures the latency of the first call (including any code generation and
+compilation) and the mean latency of subsequent calls of pointwise linear
+algebra operations on :class:`Dat`\s, with the NumPy host path
+(``host_linalg``) disabled and enabled. Generated code is cached on disk,
+clear the ``cache_dir`` to measure the first call with compilation.
+"""
+
+from __future__ import print_function
+from pyop2 import op2, utils
+from pyop2.base import _trace
+import numpy as np
+from time import time
+
+parser = utils.parser(group=True, description=__doc__)
+parser.add_argument('-s', '--size',
+                    action='store',
+                    default=100000,
+                    type=int,
+                    help='number of set elements (default 100000)')
+parser.add_argument('-r', '--repeat',
+                    action='store',
+                    default=100,
+                    type=int,
+                    help='number of repetitions per operation (default 100)')
+
+opt = vars(parser.parse_args())
+size = opt.pop('size')
+repeat = opt.pop('repeat')
+op2.init(**opt)
+
+dset = op2.Set(size, "nodes") ** 1
+x = op2.Dat(dset, np.random.rand(size), np.float64, "x")
+y = op2.Dat(dset, np.random.rand(size), np.float64, "y")
+
+
+def add():
+    x + y
+
+
+def iadd():
+    x.__iadd__(y)
+
+
+def iadd_scalar():
+    x.__iadd__(1.0)
+
+
+def imul_scalar():
+    x.__imul__(0.5)
+
+
+def inner():
+    x.inner(y)
+
+
+def norm():
+    x.norm
+
+
+ops = [add, iadd, iadd_scalar, imul_scalar, inner, norm]
+
+
+def timeit(op):
+    """Time op including the evaluation of the computation it enqueued."""
+    t = time()
+    op()
+    _trace.evaluate_all()
+    return time() - t
+
+
+print("%-12s %-6s %14s %14s" % ("operation", "numpy", "first call [s]", "per call [s]"))
+for host_linalg in (False, True):
+    op2.configuration['host_linalg'] = host_linalg
+    for op in ops:
+        first = timeit(op)
+        mean = sum(timeit(op) for _ in range(repeat)) / repeat
+        print("%-12s %-6s %14.6f %14.6f" % (op.__name__, host_linalg, first, mean))
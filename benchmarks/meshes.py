@@ -0,0 +1,189 @@
+# This file is part of PyOP2
+#
+# PyOP2 is Copyright (c) 2012, Imperial College London and
+# others. Please see the AUTHORS file in the main source directory for
+# a full list of copyright holders.  All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions
+# are met:
+#
+#     * Redistributions of source code must retain the above copyright
+#       notice, this list of conditions and the following disclaimer.
+#     * Redistributions in binary form must reproduce the above copyright
+#       notice, this list of conditions and the following disclaimer in the
+#       documentation and/or other materials provided with the distribution.
+#     * The name of Imperial College London or that of other
+#       contributors may not be used to endorse or promote products
+#       derived from this software without specific prior written
+#       permission.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTERS
+# ''AS IS'' AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT
+# LIMITED TO, THE IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS
+# FOR A PARTICULAR PURPOSE ARE DISCLAIMED. IN NO EVENT SHALL THE
+# COPYRIGHT HOLDERS OR CONTRIBUTORS BE LIABLE FOR ANY DIRECT,
+# INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES
+# (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR
+# SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION)
+# HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT,
+# STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE)
+# ARISING IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED
+# OF THE POSSIBILITY OF SUCH DAMAGE.
+
+
+"""Mesh generators for the PyOP2 benchmark suite
+
+Generate the meshes of the demo workloads in-process, so that benchmarks do
+not depend on mesh files and scale to any size.  Every generator takes the
+number of cells ``n`` along each side of the unit square.  With
+``unstructured=True`` the interior vertices are displaced and the
+vertices, cells and edges are numbered in a random order drawn from
+``seed``, which gives the irregular memory accesses of an unstructured
+mesh while keeping the amount of work the same.
+"""
+
+from collections import namedtuple
+import numpy as np
+
+
+class Quadrilaterals(namedtuple('Quadrilaterals', ['x', 'cells', 'edges', 'ecells', 'bedges',
+                                                   'becells', 'bound', 'bnodes'])):
+
+    """Quadrilateral mesh in the layout of the airfoil demo.
+
+    Cell vertices are numbered counter-clockwise.  The cell ``ecells[e, 0]``
+    lies to the right and ``ecells[e, 1]`` to the left of the edge from
+    ``edges[e, 0]`` to ``edges[e, 1]``, the boundary cell ``becells[e]`` to
+    the right of ``bedges[e]``.  ``bound`` is 1 for the walls at the bottom
+    and top and 0 for the far field on the left and right, ``bnodes`` are the
+    vertices on the boundary."""
+
+    __slots__ = ()
+
+
+class Triangles(namedtuple('Triangles', ['x', 'cells'])):
+
+    """Triangle mesh given by vertex coordinates and cell vertices."""
+
+    __slots__ = ()
+
+
+class GridGraph(namedtuple('GridGraph', ['nodes', 'edges', 'A', 'r'])):
+
+    """Matrix graph of the 5-point Laplacian on the interior vertices of a
+    grid in the layout of the jacobi demo, with an edge from each vertex to
+    itself and to each of its interior neighbours, the edge weights ``A`` and
+    the right-hand side ``r``."""
+
+    __slots__ = ()
+
+
+def _vertices(n, unstructured, rng):
+    i, j = [a.ravel() for a in np.meshgrid(np.arange(n + 1), np.arange(n + 1))]
+    x = np.column_stack((i, j)).astype(np.float64) / n
+    if unstructured:
+        interior = (i > 0) & (i < n) & (j > 0) & (j < n)
+        x[interior] += rng.uniform(-0.2, 0.2, (interior.sum(), 2)) / n
+    return x
+
+
+def _renumber(rng, rows):
+    """Return a random permutation of the entities ``rows`` and the rows in
+    the new order."""
+    perm = rng.permutation(len(rows))
+    new = np.empty_like(rows)
+    new[perm] = rows
+    return perm, new
+
+
+def _shuffle(rng, *arrays):
+    """Reorder ``arrays`` by the same random permutation."""
+    order = rng.permutation(len(arrays[0]))
+    return [a[order] for a in arrays]
+
+
+def quadrilaterals(n, unstructured=False, seed=0):
+    """Quadrilateral mesh of a channel with ``n * n`` cells.
+
+    :returns: a :class:`Quadrilaterals` mesh."""
+    rng = np.random.RandomState(seed)
+
+    def node(i, j):
+        return j * (n + 1) + i
+
+    def cell(i, j):
+        return j * n + i
+
+    def grid(i, j):
+        return [a.ravel() for a in np.meshgrid(i, j)]
+
+    x = _vertices(n, unstructured, rng)
+    ci, cj = grid(np.arange(n), np.arange(n))
+    cells = np.column_stack((node(ci, cj), node(ci + 1, cj),
+                             node(ci + 1, cj + 1), node(ci, cj + 1)))
+    vi, vj = grid(np.arange(1, n), np.arange(n))
+    hi, hj = grid(np.arange(n), np.arange(1, n))
+    edges = np.vstack((np.column_stack((node(vi, vj), node(vi, vj + 1))),
+                       np.column_stack((node(hi, hj), node(hi + 1, hj)))))
+    ecells = np.vstack((np.column_stack((cell(vi, vj), cell(vi - 1, vj))),
+                        np.column_stack((cell(hi, hj - 1), cell(hi, hj)))))
+    b = np.arange(n)
+    bedges = np.vstack((np.column_stack((node(b + 1, 0), node(b, 0))),
+                        np.column_stack((node(b, n), node(b + 1, n))),
+                        np.column_stack((node(0, b), node(0, b + 1))),
+                        np.column_stack((node(n, b + 1), node(n, b)))))
+    becells = np.concatenate((cell(b, 0), cell(b, n - 1), cell(0, b), cell(n - 1, b)))
+    bound = np.repeat(np.array([1, 0], dtype=np.int32), 2 * n)
+    if unstructured:
+        nperm, x = _renumber(rng, x)
+        cperm, cells = _renumber(rng, nperm[cells])
+        edges, ecells = _shuffle(rng, nperm[edges], cperm[ecells])
+        bedges, becells, bound = _shuffle(rng, nperm[bedges], cperm[becells], bound)
+    return Quadrilaterals(x, cells.astype(np.int32), edges.astype(np.int32),
+                          ecells.astype(np.int32), bedges.astype(np.int32),
+                          becells.astype(np.int32), bound,
+                          np.unique(bedges).astype(np.int32))
+
+
+def triangles(n, unstructured=False, seed=0):
+    """Triangle mesh of the unit square with ``2 * n * n`` cells.
+
+    :returns: a :class:`Triangles` mesh."""
+    rng = np.random.RandomState(seed)
+    i, j = [a.ravel() for a in np.meshgrid(np.arange(n), np.arange(n))]
+    v = j * (n + 1) + i
+    x = _vertices(n, unstructured, rng)
+    cells = np.vstack((np.column_stack((v, v + 1, v + n + 2)),
+                       np.column_stack((v, v + n + 2, v + n + 1))))
+    if unstructured:
+        nperm, x = _renumber(rng, x)
+        _, cells = _renumber(rng, nperm[cells])
+    return Triangles(x, cells.astype(np.int32))
+
+
+def grid_graph(n, unstructured=False, seed=0):
+    """Matrix graph of the 5-point Laplacian on the ``n * n`` interior
+    vertices of a grid.
+
+    :returns: a :class:`GridGraph`."""
+    rng = np.random.RandomState(seed)
+    i, j = [a.ravel() for a in np.meshgrid(np.arange(n), np.arange(n))]
+    v = j * n + i
+    rows, cols, A = [v], [v], [-np.ones(n * n)]
+    r = np.zeros(n * n)
+    for di, dj in ((-1, 0), (1, 0), (0, -1), (0, 1)):
+        i2, j2 = i + di, j + dj
+        inside = (i2 >= 0) & (i2 < n) & (j2 >= 0) & (j2 < n)
+        rows.append(v[inside])
+        cols.append((j2 * n + i2)[inside])
+        A.append(0.25 * np.ones(inside.sum()))
+        r[~inside] += 0.25
+    rows, cols, A = [np.concatenate(a) for a in (rows, cols, A)]
+    order = np.argsort(rows, kind='mergesort')
+    edges = np.column_stack((rows, cols))[order]
+    A = A[order]
+    if unstructured:
+        nperm, r = _renumber(rng, r)
+        edges, A = _shuffle(rng, nperm[edges], A)
+    return GridGraph(n * n, edges.astype(np.int32), A, r)
@@ -0,0 +1,256 @@
+# This file is part of PyOP2
+#
+# PyOP2 is Copyright (c) 2012, Imperial College London and
+# others. Please see the AUTHORS file in the main source directory for
+# a full list of copyright holders.  All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions
+# are met:
+#
+#     * Redistributions of source code must retain the above copyright
+#       notice, this list of conditions and the following disclaimer.
+#     * Redistributions in binary form must reproduce the above copyright
+#       notice, this list of conditions and the following disclaimer in the
+#       documentation and/or other materials provided with the distribution.
+#     * The name of Imperial College London or that of other
+#       contributors may not be used to endorse or promote products
+#       derived from this software without specific prior written
+#       permission.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTERS
+# ''AS IS'' AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT
+# LIMITED TO, THE IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS
+# FOR A PARTICULAR PURPOSE ARE DISCLAIMED. IN NO EVENT SHALL THE
+# COPYRIGHT HOLDERS OR CONTRIBUTORS BE LIABLE FOR ANY DIRECT,
+# INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES
+# (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR
+# SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION)
+# HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT,
+# STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE)
+# ARISING IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED
+# OF THE POSSIBILITY OF SUCH DAMAGE.
+
+
+"""PyOP2 benchmark suite
+
+Runs the workloads of the airfoil, aero, jacobi and extrusion demos on
+meshes generated in-process with ``--size`` cells along each side of the
+unit square, and reports for each workload:
+
+  mesh       time to generate the mesh [s]
+  setup      time to declare the sets, maps and data [s]
+  first      time of the first iteration, which generates code and
+             builds plans [s]
+  iteration  median time of the ``--iterations`` iterations that follow [s]
+  min        minimum time of these iterations [s]
+  plan       time spent building plans [s]
+  sparsity   time spent building sparsity patterns [s]
+  compile    time spent generating and compiling code [s]
+  memory     peak of the memory held by PyOP2 objects [MB]
+  rss        peak resident set size of the process so far [MB]
+
+Each backend given with ``--backends`` runs in a process of its own.
+Results are written as JSON with ``--output``.  With ``--baseline``, the
+results are compared to those stored earlier and the exit status is 1 if
+any ``--gate`` metric regressed by more than ``--tolerance``; with
+``--save``, the results are stored as the new baseline instead.  Baselines
+are only comparable on the same machine and with the same mesh options.
+"""
+
+from __future__ import print_function
+import json
+import os
+import platform
+import resource
+import subprocess
+import sys
+import tempfile
+from time import time
+
+from pyop2 import op2, utils
+from pyop2.base import _trace, Const
+from pyop2.configuration import configuration
+from pyop2.profiling import get_timers, reset_timers, MemoryTracker, write_table
+
+from workloads import WORKLOADS
+
+METRICS = ('mesh', 'setup', 'first', 'iteration', 'min', 'plan', 'sparsity',
+           'compile', 'memory', 'rss')
+COLUMNS = ('Mesh [s]', 'Setup [s]', 'First [s]', 'Iteration [s]', 'Min [s]',
+           'Plan [s]', 'Sparsity [s]', 'Compile [s]', 'Memory [MB]', 'RSS [MB]')
+MEMORY = ('memory', 'rss')
+# Setup costs taken from the PyOP2 timers
+TIMERS = {'plan': ("Plan construction",),
+          'sparsity': ("Build sparsity",),
+          'compile': ("JITModule code generation", "Compilation")}
+# Options the results depend on
+CONFIG = ('size', 'layers', 'unstructured', 'seed')
+
+parser = utils.parser(group=True, description=__doc__)
+parser.add_argument('-w', '--workloads', nargs='+', default=list(WORKLOADS),
+                    choices=list(WORKLOADS),
+                    help='workloads to run (default all)')
+parser.add_argument('-s', '--size', type=int, default=200,
+                    help='number of cells along each side of the mesh (default 200)')
+parser.add_argument('--layers', type=int, default=10,
+                    help='number of layers of the extruded meshes (default 10)')
+parser.add_argument('-u', '--unstructured', action='store_true',
+                    help='perturb and randomly renumber the meshes')
+parser.add_argument('--seed', type=int, default=0,
+                    help='seed of the random mesh numbering (default 0)')
+parser.add_argument('-i', '--iterations', type=int, default=20,
+                    help='number of timed iterations (default 20)')
+parser.add_argument('-B', '--backends', nargs='+',
+                    choices=['sequential', 'openmp', 'opencl', 'cuda'],
+                    help='run on each of these backends in a separate process')
+parser.add_argument('-o', '--output',
+                    help='write the results as JSON to this file')
+parser.add_argument('--baseline',
+                    help='compare the results to this JSON file')
+parser.add_argument('--save', action='store_true',
+                    help='store the results as the new baseline instead')
+parser.add_argument('-t', '--tolerance', type=float, default=0.1,
+                    help='relative increase of a metric taken as regression (default 0.1)')
+parser.add_argument('--min-time', type=float, default=1e-3,
+                    help='ignore increases of times below this many seconds (default 1e-3)')
+parser.add_argument('--gate', nargs='+', choices=METRICS,
+                    default=['setup', 'iteration', 'plan', 'memory'],
+                    help='metrics to compare to the baseline (default setup, '
+                    'iteration, plan and memory, as the other costs depend on '
+                    'the state of the caches)')
+parser.add_argument('-q', '--quiet', action='store_true',
+                    help='do not print the results')
+
+
+def evaluate(f):
+    """Time a call of f including the evaluation of the computation it
+    enqueued."""
+    t = time()
+    f()
+    _trace.evaluate_all()
+    return time() - t
+
+
+def run_workload(name, opt):
+    """Run the workload name and return its metrics."""
+    generate, setup = WORKLOADS[name]
+    reset_timers()
+    MemoryTracker.reset_all()
+    result = {}
+    t = time()
+    mesh = generate(opt['size'], opt['unstructured'], opt['seed'])
+    result['mesh'] = time() - t
+    t = time()
+    step = setup(mesh, opt)
+    _trace.evaluate_all()
+    result['setup'] = time() - t
+    result['first'] = evaluate(step)
+    times = sorted(evaluate(step) for _ in range(opt['iterations']))
+    result['iteration'] = times[len(times) // 2]
+    result['min'] = times[0]
+    timers = get_timers()
+    for metric, names in TIMERS.items():
+        result[metric] = sum(timers[n].total for n in names if n in timers)
+    result['memory'] = MemoryTracker.peak() / 1e6
+    # ru_maxrss is in kilobytes on Linux
+    result['rss'] = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1e3
+    # Workloads redeclare Consts of the same name with a different shape
+    for c in Const._definitions():
+        c.remove_from_namespace()
+    return result
+
+
+def run(opt):
+    """Run the workloads on the backend selected in opt and return the
+    backend and the metrics of each workload."""
+    op2.init(**dict((k, opt[k]) for k in ('backend', 'debug', 'log_level') if k in opt))
+    return configuration['backend'], dict((w, run_workload(w, opt))
+                                          for w in opt['workloads'])
+
+
+def spawn(backend, opt):
+    """Run the workloads on backend in a separate process and return the
+    metrics of each workload."""
+    fd, filename = tempfile.mkstemp(suffix='.json')
+    os.close(fd)
+    cmd = [sys.executable, os.path.abspath(__file__), '-b', backend,
+           '-l', opt['log_level'], '-s', str(opt['size']),
+           '--layers', str(opt['layers']), '--seed', str(opt['seed']),
+           '-i', str(opt['iterations']), '-o', filename, '-q',
+           '-w'] + opt['workloads']
+    if opt['unstructured']:
+        cmd.append('-u')
+    try:
+        subprocess.check_call(cmd)
+        with open(filename) as f:
+            return json.load(f)['results'][backend]
+    finally:
+        os.remove(filename)
+
+
+def compare(results, baseline, opt):
+    """Compare the gated metrics of results to baseline. Returns rows of
+    backend, workload, metric, baseline, result, relative change and
+    whether it is a regression, and whether any metric regressed."""
+    rows = []
+    for backend in sorted(results):
+        for name in sorted(results[backend]):
+            base = baseline['results'].get(backend, {}).get(name)
+            if base is None:
+                continue
+            for metric in opt['gate']:
+                old, new = base[metric], results[backend][name][metric]
+                floor = 0.0 if metric in MEMORY else opt['min_time']
+                regressed = new - old > max(opt['tolerance'] * old, floor)
+                change = '%+.1f%%' % (100.0 * (new - old) / old) if old else '-'
+                rows.append((backend, name, metric, old, new, change,
+                             'REGRESSION' if regressed else ''))
+    return rows, any(row[-1] for row in rows)
+
+
+def main():
+    opt = vars(parser.parse_args())
+    if opt['save'] and not opt['baseline']:
+        parser.error("--save requires --baseline")
+    if opt['iterations'] < 1:
+        parser.error("--iterations must be at least 1")
+    config = dict((k, opt[k]) for k in CONFIG)
+    config['host'] = platform.node()
+    if opt['backends']:
+        results = dict((b, spawn(b, opt)) for b in opt['backends'])
+    else:
+        backend, metrics = run(opt)
+        results = {backend: metrics}
+    data = {'config': config, 'results': results}
+
+    if not opt['quiet']:
+        write_table(('Backend', 'Workload') + COLUMNS,
+                    [(b, w) + tuple(results[b][w][m] for m in METRICS)
+                     for b in sorted(results) for w in opt['workloads']])
+    if opt['output']:
+        with open(opt['output'], 'w') as f:
+            json.dump(data, f, indent=1, sort_keys=True)
+    if not opt['baseline']:
+        return
+    if opt['save']:
+        with open(opt['baseline'], 'w') as f:
+            json.dump(data, f, indent=1, sort_keys=True)
+        return
+
+    with open(opt['baseline']) as f:
+        baseline = json.load(f)
+    for k in CONFIG:
+        if baseline['config'][k] != config[k]:
+            parser.error("baseline was run with %s %s, not %s"
+                         % (k, baseline['config'][k], config[k]))
+    if baseline['config']['host'] != config['host']:
+        print("Warning: baseline was run on %s" % baseline['config']['host'])
+    rows, regressed = compare(results, baseline, opt)
+    print()
+    write_table(('Backend', 'Workload', 'Metric', 'Baseline', 'Result', 'Change', ''), rows)
+    sys.exit(1 if regressed else 0)
+
+
+if __name__ == '__main__':
+    main()
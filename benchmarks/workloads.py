@@ -0,0 +1,411 @@
+# This file is part of PyOP2
+#
+# PyOP2 is Copyright (c) 2012, Imperial College London and
+# others. Please see the AUTHORS file in the main source directory for
+# a full list of copyright holders.  All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions
+# are met:
+#
+#     * Redistributions of source code must retain the above copyright
+#       notice, this list of conditions and the following disclaimer.
+#     * Redistributions in binary form must reproduce the above copyright
+#       notice, this list of conditions and the following disclaimer in the
+#       documentation and/or other materials provided with the distribution.
+#     * The name of Imperial College London or that of other
+#       contributors may not be used to endorse or promote products
+#       derived from this software without specific prior written
+#       permission.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTERS
+# ''AS IS'' AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT
+# LIMITED TO, THE IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS
+# FOR A PARTICULAR PURPOSE ARE DISCLAIMED. IN NO EVENT SHALL THE
+# COPYRIGHT HOLDERS OR CONTRIBUTORS BE LIABLE FOR ANY DIRECT,
+# INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES
+# (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR
+# SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION)
+# HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT,
+# STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE)
+# ARISING IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED
+# OF THE POSSIBILITY OF SUCH DAMAGE.
+
+
+"""Workloads of the PyOP2 benchmark suite
+
+Each workload declares the sets, maps and data of a demo on a mesh from
+:mod:`meshes` and returns a function which enqueues one iteration of the
+demo's main loop.  The kernels are those of the demos.  Workloads must be
+set up after :func:`pyop2.op2.init`.
+"""
+
+from collections import OrderedDict
+from math import atan, sqrt
+import os
+import sys
+
+import numpy as np
+
+from pyop2 import op2
+
+import meshes
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                                os.pardir, 'demo'))
+
+# Number of conjugate gradient iterations per iteration of the aero workload
+CG_ITERATIONS = 10
+
+
+def airfoil(mesh, opt):
+    """Non-linear 2D inviscid airfoil code of the airfoil demo: one
+    iteration saves the flow solution and takes a predictor and a corrector
+    step."""
+    from airfoil_kernels import save_soln, adt_calc, res_calc, bres_calc, update
+
+    nodes = op2.Set(len(mesh.x), "nodes")
+    edges = op2.Set(len(mesh.edges), "edges")
+    bedges = op2.Set(len(mesh.bedges), "bedges")
+    cells = op2.Set(len(mesh.cells), "cells")
+
+    pedge = op2.Map(edges, nodes, 2, mesh.edges, "pedge")
+    pecell = op2.Map(edges, cells, 2, mesh.ecells, "pecell")
+    pbedge = op2.Map(bedges, nodes, 2, mesh.bedges, "pbedge")
+    pbecell = op2.Map(bedges, cells, 1, mesh.becells, "pbecell")
+    pcell = op2.Map(cells, nodes, 4, mesh.cells, "pcell")
+
+    gam, mach = 1.4, 0.4
+    gm1 = gam - 1.0
+    p, r = 1.0, 1.0
+    u = sqrt(gam * p / r) * mach
+    e = p / (r * gm1) + 0.5 * u * u
+    qinf = [r, r * u, 0.0, r * e]
+    op2.Const(1, gam, "gam", dtype=np.double)
+    op2.Const(1, gm1, "gm1", dtype=np.double)
+    op2.Const(1, 0.9, "cfl", dtype=np.double)
+    op2.Const(1, 0.05, "eps", dtype=np.double)
+    op2.Const(1, mach, "mach", dtype=np.double)
+    op2.Const(1, 3.0 * atan(1.0) / 45.0, "alpha", dtype=np.double)
+    op2.Const(4, qinf, "qinf", dtype=np.double)
+
+    p_bound = op2.Dat(bedges, mesh.bound, np.int32, "p_bound")
+    p_x = op2.Dat(nodes ** 2, mesh.x, np.double, "p_x")
+    p_q = op2.Dat(cells ** 4, np.tile(qinf, (cells.size, 1)), np.double, "p_q")
+    p_qold = op2.Dat(cells ** 4, dtype=np.double, name="p_qold")
+    p_adt = op2.Dat(cells, dtype=np.double, name="p_adt")
+    p_res = op2.Dat(cells ** 4, dtype=np.double, name="p_res")
+
+    def step():
+        op2.par_loop(save_soln, cells,
+                     p_q(op2.READ),
+                     p_qold(op2.WRITE))
+        for k in range(2):
+            op2.par_loop(adt_calc, cells,
+                         p_x(op2.READ, pcell[0]),
+                         p_x(op2.READ, pcell[1]),
+                         p_x(op2.READ, pcell[2]),
+                         p_x(op2.READ, pcell[3]),
+                         p_q(op2.READ),
+                         p_adt(op2.WRITE))
+            op2.par_loop(res_calc, edges,
+                         p_x(op2.READ, pedge[0]),
+                         p_x(op2.READ, pedge[1]),
+                         p_q(op2.READ, pecell[0]),
+                         p_q(op2.READ, pecell[1]),
+                         p_adt(op2.READ, pecell[0]),
+                         p_adt(op2.READ, pecell[1]),
+                         p_res(op2.INC, pecell[0]),
+                         p_res(op2.INC, pecell[1]))
+            op2.par_loop(bres_calc, bedges,
+                         p_x(op2.READ, pbedge[0]),
+                         p_x(op2.READ, pbedge[1]),
+                         p_q(op2.READ, pbecell[0]),
+                         p_adt(op2.READ, pbecell[0]),
+                         p_res(op2.INC, pbecell[0]),
+                         p_bound(op2.READ))
+            rms = op2.Global(1, 0.0, np.double, "rms")
+            op2.par_loop(update, cells,
+                         p_qold(op2.READ),
+                         p_q(op2.WRITE),
+                         p_res(op2.RW),
+                         p_adt(op2.READ),
+                         rms(op2.INC))
+    return step
+
+
+def aero(mesh, opt):
+    """Non-linear 2D potential flow solver of the aero demo: one iteration
+    assembles the residual and element stiffness matrices and solves the
+    linearised problem with :data:`CG_ITERATIONS` conjugate gradient
+    iterations.
+
+    The demo applies the stiffness matrix element by element, the workload
+    also builds the :class:`~pyop2.Sparsity` an assembled matrix would need
+    to account for its setup cost."""
+    from aero_kernels import dirichlet, dotPV, dotR, init_cg, res_calc, spMV, \
+        update, updateP, updateUR
+
+    nodes = op2.Set(len(mesh.x), "nodes")
+    bnodes = op2.Set(len(mesh.bnodes), "bnodes")
+    cells = op2.Set(len(mesh.cells), "cells")
+
+    pbnodes = op2.Map(bnodes, nodes, 1, mesh.bnodes, "pbnodes")
+    # The shape functions number the vertices of the reference square
+    # lexicographically rather than counter-clockwise
+    pcell = op2.Map(cells, nodes, 4, mesh.cells[:, [0, 1, 3, 2]], "pcell")
+    op2.Sparsity((nodes, nodes), (pcell, pcell), "stiffness")
+
+    x, y = mesh.x[:, 0], mesh.x[:, 1]
+    p_xm = op2.Dat(nodes ** 2, mesh.x, np.double, "p_x")
+    p_phim = op2.Dat(nodes, x + 0.1 * np.sin(np.pi * x) * np.sin(np.pi * y),
+                     np.double, "p_phim")
+    p_resm = op2.Dat(nodes, dtype=np.double, name="p_resm")
+    p_K = op2.Dat(cells ** 16, dtype=np.double, name="p_K")
+    p_V = op2.Dat(nodes, dtype=np.double, name="p_V")
+    p_P = op2.Dat(nodes, dtype=np.double, name="p_P")
+    p_U = op2.Dat(nodes, dtype=np.double, name="p_U")
+
+    gam = 1.4
+    gm1 = op2.Const(1, gam - 1.0, 'gm1', dtype=np.double)
+    op2.Const(1, 1.0 / gm1.data, 'gm1i', dtype=np.double)
+    op2.Const(2, [0.5, 0.5], 'wtg1', dtype=np.double)
+    op2.Const(2, [0.211324865405187, 0.788675134594813], 'xi1',
+              dtype=np.double)
+    op2.Const(4, [0.788675134594813, 0.211324865405187,
+                  0.211324865405187, 0.788675134594813],
+              'Ng1', dtype=np.double)
+    op2.Const(4, [-1, -1, 1, 1], 'Ng1_xi', dtype=np.double)
+    op2.Const(4, [0.25] * 4, 'wtg2', dtype=np.double)
+    op2.Const(16, [0.622008467928146, 0.166666666666667,
+                   0.166666666666667, 0.044658198738520,
+                   0.166666666666667, 0.622008467928146,
+                   0.044658198738520, 0.166666666666667,
+                   0.166666666666667, 0.044658198738520,
+                   0.622008467928146, 0.166666666666667,
+                   0.044658198738520, 0.166666666666667,
+                   0.166666666666667, 0.622008467928146],
+              'Ng2', dtype=np.double)
+    op2.Const(32, [-0.788675134594813, 0.788675134594813,
+                   -0.211324865405187, 0.211324865405187,
+                   -0.788675134594813, 0.788675134594813,
+                   -0.211324865405187, 0.211324865405187,
+                   -0.211324865405187, 0.211324865405187,
+                   -0.788675134594813, 0.788675134594813,
+                   -0.211324865405187, 0.211324865405187,
+                   -0.788675134594813, 0.788675134594813,
+                   -0.788675134594813, -0.211324865405187,
+                   0.788675134594813, 0.211324865405187,
+                   -0.211324865405187, -0.788675134594813,
+                   0.211324865405187, 0.788675134594813,
+                   -0.788675134594813, -0.211324865405187,
+                   0.788675134594813, 0.211324865405187,
+                   -0.211324865405187, -0.788675134594813,
+                   0.211324865405187, 0.788675134594813],
+              'Ng2_xi', dtype=np.double)
+    minf = op2.Const(1, 0.1, 'minf', dtype=np.double)
+    op2.Const(1, minf.data ** 2, 'm2', dtype=np.double)
+    op2.Const(1, 1, 'freq', dtype=np.double)
+    op2.Const(1, 1, 'kappa', dtype=np.double)
+    op2.Const(1, 0, 'nmode', dtype=np.double)
+    op2.Const(1, 1.0, 'mfan', dtype=np.double)
+
+    def step():
+        op2.par_loop(res_calc, cells,
+                     p_xm(op2.READ, pcell),
+                     p_phim(op2.READ, pcell),
+                     p_K(op2.WRITE),
+                     p_resm(op2.INC, pcell))
+        op2.par_loop(dirichlet, bnodes,
+                     p_resm(op2.WRITE, pbnodes[0]))
+        c1 = op2.Global(1, data=0.0, name='c1')
+        op2.par_loop(init_cg, nodes,
+                     p_resm(op2.READ),
+                     c1(op2.INC),
+                     p_U(op2.WRITE),
+                     p_V(op2.WRITE),
+                     p_P(op2.WRITE))
+        for _ in range(CG_ITERATIONS):
+            op2.par_loop(spMV, cells,
+                         p_V(op2.INC, pcell),
+                         p_K(op2.READ),
+                         p_P(op2.READ, pcell))
+            op2.par_loop(dirichlet, bnodes,
+                         p_V(op2.WRITE, pbnodes[0]))
+            c2 = op2.Global(1, data=0.0, name='c2')
+            op2.par_loop(dotPV, nodes,
+                         p_P(op2.READ),
+                         p_V(op2.READ),
+                         c2(op2.INC))
+            # The search direction vanishes once the residual does
+            if c2.data[0] == 0.0:
+                break
+            alpha = op2.Global(1, data=c1.data / c2.data, name='alpha')
+            op2.par_loop(updateUR, nodes,
+                         p_U(op2.INC),
+                         p_resm(op2.INC),
+                         p_P(op2.READ),
+                         p_V(op2.RW),
+                         alpha(op2.READ))
+            c3 = op2.Global(1, data=0.0, name='c3')
+            op2.par_loop(dotR, nodes,
+                         p_resm(op2.READ),
+                         c3(op2.INC))
+            beta = op2.Global(1, data=c3.data / c1.data, name="beta")
+            op2.par_loop(updateP, nodes,
+                         p_resm(op2.READ),
+                         p_P(op2.RW),
+                         beta(op2.READ))
+            c1.data = c3.data
+        rms = op2.Global(1, data=0.0, name='rms')
+        op2.par_loop(update, nodes,
+                     p_phim(op2.RW),
+                     p_resm(op2.WRITE),
+                     p_U(op2.READ),
+                     rms(op2.INC))
+    return step
+
+
+jacobi_res = """void res(double *A, double *u, double *du, const double *beta){
+  *du += (*beta)*(*A)*(*u);
+}"""
+
+jacobi_update = """
+void update(double *r, double *du, double *u, double *u_sum, double *u_max) {
+  *u += *du + alpha * (*r);
+  *du = 0.0;
+  *u_sum += (*u)*(*u);
+  *u_max = *u_max > *u ? *u_max : *u;
+}"""
+
+
+def jacobi(mesh, opt):
+    """Jacobi iteration for the 5-point Laplacian of the jacobi demo: one
+    iteration computes and applies an update."""
+    nodes = op2.Set(mesh.nodes, "nodes")
+    edges = op2.Set(len(mesh.edges), "edges")
+
+    ppedge = op2.Map(edges, nodes, 2, mesh.edges, "ppedge")
+
+    p_A = op2.Dat(edges, data=mesh.A, name="p_A")
+    p_r = op2.Dat(nodes, data=mesh.r, name="p_r")
+    p_u = op2.Dat(nodes, dtype=np.double, name="p_u")
+    p_du = op2.Dat(nodes, dtype=np.double, name="p_du")
+
+    op2.Const(1, data=1.0, name="alpha", dtype=np.double)
+    beta = op2.Global(1, data=1.0, name="beta", dtype=np.double)
+
+    res = op2.Kernel(jacobi_res, "res")
+    update = op2.Kernel(jacobi_update, "update")
+
+    def step():
+        op2.par_loop(res, edges,
+                     p_A(op2.READ),
+                     p_u(op2.READ, ppedge[1]),
+                     p_du(op2.INC, ppedge[0]),
+                     beta(op2.READ))
+        u_sum = op2.Global(1, data=0.0, name="u_sum", dtype=np.double)
+        u_max = op2.Global(1, data=0.0, name="u_max", dtype=np.double)
+        op2.par_loop(update, nodes,
+                     p_r(op2.READ),
+                     p_du(op2.RW),
+                     p_u(op2.INC),
+                     u_sum(op2.INC),
+                     u_max(op2.MAX))
+    return step
+
+
+comp_vol_ro = """
+void comp_vol(double A[1], double *x[], double *y[])
+{
+  double area = x[0][0]*(x[2][1]-x[4][1]) + x[2][0]*(x[4][1]-x[0][1])
+               + x[4][0]*(x[0][1]-x[2][1]);
+  if (area < 0)
+    area = area * (-1.0);
+  A[0]+=0.5*area*0.1 * y[0][0];
+}"""
+
+comp_vol_rw = """
+void comp_vol(double A[1], double *x[], double *y[], double *z[])
+{
+  double area = x[0][0]*(x[2][1]-x[4][1]) + x[2][0]*(x[4][1]-x[0][1])
+               + x[4][0]*(x[0][1]-x[2][1]);
+  if (area < 0)
+    area = area * (-1.0);
+  A[0]+=0.5*area*0.1 * y[0][0];
+
+  z[0][0]+=0.2*(0.5*area*0.1*y[0][0]);
+  z[1][0]+=0.2*(0.5*area*0.1*y[0][0]);
+  z[2][0]+=0.2*(0.5*area*0.1*y[0][0]);
+  z[3][0]+=0.2*(0.5*area*0.1*y[0][0]);
+  z[4][0]+=0.2*(0.5*area*0.1*y[0][0]);
+  z[5][0]+=0.2*(0.5*area*0.1*y[0][0]);
+}"""
+
+
+def _extrude(mesh, layers):
+    """Extrude the triangle mesh by ``layers`` layers, with the vertices of
+    a column numbered consecutively.  Returns the extruded cells, the
+    vertex numbers of the prisms of the bottom layer, the coordinates, the
+    field on the prisms and their maps."""
+    elements = op2.ExtrudedSet(op2.Set(len(mesh.cells), "elements"), layers=layers)
+    bottom = mesh.cells * layers
+    prisms = np.dstack((bottom, bottom + 1)).reshape(-1, 6)
+
+    coords_dofsSet = op2.Set(len(mesh.x) * layers, "coords_dofsSet")
+    coords = op2.Dat(coords_dofsSet ** 2, np.repeat(mesh.x, layers, axis=0),
+                     np.float64, "coords")
+    wedges_dofsSet = op2.Set(len(mesh.cells) * (layers - 1), "wedges_dofsSet")
+    field = op2.Dat(wedges_dofsSet, np.ones(wedges_dofsSet.size), np.float64, "field")
+
+    elem_dofs = op2.Map(elements, coords_dofsSet, 6, prisms, "elem_dofs",
+                        np.ones(6, dtype=np.int32))
+    elem_elem = op2.Map(elements, wedges_dofsSet, 1,
+                        np.arange(len(mesh.cells)) * (layers - 1), "elem_elem",
+                        np.ones(1, dtype=np.int32))
+    return elements, prisms, coords, field, elem_dofs, elem_elem
+
+
+def extrusion_ro(mesh, opt):
+    """Volume of the extruded mesh of the extrusion_mp_ro demo: one
+    iteration integrates a field over the prisms."""
+    elements, _, coords, field, elem_dofs, elem_elem = _extrude(mesh, opt['layers'])
+    mass = op2.Kernel(comp_vol_ro, "comp_vol")
+    g = op2.Global(1, data=0.0, name='g')
+
+    def step():
+        op2.par_loop(mass, elements,
+                     g(op2.INC),
+                     coords(op2.READ, elem_dofs),
+                     field(op2.READ, elem_elem))
+    return step
+
+
+def extrusion_rw(mesh, opt):
+    """Volume of the extruded mesh of the extrusion_mp_rw demo: one
+    iteration integrates a field over the prisms and increments a field on
+    their vertices."""
+    layers = opt['layers']
+    elements, prisms, coords, field, elem_dofs, elem_elem = _extrude(mesh, layers)
+    p1_dofsSet = op2.Set(len(mesh.x) * layers, "p1_dofsSet")
+    res = op2.Dat(p1_dofsSet, np.zeros(p1_dofsSet.size), np.float64, "res")
+    elem_p1_dofs = op2.Map(elements, p1_dofsSet, 6, prisms, "elem_p1_dofs",
+                           np.ones(6, dtype=np.int32))
+    mass = op2.Kernel(comp_vol_rw, "comp_vol")
+    g = op2.Global(1, data=0.0, name='g')
+
+    def step():
+        op2.par_loop(mass, elements,
+                     g(op2.INC),
+                     coords(op2.READ, elem_dofs),
+                     field(op2.READ, elem_elem),
+                     res(op2.INC, elem_p1_dofs))
+    return step
+
+
+# Workloads by name, with the mesh generator each runs on
+WORKLOADS = OrderedDict([('airfoil', (meshes.quadrilaterals, airfoil)),
+                         ('aero', (meshes.quadrilaterals, aero)),
+                         ('jacobi', (meshes.grid_graph, jacobi)),
+                         ('extrusion_ro', (meshes.triangles, extrusion_ro)),
+                         ('extrusion_rw', (meshes.triangles, extrusion_rw))])
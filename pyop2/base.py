@@ -36,6 +36,8 @@ information which is backend independent. Individual runtime backends should
 subclass these as required to implement backend-specific features.
 """
 
+import os
+from time import time
 import weakref
 import numpy as np
 import operator
@@ -43,14 +45,15 @@ import types
 from hashlib import md5
 
 from configuration import configuration
-from caching import Cached, ObjectCached
+from caching import Cached, ObjectCached, CacheStats
 from versioning import Versioned, modifies, modifies_argn, CopyOnWrite, \
     shallow_copy, zeroes
 from exceptions import *
 from utils import *
 from backends import _make_object
 from mpi import MPI, _MPI, _check_comm, collective
-from profiling import profile, timed_region, timed_function
+from profiling import profile, timed_region, timed_function, traced, \
+    LoopCounter, MemoryTracker, Tracer
 from sparsity import build_sparsity
 from version import __version__ as version
 
@@ -76,6 +79,11 @@ class LazyComputation(object):
     def _run(self):
         assert False, "Not implemented"
 
+    @property
+    def _trace_name(self):
+        """Name of this computation in a trace of runtime events."""
+        return self.__class__.__name__
+
 
 class ExecutionTrace(object):
 
@@ -93,6 +101,8 @@ class ExecutionTrace(object):
             self.evaluate(computation.reads, computation.writes)
             computation._run()
         else:
+            if configuration['trace_file']:
+                Tracer.instant(computation._trace_name, 'enqueue')
             self._trace.append(computation)
 
     def in_queue(self, computation):
@@ -106,8 +116,11 @@ class ExecutionTrace(object):
 
     def evaluate_all(self):
         """Forces the evaluation of all delayed computations."""
-        for comp in self._trace:
-            comp._run()
+        if not self._trace:
+            return
+        with timed_region("Trace evaluation"):
+            for comp in self._trace:
+                comp._run()
         self._trace = list()
 
     def evaluate(self, reads=None, writes=None):
@@ -148,12 +161,15 @@ class ExecutionTrace(object):
             else:
                 comp._scheduled = False
 
+        if not any(comp._scheduled for comp in self._trace):
+            return
         new_trace = list()
-        for comp in self._trace:
-            if comp._scheduled:
-                comp._run()
-            else:
-                new_trace.append(comp)
+        with timed_region("Trace evaluation"):
+            for comp in self._trace:
+                if comp._scheduled:
+                    comp._run()
+                else:
+                    new_trace.append(comp)
         self._trace = new_trace
 
 
@@ -407,6 +423,10 @@ class Arg(object):
     def _is_mixed_dat(self):
         return isinstance(self._dat, MixedDat)
 
+    @property
+    def _is_mixed_precision(self):
+        return self._is_dat and self._dat._is_mixed_precision
+
     @property
     def _is_mixed(self):
         return self._is_mixed_dat or self._is_mixed_mat
@@ -1271,11 +1291,11 @@ class Halo(object):
         if reverse:
             sends, receives = receives, sends
         for dest, ele in sends.iteritems():
-            dat._send_buf[dest] = dat._data[ele]
+            dat._send_buf[dest] = MemoryTracker.track("Halo buffers", dat._data[ele])
             dat._send_reqs[dest] = self.comm.Isend(dat._send_buf[dest],
                                                    dest=dest, tag=dat._id)
         for source, ele in receives.iteritems():
-            dat._recv_buf[source] = dat._data[ele]
+            dat._recv_buf[source] = MemoryTracker.track("Halo buffers", dat._data[ele])
             dat._recv_reqs[source] = self.comm.Irecv(dat._recv_buf[source],
                                                      source=source, tag=dat._id)
 
@@ -1511,24 +1531,25 @@ class DataCarrier(Versioned):
         """The Python type of the data."""
         return self._data.dtype
 
+    # FIXME: Complex and float16 not supported
+    _ctypes = {"bool": "unsigned char",
+               "int": "int",
+               "int8": "char",
+               "int16": "short",
+               "int32": "int",
+               "int64": "long long",
+               "uint8": "unsigned char",
+               "uint16": "unsigned short",
+               "uint32": "unsigned int",
+               "uint64": "unsigned long",
+               "float": "double",
+               "float32": "float",
+               "float64": "double"}
+
     @property
     def ctype(self):
         """The c type of the data."""
-        # FIXME: Complex and float16 not supported
-        typemap = {"bool": "unsigned char",
-                   "int": "int",
-                   "int8": "char",
-                   "int16": "short",
-                   "int32": "int",
-                   "int64": "long long",
-                   "uint8": "unsigned char",
-                   "uint16": "unsigned short",
-                   "uint32": "unsigned int",
-                   "uint64": "unsigned long",
-                   "float": "double",
-                   "float32": "float",
-                   "float64": "double"}
-        return typemap[self.dtype.name]
+        return self._ctypes[self.dtype.name]
 
     @property
     def name(self):
@@ -1564,8 +1585,13 @@ class _EmptyDataMixin(object):
     in.
 
     Accessing the :attr:`_data` property allocates a zeroed data array
-    if it does not already exist.
+    if it does not already exist. Data buffers are accounted for by the
+    :class:`~pyop2.profiling.MemoryTracker` under the class's
+    ``_memory_category``.
     """
+
+    _memory_category = None
+
     def __init__(self, data, dtype, shape):
         if data is None:
             self._dtype = np.dtype(dtype if dtype is not None else np.float64)
@@ -1579,12 +1605,16 @@ class _EmptyDataMixin(object):
         """Return the user-provided data buffer, or a zeroed buffer of
         the correct size if none was provided."""
         if not self._is_allocated:
-            self._numpy_data = np.zeros(self.shape, dtype=self._dtype)
+            self._numpy_data = MemoryTracker.track(
+                self._memory_category,
+                np.zeros(self.shape, dtype=self._dtype, order=self._order))
         return self._numpy_data
 
     @_data.setter
     def _data(self, value):
         """Set the data buffer to `value`."""
+        if isinstance(value, np.ndarray):
+            MemoryTracker.track(self._memory_category, value)
         self._numpy_data = value
 
     @property
@@ -1592,6 +1622,81 @@ class _EmptyDataMixin(object):
         """Return True if the data buffer has been allocated."""
         return hasattr(self, '_numpy_data')
 
+    @property
+    def _order(self):
+        """Memory layout of the data buffer allocated on demand."""
+        return 'C'
+
+
+class DataPool(object):
+    """A pool of host data buffers for temporary :class:`Dat`\s, keyed by
+    :class:`DataSet` and dtype.
+
+    The storage of a :class:`Dat` taken from the pool is returned to it
+    once the :class:`Dat` and all views of its data are collected, and
+    reused for the next temporary on the same :class:`DataSet` with the
+    same dtype. At most ``configuration['dat_pool_max_bytes']`` are held
+    by the pool.
+
+    :attr:`hits`, :attr:`misses` and :attr:`bytes_saved` count the
+    requests served from the pool, those needing a new allocation and
+    the number of bytes not allocated thanks to the pool."""
+
+    def __init__(self):
+        self._free = {}
+        # Weak references to the arrays handed out, keyed by id
+        self._used = {}
+        self.nbytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.bytes_saved = 0
+
+    def acquire(self, dataset, dtype, shape, zero=True):
+        """Return an array of ``shape`` for a :class:`Dat` on ``dataset``
+        with ``dtype``, zeroed if ``zero`` is set. Its buffer is returned
+        to the pool once the array and all views of it are collected."""
+        free = self._free.get((dataset, dtype))
+        if free:
+            buf = free.pop()
+            self.nbytes -= len(buf)
+            self.hits += 1
+            self.bytes_saved += len(buf)
+        else:
+            self.misses += 1
+            # A new bytearray is zeroed
+            buf = bytearray(int(np.prod(shape)) * np.dtype(dtype).itemsize)
+            zero = False
+        # The base of this array is not an array, hence all views of it
+        # reference this array rather than its base: once it is
+        # collected, no views of buf are left
+        data = np.frombuffer(buf, dtype=dtype)
+        if zero:
+            data.fill(0)
+
+        key = id(data)
+
+        def release(ref):
+            del self._used[key]
+            self.release(dataset, dtype, buf)
+        self._used[key] = weakref.ref(data, release)
+        return MemoryTracker.track("Dat", data).reshape(shape)
+
+    def release(self, dataset, dtype, buf):
+        """Return the buffer ``buf`` to the pool, if there is room for it."""
+        if self.nbytes + len(buf) > configuration['dat_pool_max_bytes']:
+            return
+        self._free.setdefault((dataset, dtype), []).append(buf)
+        self.nbytes += len(buf)
+
+    def clear(self):
+        """Drop all buffers held by the pool."""
+        self._free = {}
+        self.nbytes = 0
+
+
+dat_pool = DataPool()
+"""The :class:`DataPool` for temporary :class:`Dat`\s."""
+
 
 class SetAssociated(DataCarrier):
     """Intermediate class between DataCarrier and subtypes associated with a
@@ -1644,23 +1749,63 @@ class Dat(SetAssociated, _EmptyDataMixin, CopyOnWrite):
     :class:`Map`. Direct access to a Dat is accomplished by
     omitting the path argument.
 
+    A :class:`Dat` created with ``soa=True`` stores its data in
+    structure-of-arrays (SoA) order: each component is contiguous over the
+    set elements.  As on the device backends, kernels index the components
+    of direct arguments of such a :class:`Dat` with ``OP2_STRIDE(x, j)``
+    rather than ``x[j]``, and see the data of each element of indirect
+    arguments contiguously.  With ``soa="auto"`` the layout is chosen per
+    :class:`Dat` and kernels always see the data of each element
+    contiguously: SoA on the host backends if
+    ``configuration["soa_min_cdim"]`` is positive and the :class:`Dat` has
+    at least that many components per element, AoS otherwise.
+
     :class:`Dat` objects support the pointwise linear algebra operations
     ``+=``, ``*=``, ``-=``, ``/=``, where ``*=`` and ``/=`` also support
     multiplication / division by a scalar.
+
+    The data may be stored with a lower precision than that in which
+    kernels compute with them: if ``compute_dtype`` (by default the
+    ``dtype``) differs from the storage ``dtype``, kernels are passed the
+    data converted to ``compute_dtype``, and their results are converted
+    back to ``dtype``.  Both must be floating point types, and this is
+    only supported on the host backends. For instance ::
+
+      D = op2.Dat(nodes, dtype=np.float32, compute_dtype=np.float64)
+
+    halves the memory footprint of ``D`` relative to double precision
+    storage, while kernels accessing ``D`` still see ``double`` data.
     """
 
     _globalcount = 0
     _modes = [READ, WRITE, RW, INC]
+    # Can pointwise linear algebra act on the host data directly?
+    _host_linalg = False
+    # Are the host data of Dats created with soa=True in SoA order?
+    _host_soa = False
+    _memory_category = "Dat"
+    _host_ops = {operator.add: np.add,
+                 operator.sub: np.subtract,
+                 operator.mul: np.multiply,
+                 operator.div: np.divide,
+                 operator.iadd: np.add,
+                 operator.isub: np.subtract,
+                 operator.imul: np.multiply,
+                 operator.idiv: np.divide}
 
     @validate_type(('dataset', (DataCarrier, DataSet, Set), DataSetTypeError),
                    ('name', str, NameTypeError))
-    @validate_dtype(('dtype', None, DataTypeError))
+    @validate_dtype(('dtype', None, DataTypeError),
+                    ('compute_dtype', None, DataTypeError))
     def __init__(self, dataset, data=None, dtype=None, name=None,
-                 soa=None, uid=None):
+                 soa=None, uid=None, compute_dtype=None):
 
         if isinstance(dataset, Dat):
             self.__init__(dataset.dataset, None, dtype=dataset.dtype,
-                          name="copy_of_%s" % dataset.name, soa=dataset.soa)
+                          name="copy_of_%s" % dataset.name,
+                          soa=dataset.soa if dataset._op2_stride else "auto",
+                          compute_dtype=dataset.compute_dtype)
+            self._use_pool(zero=False)
             dataset.copy(self)
             return
         if type(dataset) is Set or type(dataset) is ExtrudedSet:
@@ -1669,10 +1814,24 @@ class Dat(SetAssociated, _EmptyDataMixin, CopyOnWrite):
             dataset = dataset ** 1
         self._shape = (dataset.total_size,) + (() if dataset.cdim == 1 else dataset.dim)
         _EmptyDataMixin.__init__(self, data, dtype, self._shape)
+        if compute_dtype is None:
+            self._compute_dtype = self._dtype
+        else:
+            self._compute_dtype = np.dtype(compute_dtype)
+            if self._compute_dtype != self._dtype and \
+                    not (self._dtype.kind == 'f' and self._compute_dtype.kind == 'f'):
+                raise DataTypeError("Storage dtype %s and compute dtype %s of a Dat must both be floating point if they differ"
+                                    % (self._dtype, self._compute_dtype))
 
         self._dataset = dataset
-        # Are these data to be treated as SoA on the device?
+        # Are these data to be treated as SoA?  Kernels index direct
+        # arguments through OP2_STRIDE unless the layout was left to PyOP2
+        self._op2_stride = soa != "auto" and bool(soa)
+        if soa == "auto":
+            soa = self._soa_heuristic(dataset)
         self._soa = bool(soa)
+        if self._soa_storage and self._is_allocated:
+            self._data = np.asfortranarray(self._numpy_data)
         self._needs_halo_update = False
         # If the uid is not passed in from outside, assume that Dats
         # have been declared in the same order everywhere.
@@ -1691,6 +1850,8 @@ class Dat(SetAssociated, _EmptyDataMixin, CopyOnWrite):
 
     @validate_in(('access', _modes, ModeValueError))
     def __call__(self, access, path=None, flatten=False):
+        if access is not READ and self._is_mapped_readonly:
+            raise ModeValueError("Dat %s is memory mapped read-only" % self.name)
         if isinstance(path, Arg):
             return _make_object('Arg', data=self, map=path.map, idx=path.idx,
                                 access=access, flatten=flatten)
@@ -1730,6 +1891,28 @@ class Dat(SetAssociated, _EmptyDataMixin, CopyOnWrite):
         """Are the data in SoA format?"""
         return self._soa
 
+    @classmethod
+    def _soa_heuristic(cls, dataset):
+        """Should a :class:`Dat` on ``dataset`` created with
+        ``soa="auto"`` be stored in SoA order?  Only where the layout is
+        transparent to kernels, i.e. on the host backends, and only for
+        at least ``configuration["soa_min_cdim"]`` components per
+        element.  Since kernels see the data of each element contiguously,
+        SoA data are staged for them, and this is disabled by default."""
+        min_cdim = configuration['soa_min_cdim']
+        return cls._host_soa and min_cdim > 0 and dataset.cdim >= min_cdim
+
+    @property
+    def _soa_storage(self):
+        """Are the host data stored in SoA order?"""
+        return self._soa and self._host_soa and self.cdim > 1
+
+    @property
+    def _order(self):
+        """Memory layout of the data buffer: SoA data are stored in
+        Fortran order, such that each component is contiguous."""
+        return 'F' if self._soa_storage else 'C'
+
     @property
     def _argtype(self):
         """Ctypes argtype for this :class:`Dat`"""
@@ -1752,6 +1935,8 @@ class Dat(SetAssociated, _EmptyDataMixin, CopyOnWrite):
         _trace.evaluate(set([self]), set([self]))
         if self.dataset.total_size > 0 and self._data.size == 0 and self.cdim > 0:
             raise RuntimeError("Illegal access: no data associated with this Dat!")
+        if self._is_mapped_readonly:
+            raise RuntimeError("Illegal access: Dat %s is memory mapped read-only, use data_ro" % self.name)
         maybe_setflags(self._data, write=True)
         v = self._data[:self.dataset.size].view()
         self.needs_halo_update = True
@@ -1820,9 +2005,13 @@ class Dat(SetAssociated, _EmptyDataMixin, CopyOnWrite):
         """Write the data array to file ``filename`` in NumPy format."""
         np.save(filename, self.data_ro)
 
-    def load(self, filename):
+    def load(self, filename, mmap_mode=None):
         """Read the data stored in file ``filename`` into a NumPy array
         and store the values in :meth:`_data`.
+
+        :arg mmap_mode: If ``'r'`` (read-only) or ``'c'`` (copy-on-write),
+            memory map the file as the storage of this :class:`Dat`
+            instead, see :meth:`fromfile`.
         """
         # The np.save method appends a .npy extension to the file name
         # if the user has not supplied it. However, np.load does not,
@@ -1830,6 +2019,9 @@ class Dat(SetAssociated, _EmptyDataMixin, CopyOnWrite):
         if(filename[-4:] != ".npy"):
             filename = filename + ".npy"
 
+        if mmap_mode is not None:
+            self._use_mapped_data(self._mmap(filename, mmap_mode))
+            return
         if isinstance(self.data, tuple):
             # MixedDat case
             for d, d_from_file in zip(self.data, np.load(filename)):
@@ -1845,6 +2037,21 @@ class Dat(SetAssociated, _EmptyDataMixin, CopyOnWrite):
     def dtype(self):
         return self._dtype
 
+    @property
+    def compute_dtype(self):
+        """The NumPy dtype kernels see the data of this :class:`Dat` as."""
+        return self._compute_dtype
+
+    @property
+    def compute_ctype(self):
+        """The c type kernels see the data of this :class:`Dat` as."""
+        return self._ctypes[self.compute_dtype.name]
+
+    @property
+    def _is_mixed_precision(self):
+        """Are the data stored with a different dtype than kernels see?"""
+        return self.dtype != self.compute_dtype
+
     @property
     def nbytes(self):
         """Return an estimate of the size of the data associated with this
@@ -1875,10 +2082,10 @@ class Dat(SetAssociated, _EmptyDataMixin, CopyOnWrite):
         """Zero the data associated with this :class:`Dat`"""
         if not hasattr(self, '_zero_kernel'):
             k = ast.FunDecl("void", "zero",
-                            [ast.Decl(self.ctype, ast.Symbol("*self"))],
+                            [ast.Decl(self.compute_ctype, ast.Symbol("*self"))],
                             body=ast.c_for("n", self.cdim,
                                            ast.Assign(ast.Symbol("self", ("n", )),
-                                                      ast.FlatBlock("(%s)0" % self.ctype)),
+                                                      ast.FlatBlock("(%s)0" % self.compute_ctype)),
                                            pragma=None))
             self._zero_kernel = _make_object('Kernel', k, 'zero')
         par_loop(self._zero_kernel, self.dataset.set, self(WRITE))
@@ -1898,9 +2105,9 @@ class Dat(SetAssociated, _EmptyDataMixin, CopyOnWrite):
         """Create the :class:`ParLoop` implementing copy."""
         if not hasattr(self, '_copy_kernel'):
             k = ast.FunDecl("void", "copy",
-                            [ast.Decl(self.ctype, ast.Symbol("*self"),
+                            [ast.Decl(self.compute_ctype, ast.Symbol("*self"),
                                       qualifiers=["const"]),
-                             ast.Decl(other.ctype, ast.Symbol("*other"))],
+                             ast.Decl(other.compute_ctype, ast.Symbol("*other"))],
                             body=ast.c_for("n", self.cdim,
                                            ast.Assign(ast.Symbol("other", ("n", )),
                                                       ast.Symbol("self", ("n", ))),
@@ -1987,21 +2194,94 @@ class Dat(SetAssociated, _EmptyDataMixin, CopyOnWrite):
             raise ValueError('Mismatched shapes in operands %s and %s' %
                              self.dataset.dim, other.dataset.dim)
 
+    class _HostLinearAlgebra(LazyComputation):
+        """Pointwise linear algebra on the data owned by :class:`Dat`\s,
+        computed with NumPy rather than a generated :func:`par_loop`.
+
+        Called lazily, like a :func:`par_loop`, in order to respect the
+        dependencies of the computation."""
+
+        def __init__(self, ufunc, operands, out):
+            reads = [o for o in operands if isinstance(o, Dat)]
+            super(Dat._HostLinearAlgebra, self).__init__(reads=reads, writes=[out])
+            self._ufunc = ufunc
+            self._operands = operands
+            self._out = out
+
+        def _run(self):
+            out = self._out
+            maybe_setflags(out._data, write=True)
+            self._ufunc(*[o._owned_data if isinstance(o, Dat) else o
+                          for o in self._operands], out=out._owned_data)
+            maybe_setflags(out._data, write=False)
+            out.needs_halo_update = True
+
+    def _use_pool(self, zero=True):
+        """Take the storage of this :class:`Dat`, which must not be
+        allocated yet, from the :data:`dat_pool` and return it to the pool
+        when this :class:`Dat` and all views of its data are collected.
+
+        :arg zero: Zero the storage. Only pass ``False`` if all entries
+            owned by this process are written before being read."""
+        if self._is_allocated or self.dataset.total_size == 0 or self._soa_storage:
+            return self
+        self._numpy_data = dat_pool.acquire(self.dataset, self.dtype, self.shape, zero)
+        if not zero:
+            # The storage holds the values of a previous Dat
+            self._version_bump()
+        return self
+
+    @collective
+    def _release_to_pool(self):
+        """Return the storage of this :class:`Dat` to the :data:`dat_pool`
+        right away, after any pending computation involving it, unless
+        views of its data are still referenced. The :class:`Dat` must not
+        be used afterwards."""
+        if not self._is_allocated:
+            return
+        _trace.evaluate(set([self]), set([self]))
+        del self._numpy_data
+        self.__dict__.pop('_vec', None)
+
+    @property
+    def _owned_data(self):
+        """A view of the data owned by this process, without evaluating
+        pending computation."""
+        return self._data[:self.dataset.size]
+
+    def _use_host_linalg(self, other=None):
+        """Is pointwise linear algebra on this :class:`Dat` and ``other``
+        (a scalar or :class:`Dat`) computed with NumPy? Data stored with a
+        lower precision than they are computed in are not, since NumPy
+        would compute in the storage precision."""
+        return configuration['host_linalg'] and self._host_linalg and \
+            self.dtype.kind == 'f' and self.compute_dtype == self.dtype and \
+            (np.isscalar(other) or other is None or
+             (isinstance(other, Dat) and other._host_linalg and
+              other.compute_dtype == other.dtype))
+
     def _op(self, other, op):
         ops = {operator.add: '+',
                operator.sub: '-',
                operator.mul: '*',
                operator.div: '/'}
-        ret = _make_object('Dat', self.dataset, None, self.dtype)
+        ret = _make_object('Dat', self.dataset, None, self.dtype,
+                           compute_dtype=self.compute_dtype)._use_pool(zero=False)
+        if self._use_host_linalg(other):
+            if not np.isscalar(other):
+                self._check_shape(other)
+            Dat._HostLinearAlgebra(self._host_ops[op], (self, other), ret).enqueue()
+            ret._version_bump()
+            return ret
         name = "binop_%s" % op.__name__
         if np.isscalar(other):
             other = _make_object('Global', 1, data=other)
             k = ast.FunDecl("void", name,
-                            [ast.Decl(self.ctype, ast.Symbol("*self"),
+                            [ast.Decl(self.compute_ctype, ast.Symbol("*self"),
                                       qualifiers=["const"]),
                              ast.Decl(other.ctype, ast.Symbol("*other"),
                                       qualifiers=["const"]),
-                             ast.Decl(self.ctype, ast.Symbol("*ret"))],
+                             ast.Decl(self.compute_ctype, ast.Symbol("*ret"))],
                             ast.c_for("n", self.cdim,
                                       ast.Assign(ast.Symbol("ret", ("n", )),
                                                  ast.BinExpr(ast.Symbol("self", ("n", )),
@@ -2013,11 +2293,11 @@ class Dat(SetAssociated, _EmptyDataMixin, CopyOnWrite):
         else:
             self._check_shape(other)
             k = ast.FunDecl("void", name,
-                            [ast.Decl(self.ctype, ast.Symbol("*self"),
+                            [ast.Decl(self.compute_ctype, ast.Symbol("*self"),
                                       qualifiers=["const"]),
-                             ast.Decl(other.ctype, ast.Symbol("*other"),
+                             ast.Decl(other.compute_ctype, ast.Symbol("*other"),
                                       qualifiers=["const"]),
-                             ast.Decl(self.ctype, ast.Symbol("*ret"))],
+                             ast.Decl(self.compute_ctype, ast.Symbol("*ret"))],
                             ast.c_for("n", self.cdim,
                                       ast.Assign(ast.Symbol("ret", ("n", )),
                                                  ast.BinExpr(ast.Symbol("self", ("n", )),
@@ -2035,11 +2315,16 @@ class Dat(SetAssociated, _EmptyDataMixin, CopyOnWrite):
                operator.isub: ast.Decr,
                operator.imul: ast.IMul,
                operator.idiv: ast.IDiv}
+        if self._use_host_linalg(other):
+            if not np.isscalar(other):
+                self._check_shape(other)
+            Dat._HostLinearAlgebra(self._host_ops[op], (self, other), self).enqueue()
+            return self
         name = "iop_%s" % op.__name__
         if np.isscalar(other):
             other = _make_object('Global', 1, data=other)
             k = ast.FunDecl("void", name,
-                            [ast.Decl(self.ctype, ast.Symbol("*self")),
+                            [ast.Decl(self.compute_ctype, ast.Symbol("*self")),
                              ast.Decl(other.ctype, ast.Symbol("*other"),
                                       qualifiers=["const"])],
                             ast.c_for("n", self.cdim,
@@ -2051,8 +2336,8 @@ class Dat(SetAssociated, _EmptyDataMixin, CopyOnWrite):
             self._check_shape(other)
             quals = ["const"] if self is not other else []
             k = ast.FunDecl("void", name,
-                            [ast.Decl(self.ctype, ast.Symbol("*self")),
-                             ast.Decl(other.ctype, ast.Symbol("*other"),
+                            [ast.Decl(self.compute_ctype, ast.Symbol("*self")),
+                             ast.Decl(other.compute_ctype, ast.Symbol("*other"),
                                       qualifiers=quals)],
                             ast.c_for("n", self.cdim,
                                       ops[op](ast.Symbol("self", ("n", )),
@@ -2063,10 +2348,14 @@ class Dat(SetAssociated, _EmptyDataMixin, CopyOnWrite):
         return self
 
     def _uop(self, op):
+        if self._use_host_linalg():
+            Dat._HostLinearAlgebra(np.negative, (self,), self).enqueue()
+            self._version_bump()
+            return self
         ops = {operator.sub: ast.Neg}
         name = "uop_%s" % op.__name__
         k = ast.FunDecl("void", name,
-                        [ast.Decl(self.ctype, ast.Symbol("*self"))],
+                        [ast.Decl(self.compute_ctype, ast.Symbol("*self"))],
                         ast.c_for("n", self.cdim,
                                   ast.Assign(ast.Symbol("self", ("n", )),
                                              ops[op](ast.Symbol("self", ("n", )))),
@@ -2083,14 +2372,16 @@ class Dat(SetAssociated, _EmptyDataMixin, CopyOnWrite):
 
         """
         self._check_shape(other)
-        ret = _make_object('Global', 1, data=0, dtype=self.dtype)
+        if self._use_host_linalg(other):
+            return MPI.comm.allreduce(self._inner_local(other), op=_MPI.SUM)
+        ret = _make_object('Global', 1, data=0, dtype=self.compute_dtype)
 
         k = ast.FunDecl("void", "inner",
-                        [ast.Decl(self.ctype, ast.Symbol("*self"),
+                        [ast.Decl(self.compute_ctype, ast.Symbol("*self"),
                                   qualifiers=["const"]),
-                         ast.Decl(other.ctype, ast.Symbol("*other"),
+                         ast.Decl(other.compute_ctype, ast.Symbol("*other"),
                                   qualifiers=["const"]),
-                         ast.Decl(self.ctype, ast.Symbol("*ret"))],
+                         ast.Decl(ret.ctype, ast.Symbol("*ret"))],
                         ast.c_for("n", self.cdim,
                                   ast.Incr(ast.Symbol("ret", (0, )),
                                            ast.Prod(ast.Symbol("self", ("n", )),
@@ -2100,6 +2391,103 @@ class Dat(SetAssociated, _EmptyDataMixin, CopyOnWrite):
         par_loop(k, self.dataset.set, self(READ), other(READ), ret(INC))
         return ret.data_ro[0]
 
+    def _inner_local(self, other):
+        """Compute the l2 inner product of the data owned by this process.
+        Data stored with a lower precision are accumulated in the compute
+        precision."""
+        _trace.evaluate(set([self, other]), set())
+        dtype = np.promote_types(self.compute_dtype, other.compute_dtype)
+        x, y = self._owned_data.reshape(-1), other._owned_data.reshape(-1)
+        return np.dot(x.astype(dtype, copy=False), y.astype(dtype, copy=False))
+
+    def _fused_operands(self, dats):
+        """Return the distinct :class:`Dat`\s other than this one in ``dats``
+        and the names of the kernel arguments for each of ``dats``."""
+        others, names = [], []
+        for d in dats:
+            self._check_shape(d)
+            if d is self:
+                names.append("self")
+                continue
+            for i, o in enumerate(others):
+                if d is o:
+                    break
+            else:
+                i = len(others)
+                others.append(d)
+            names.append("x%d" % i)
+        return others, names
+
+    @modifies
+    @collective
+    def lincomb(self, coeffs, dats):
+        """Set this :class:`Dat` to the linear combination ``coeffs[0] *
+        dats[0] + coeffs[1] * dats[1] + ...`` in a single :func:`par_loop`.
+
+        :arg coeffs: an iterable of scalar coefficients
+        :arg dats: an iterable of :class:`Dat`\s of the same shape as this
+            :class:`Dat`, which may include this :class:`Dat` itself
+        """
+        coeffs, dats = as_tuple(coeffs), as_tuple(dats, Dat)
+        if len(coeffs) != len(dats) or not dats:
+            raise ValueError("Need the same (nonzero) number of coefficients and Dats")
+        others, names = self._fused_operands(dats)
+        coeffs = _make_object('Global', len(coeffs), data=coeffs, dtype=self.compute_dtype)
+        terms = [ast.Prod(ast.Symbol("coeffs", (i, )), ast.Symbol(name, ("n", )))
+                 for i, name in enumerate(names)]
+        name = "lincomb_%d" % len(dats)
+        k = ast.FunDecl("void", name,
+                        [ast.Decl(self.compute_ctype, ast.Symbol("*self")),
+                         ast.Decl(coeffs.ctype, ast.Symbol("*coeffs"),
+                                  qualifiers=["const"])] +
+                        [ast.Decl(o.compute_ctype, ast.Symbol("*x%d" % i),
+                                  qualifiers=["const"])
+                         for i, o in enumerate(others)],
+                        ast.c_for("n", self.cdim,
+                                  ast.Assign(ast.Symbol("self", ("n", )),
+                                             reduce(ast.Sum, terms)),
+                                  pragma=None))
+        k = _make_object('Kernel', k, name)
+        access = RW if "self" in names else WRITE
+        par_loop(k, self.dataset.set, self(access), coeffs(READ),
+                 *[o(READ) for o in others])
+        return self
+
+    @collective
+    def inner_many(self, others):
+        """Compute the l2 inner products of the flattened :class:`Dat` with
+        each of ``others`` in a single :func:`par_loop` with a single
+        reduction.
+
+        :arg others: an iterable of :class:`Dat`\s to compute the inner
+            products against
+        :returns: a numpy array of the inner products
+        """
+        others, names = self._fused_operands(as_tuple(others, Dat))
+        if not names:
+            raise ValueError("Need at least one Dat to compute inner products with")
+        ret = _make_object('Global', len(names), data=np.zeros(len(names)),
+                           dtype=self.compute_dtype)
+        name = "inner_%d" % len(names)
+        k = ast.FunDecl("void", name,
+                        [ast.Decl(self.compute_ctype, ast.Symbol("*self"),
+                                  qualifiers=["const"]),
+                         ast.Decl(ret.ctype, ast.Symbol("*ret"))] +
+                        [ast.Decl(o.compute_ctype, ast.Symbol("*x%d" % i),
+                                  qualifiers=["const"])
+                         for i, o in enumerate(others)],
+                        ast.c_for("n", self.cdim,
+                                  ast.Block([ast.Incr(ast.Symbol("ret", (i, )),
+                                                      ast.Prod(ast.Symbol("self", ("n", )),
+                                                               ast.Symbol(o, ("n", ))))
+                                             for i, o in enumerate(names)],
+                                            open_scope=True),
+                                  pragma=None))
+        k = _make_object('Kernel', k, name)
+        par_loop(k, self.dataset.set, self(READ), ret(INC),
+                 *[o(READ) for o in others])
+        return ret.data_ro.copy()
+
     @property
     def norm(self):
         """Compute the l2 norm of this :class:`Dat`
@@ -2196,6 +2584,74 @@ class Dat(SetAssociated, _EmptyDataMixin, CopyOnWrite):
             return
         halo.end(self, reverse=reverse)
 
+    @classmethod
+    def fromfile(cls, dataset, filename, dtype=None, name=None, soa=None,
+                 mode='r', offset=0):
+        """Construct a :class:`Dat` whose storage is memory mapped from
+        the file ``filename``, such that the data are read from disk on
+        demand rather than being copied into memory.
+
+        :arg filename: a NumPy ``.npy`` file, or a raw file of values of
+            type ``dtype`` (by default ``float64``), holding all entries of
+            the :class:`Dat` on this process including halo entries (in SoA
+            order if the :class:`Dat` is stored in SoA order)
+        :arg mode: ``'r'`` to map the file read-only, in which case the
+            :class:`Dat` can only be accessed for reading and the halo
+            entries are used as stored, or ``'c'`` to map it
+            copy-on-write, in which case modifications of the data are
+            kept in memory and never written to the file, and the halo
+            entries are updated before they are first read
+        :arg offset: offset in bytes of the data in a raw file
+        """
+        if filename.endswith(".npy"):
+            data = cls._mmap(filename, mode)
+            dtype = dtype or data.dtype
+            ret = cls(dataset, None, dtype, name=name, soa=soa)
+        else:
+            ret = cls(dataset, None, dtype, name=name, soa=soa)
+            data = cls._mmap(filename, mode, ret.dtype, ret.shape, offset,
+                             order=ret._order)
+        ret._use_mapped_data(data)
+        return ret
+
+    @staticmethod
+    def _mmap(filename, mode, dtype=None, shape=None, offset=0, order='C'):
+        """Memory map the ``.npy`` file ``filename``, or, if ``shape`` is
+        given, the raw file ``filename``."""
+        if mode not in ('r', 'c'):
+            raise ModeValueError("Can only memory map Dat storage read-only ('r') or copy-on-write ('c')")
+        if shape is None:
+            return np.load(filename, mmap_mode=mode)
+        return np.memmap(filename, dtype=dtype, mode=mode, offset=offset,
+                         shape=shape, order=order)
+
+    @collective
+    def _use_mapped_data(self, data):
+        """Use the memory mapped array ``data`` as the storage of this
+        :class:`Dat`, without copying."""
+        if isinstance(self, MixedDat):
+            raise NotImplementedError("Cannot memory map the storage of a MixedDat")
+        if data.dtype != self.dtype:
+            raise DataTypeError("Mapped data of type %s, expected %s" % (data.dtype, self.dtype))
+        if data.shape != self.shape:
+            raise DataValueError("Mapped data of shape %s, expected %s (including halo entries)"
+                                 % (data.shape, self.shape))
+        if not data.flags['F_CONTIGUOUS' if self._order == 'F' else 'C_CONTIGUOUS']:
+            raise DataValueError("Mapped data are not in the storage order of Dat %s" % self.name)
+        # Pending computation must not write into the mapped data
+        _trace.evaluate(set([self]), set([self]))
+        self.__dict__.pop('_vec', None)
+        self._numpy_data = data
+        self._version_bump()
+        # The halo entries read from file may be stale, refresh them on
+        # first use unless they cannot be written
+        self.needs_halo_update = not self._is_mapped_readonly
+
+    @property
+    def _is_mapped_readonly(self):
+        """Is the storage of this :class:`Dat` memory mapped read-only?"""
+        return getattr(self.__dict__.get('_numpy_data'), 'mode', None) == 'r'
+
     @classmethod
     def fromhdf5(cls, dataset, f, name):
         """Construct a :class:`Dat` from a Dat named ``name`` in HDF5 data ``f``"""
@@ -2219,17 +2675,52 @@ class MixedDat(Dat):
     or from an iterable of :class:`Dat`\s ::
 
         mdat = op2.MixedDat([dat1, ..., datN])
+
+    When created from data sets (or as a copy of another
+    :class:`MixedDat`) with ``contiguous=True``, the data of all
+    component :class:`Dat`\s are views into a single contiguous
+    allocation, in the order of a vector multiplied by a
+    :class:`MixedMat`. Where possible, the PETSc vector of such a
+    :class:`MixedDat` shares that storage rather than copying the
+    component data to and from it.
     """
 
-    def __init__(self, mdset_or_dats):
+    def __init__(self, mdset_or_dats, contiguous=False):
+        self._contiguous_data = None
         if isinstance(mdset_or_dats, MixedDat):
-            self._dats = tuple(_make_object('Dat', d) for d in mdset_or_dats)
+            if contiguous:
+                self._init_contiguous(mdset_or_dats.dataset, mdset_or_dats.dtype)
+                mdset_or_dats.copy(self)
+            else:
+                self._dats = tuple(_make_object('Dat', d) for d in mdset_or_dats)
+            return
+        if contiguous:
+            dsets = tuple(mdset_or_dats)
+            if any(isinstance(d, Dat) for d in dsets):
+                raise DataValueError('A contiguous MixedDat can only be created from data sets')
+            self._init_contiguous(dsets, np.float64)
             return
         self._dats = tuple(d if isinstance(d, Dat) else _make_object('Dat', d)
                            for d in mdset_or_dats)
         if not all(d.dtype == self._dats[0].dtype for d in self._dats):
             raise DataValueError('MixedDat with different dtypes is not supported')
 
+    def _init_contiguous(self, dsets, dtype):
+        """Allocate a single zeroed buffer for Dats on all of ``dsets`` and
+        create the component :class:`Dat`\s as views into it."""
+        dsets = [s if isinstance(s, DataSet) else s ** 1 for s in dsets]
+        sizes = [s.total_size * s.cdim for s in dsets]
+        offsets = np.cumsum([0] + sizes)
+        self._contiguous_data = np.zeros(offsets[-1], dtype=dtype)
+        self._dats = tuple(_make_object('Dat', s, self._contiguous_data[o:o + sz], dtype=dtype)
+                           for s, o, sz in zip(dsets, offsets, sizes))
+
+    @property
+    def contiguous(self):
+        """Are the data of all component :class:`Dat`\s stored in a single
+        contiguous allocation?"""
+        return self._contiguous_data is not None
+
     def __getitem__(self, idx):
         """Return :class:`Dat` with index ``idx`` or a given slice of Dats."""
         return self._dats[idx]
@@ -2239,6 +2730,22 @@ class MixedDat(Dat):
         """The NumPy dtype of the data."""
         return self._dats[0].dtype
 
+    @property
+    def compute_dtype(self):
+        """The NumPy dtype kernels see the data as."""
+        return self._dats[0].compute_dtype
+
+    @property
+    def _is_mixed_precision(self):
+        """Are the data of any component stored with a different dtype
+        than kernels see?"""
+        return any(d._is_mixed_precision for d in self._dats)
+
+    @property
+    def _soa_storage(self):
+        """Are the host data of any component stored in SoA order?"""
+        return any(d._soa_storage for d in self._dats)
+
     @property
     def split(self):
         """The underlying tuple of :class:`Dat`\s."""
@@ -2349,6 +2856,10 @@ class MixedDat(Dat):
         other = shallow_copy(self)
 
         other._dats = [d._cow_shallow_copy() for d in self._dats]
+        # The component copies get separate storage once they are made
+        other._contiguous_data = None
+        for attr in ('_vec', '_sctxs'):
+            other.__dict__.pop(attr, None)
 
         return other
 
@@ -2385,11 +2896,62 @@ class MixedDat(Dat):
         """Compute the l2 inner product.
 
         :arg other: the other :class:`MixedDat` to compute the inner product against"""
+        if all(s._use_host_linalg(o) for s, o in zip(self, other)):
+            # Only reduce once over all components
+            for s, o in zip(self, other):
+                s._check_shape(o)
+            local = sum(s._inner_local(o) for s, o in zip(self, other))
+            return MPI.comm.allreduce(local, op=_MPI.SUM)
         ret = 0
         for s, o in zip(self, other):
             ret += s.inner(o)
         return ret
 
+    def _use_pool(self, zero=True):
+        """Take the storage of all components from the :data:`dat_pool`
+        (see :meth:`Dat._use_pool`)."""
+        for d in self._dats:
+            d._use_pool(zero)
+        return self
+
+    def lincomb(self, coeffs, dats):
+        """Set this :class:`MixedDat` to the linear combination ``coeffs[0] *
+        dats[0] + coeffs[1] * dats[1] + ...``, with a single
+        :func:`par_loop` per component.
+
+        :arg coeffs: an iterable of scalar coefficients
+        :arg dats: an iterable of :class:`MixedDat`\s of the same shape as
+            this :class:`MixedDat`, which may include this :class:`MixedDat`
+            itself
+        """
+        dats = as_tuple(dats, MixedDat)
+        for i, s in enumerate(self):
+            s.lincomb(coeffs, [d[i] for d in dats])
+        return self
+
+    def inner_many(self, others):
+        """Compute the l2 inner products with each of ``others``. On the host
+        backends, the local products of all components are computed with
+        NumPy and reduced together once. Otherwise there is a single
+        :func:`par_loop`, and hence a single reduction, per component.
+
+        :arg others: an iterable of :class:`MixedDat`\s to compute the inner
+            products against
+        :returns: a numpy array of the inner products
+        """
+        others = as_tuple(others, MixedDat)
+        if not others:
+            raise ValueError("Need at least one Dat to compute inner products with")
+        if all(s._use_host_linalg(o[i]) for i, s in enumerate(self) for o in others):
+            # Only reduce once over all components and products
+            local = np.zeros(len(others))
+            for i, s in enumerate(self):
+                for j, o in enumerate(others):
+                    s._check_shape(o[i])
+                    local[j] += s._inner_local(o[i])
+            return MPI.comm.allreduce(local, op=_MPI.SUM)
+        return sum(s.inner_many([o[i] for o in others]) for i, s in enumerate(self))
+
     def _op(self, other, op):
         ret = []
         if np.isscalar(other):
@@ -2601,6 +3163,7 @@ class Global(DataCarrier, _EmptyDataMixin):
 
     _globalcount = 0
     _modes = [READ, INC, MIN, MAX]
+    _memory_category = "Global"
 
     @validate_type(('name', str, NameTypeError))
     def __init__(self, dim, data=None, dtype=None, name=None):
@@ -2792,8 +3355,9 @@ class Map(object):
         self._iterset = iterset
         self._toset = toset
         self._arity = arity
-        self._values = verify_reshape(values, np.int32, (iterset.total_size, arity),
-                                      allow_none=True)
+        self._values = MemoryTracker.track(
+            "Map", verify_reshape(values, np.int32, (iterset.total_size, arity),
+                                  allow_none=True))
         self._name = name or "map_%d" % Map._globalcount
         self._offset = offset
         # This is intended to be used for modified maps, for example
@@ -2902,6 +3466,16 @@ class Map(object):
         points."""
         return self._values
 
+    def _touched(self, part, rows):
+        """The number of distinct target set elements of the ``rows`` of
+        this :class:`Map` computed over in the :class:`SetPartition`
+        ``part``."""
+        key = (part.set, part.offset, part.size)
+        cache = self.__dict__.setdefault('_touched_cache', {})
+        if key not in cache:
+            cache[key] = len(np.unique(self.values_with_halo[rows]))
+        return cache[key]
+
     @property
     def name(self):
         """User-defined label"""
@@ -3162,7 +3736,7 @@ class Sparsity(ObjectCached):
     .. _MatMPIAIJSetPreallocation: http://www.mcs.anl.gov/petsc/petsc-current/docs/manualpages/Mat/MatMPIAIJSetPreallocation.html
     """
 
-    def __init__(self, dsets, maps, name=None):
+    def __init__(self, dsets, maps, name=None, block_sparse=False):
         """
         :param dsets: :class:`DataSet`\s for the left and right function
             spaces this :class:`Sparsity` maps between
@@ -3172,6 +3746,10 @@ class Sparsity(ObjectCached):
             row and column maps - if a single :class:`Map` is passed, it is
             used as both a row map and a column map
         :param string name: user-defined label (optional)
+        :param block_sparse: build the sparsity on block rows and
+            columns, with the dimension of the :class:`DataSet`\s as
+            block size (optional).  Only honoured if the row and column
+            dimensions are equal and greater than one.
         """
         # Protect against re-initialization when retrieved from cache
         if self._initialized:
@@ -3185,6 +3763,8 @@ class Sparsity(ObjectCached):
         self._nrows = self._rmaps[0].toset.size
         self._ncols = self._cmaps[0].toset.size
         self._dims = (self._dsets[0].cdim, self._dsets[1].cdim)
+        self._block_sparse = block_sparse and self._dims[0] == self._dims[1] > 1
+        self._offset_tables = {}
 
         self._name = name or "sparsity_%d" % Sparsity._globalcount
         Sparsity._globalcount += 1
@@ -3196,7 +3776,8 @@ class Sparsity(ObjectCached):
             for i, rds in enumerate(dsets[0]):
                 row = []
                 for j, cds in enumerate(dsets[1]):
-                    row.append(Sparsity((rds, cds), [(rm.split[i], cm.split[j]) for rm, cm in maps]))
+                    row.append(Sparsity((rds, cds), [(rm.split[i], cm.split[j]) for rm, cm in maps],
+                                        block_sparse=block_sparse))
                 self._blocks.append(row)
             self._rowptr = tuple(s._rowptr for s in self)
             self._colidx = tuple(s._colidx for s in self)
@@ -3206,18 +3787,90 @@ class Sparsity(ObjectCached):
             self._o_nz = sum(s._o_nz for s in self)
         else:
             with timed_region("Build sparsity"):
-                build_sparsity(self, parallel=MPI.parallel)
+                if configuration['sparsity_cache']:
+                    self._build_with_disk_cache()
+                else:
+                    build_sparsity(self, parallel=MPI.parallel,
+                                   block=self._block_sparse)
+            for f in self._disk_cache_fields:
+                a = getattr(self, '_' + f)
+                # Patterns memory mapped from the disk cache are paged in
+                # on demand, so are not accounted for
+                if isinstance(a, np.ndarray) and not isinstance(a, np.memmap):
+                    MemoryTracker.track("Sparsity", a)
             self._blocks = [[self]]
         self._initialized = True
 
     _cache = {}
     _globalcount = 0
+    _disk_cache_fields = ('d_nnz', 'o_nnz', 'rowptr', 'colidx')
+
+    def _disk_cache_key(self):
+        """Return a key identifying this sparsity pattern on disk.
+
+        In contrast to the in-memory cache key, which is based on the
+        identity of the :class:`Map`\s, this is computed from their
+        values, so identical patterns built by separate runs of a
+        program share a cache entry.  Each MPI process has its own
+        entry, since the pattern is built in process-local numbering."""
+        h = md5(version)
+        h.update(str((self._dims, self._block_sparse,
+                      MPI.comm.size, MPI.comm.rank)))
+        for rmap, cmap in self.maps:
+            for m in (rmap, cmap):
+                h.update(str((m.arity, m.iterset.sizes, m.toset.sizes,
+                              m.iterset.layers,
+                              sorted(r.where for r in m.iteration_region))))
+                h.update(np.ascontiguousarray(m.values_with_halo, dtype=np.int32).data)
+                if m.offset is not None:
+                    h.update(np.ascontiguousarray(m.offset, dtype=np.int32).data)
+        return h.hexdigest()
+
+    def _build_with_disk_cache(self):
+        """Build the sparsity pattern, reading it from the on-disk cache
+        if possible and writing it there otherwise.
+
+        Cached arrays are memory mapped on load, so the pattern is only
+        paged in from disk as it is used."""
+        cachedir = os.path.join(configuration['cache_dir'], 'sparsity')
+        key = self._disk_cache_key()
+        fname = lambda f: os.path.join(cachedir, "%s.%s.npy" % (key, f))
+        stats = CacheStats("pyop2.base.Sparsity on disk")
+        try:
+            for f in self._disk_cache_fields:
+                setattr(self, '_' + f, np.load(fname(f), mmap_mode='r'))
+            self._d_nz = int(self._d_nnz.sum())
+            self._o_nz = int(self._o_nnz.sum())
+            stats.hits += 1
+            stats.disk_hits += 1
+            return
+        except (IOError, ValueError):
+            pass
+        start = time()
+        build_sparsity(self, parallel=MPI.parallel, block=self._block_sparse)
+        stats.misses += 1
+        stats.miss_time += time() - start
+        if not os.path.exists(cachedir):
+            try:
+                os.makedirs(cachedir)
+            except OSError:
+                # Another process may have created it in the meantime
+                if not os.path.isdir(cachedir):
+                    raise
+        for f in self._disk_cache_fields:
+            # Write to a temporary file and move it into place, so that
+            # concurrent readers never see a partially written entry
+            tmpname = fname(f) + ".%d.tmp" % os.getpid()
+            with open(tmpname, 'wb') as tmp:
+                np.save(tmp, getattr(self, '_' + f))
+            os.rename(tmpname, fname(f))
+        stats.stores += 1
 
     @classmethod
     @validate_type(('dsets', (Set, DataSet, tuple, list), DataSetTypeError),
                    ('maps', (Map, tuple, list), MapTypeError),
                    ('name', str, NameTypeError))
-    def _process_args(cls, dsets, maps, name=None, *args, **kwargs):
+    def _process_args(cls, dsets, maps, name=None, block_sparse=False, *args, **kwargs):
         "Turn maps argument into a canonical tuple of pairs."
 
         # A single data set becomes a pair of identical data sets
@@ -3273,11 +3926,12 @@ class Sparsity(ObjectCached):
             cache = dsets[0].set[0]
         else:
             cache = dsets[0].set
-        return (cache, ) + (tuple(dsets), tuple(sorted(uniquify(maps))), name), {}
+        return (cache, ) + (tuple(dsets), tuple(sorted(uniquify(maps))), name), \
+            {'block_sparse': bool(block_sparse)}
 
     @classmethod
     def _cache_key(cls, dsets, maps, *args, **kwargs):
-        return (dsets, maps)
+        return (dsets, maps, kwargs['block_sparse'])
 
     def __getitem__(self, idx):
         """Return :class:`Sparsity` block with row and column given by ``idx``
@@ -3323,6 +3977,62 @@ class Sparsity(ObjectCached):
         :class:`Set` of the ``Sparsity``."""
         return self._dims
 
+    def _insertion_offsets(self, rmap, cmap):
+        """Return the offsets into the CSR values array of the entries of
+        each element matrix assembled through the pair of maps ``(rmap,
+        cmap)``.
+
+        The result has one row per element of the iteration set, with
+        the offsets of the element matrix entries in row-major order.
+        Element matrices of vector fields are expected in flattened
+        layout (ordered by component, then by node).  Entries with a
+        negative row or column index, as set by maps masking boundary
+        entries, get the offset -1 and are dropped like MatSetValues
+        does.  The table is computed on first use and cached on the
+        ``Sparsity``.
+
+        :raises MapValueError: if the maps address an entry which is not
+            in the ``Sparsity``."""
+        key = (rmap, cmap)
+        if key in self._offset_tables:
+            return self._offset_tables[key]
+
+        def scalar_indices(m, dim):
+            # Scalar row (column) of each entry of the flattened element matrix
+            vals = m.values_with_halo.astype(np.int64)
+            return dim * vals[:, np.tile(np.arange(m.arity), dim)] + \
+                np.repeat(np.arange(dim), m.arity)
+        rdim, cdim = self._dims
+        ncols = self._ncols * cdim
+        rows = scalar_indices(rmap, rdim)
+        cols = scalar_indices(cmap, cdim)
+        # Rows are in ascending order and columns are sorted within each
+        # row, so (row, column) pairs of the CSR structure linearised in
+        # row-major order are sorted and can be searched directly.
+        rowptr = np.asarray(self._rowptr, dtype=np.int64)
+        csr = np.repeat(np.arange(len(rowptr) - 1), np.diff(rowptr)) * ncols + self._colidx
+        targets = (rows[:, :, None] * ncols + cols[:, None, :]).reshape(len(rows), -1)
+        masked = ((rows[:, :, None] < 0) | (cols[:, None, :] < 0)).reshape(targets.shape)
+        offsets = np.searchsorted(csr, targets)
+        # searchsorted returns the insertion point of entries which are
+        # not in the sparsity, which would silently address a neighbour
+        found = csr[np.minimum(offsets, len(csr) - 1)] == targets if len(csr) else False
+        if not np.all(found | masked):
+            raise MapValueError("Maps %s and %s address entries not in Sparsity %s"
+                                % (rmap.name, cmap.name, self.name))
+        offsets[masked] = -1
+        offsets = offsets.astype(np.int32)
+        self._offset_tables[key] = offsets
+        return offsets
+
+    @property
+    def block_sparse(self):
+        """Is this ``Sparsity`` built on block rows and columns?
+
+        If so, the CSR arrays and non-zero counts refer to blocks of
+        size :attr:`dims` rather than to individual entries."""
+        return self._block_sparse
+
     @property
     def shape(self):
         """Number of block rows and columns."""
@@ -3363,7 +4073,9 @@ class Sparsity(ObjectCached):
 
     @property
     def colidx(self):
-        """Column indices array of CSR data structure."""
+        """Column indices array of CSR data structure.
+
+        Column indices are in process-local numbering."""
         return self._colidx
 
     @property
@@ -3537,6 +4249,20 @@ class Mat(SetAssociated):
         """Yield self when iterated over."""
         yield self
 
+    def mult(self, x, out):
+        """Compute the matrix-vector product ``out = A x`` into the
+        existing :class:`Dat` ``out``."""
+        raise NotImplementedError("Abstract base Mat does not implement multiplication")
+
+    def mult_add(self, x, y, out):
+        """Compute ``out = y + A x`` into the existing :class:`Dat` ``out``."""
+        raise NotImplementedError("Abstract base Mat does not implement multiplication")
+
+    def mult_transpose(self, x, out):
+        """Compute the transpose product ``out = A^T x`` into the
+        existing :class:`Dat` ``out``."""
+        raise NotImplementedError("Abstract base Mat does not implement multiplication")
+
     def __mul__(self, other):
         """Multiply this :class:`Mat` with the vector ``other``."""
         raise NotImplementedError("Abstract base Mat does not implement multiplication")
@@ -3549,6 +4275,7 @@ class Mat(SetAssociated):
         return "Mat(%r, %r, %r)" \
                % (self._sparsity, self._datatype, self._name)
 
+
 # Kernel API
 
 
@@ -3642,6 +4369,138 @@ class Kernel(Cached):
         return 'Kernel("""%s""", %r)' % (self._code, self._name)
 
 
+class ImplicitMat(Mat):
+    """Matrix-free OP2 matrix. An ``ImplicitMat`` is never assembled, but
+    defined by the action of a :class:`Kernel` over an iteration
+    :class:`Set`: the product ``y = A x`` is computed as ::
+
+      y.zero()
+      par_loop(kernel, iterset, y(INC, rmap), x(READ, cmap), *args)
+
+    Hence the kernel's first two arguments are the element contribution
+    to ``y`` and the element values of ``x``, followed by those passed
+    in ``args``.  Only O(n) storage is needed for the vectors, rather
+    than O(nnz) for an assembled matrix.
+
+    Since the diagonal is not otherwise available, preconditioning with
+    ``pc_type`` ``jacobi`` (the :class:`Solver` default) requires a
+    ``diagonal`` kernel, which is executed as ::
+
+      par_loop(diagonal, iterset, d(INC, rmap), *args)
+
+    An ``ImplicitMat`` cannot be passed to a :func:`par_loop`.
+    """
+
+    _globalcount = 0
+
+    @validate_type(('dsets', (Set, DataSet, tuple, list), DataSetTypeError),
+                   ('kernel', Kernel, KernelTypeError),
+                   ('iterset', Set, SetTypeError),
+                   ('maps', (Map, tuple, list), MapTypeError),
+                   ('name', str, NameTypeError))
+    def __init__(self, dsets, kernel, iterset, maps, args=(), diagonal=None,
+                 dtype=None, name=None):
+        """
+        :param dsets: :class:`DataSet`\s for the left and right function
+            spaces this ``ImplicitMat`` maps between (a single
+            :class:`DataSet` is used for both)
+        :param kernel: :class:`Kernel` computing the element action
+        :param iterset: :class:`Set` to iterate over to compute the action
+        :param maps: a pair of row and column :class:`Map`\s (a single
+            :class:`Map` is used as both)
+        :param args: additional :class:`Arg`\s to pass to ``kernel`` and
+            ``diagonal`` (optional)
+        :param diagonal: :class:`Kernel` computing the element
+            contributions to the diagonal (optional)
+        :param dtype: the type of the matrix entries (optional)
+        :param string name: user-defined label (optional)
+        """
+        dsets = [dsets, dsets] if isinstance(dsets, (Set, DataSet)) else list(dsets)
+        dsets = [s ** 1 if isinstance(s, Set) else s for s in dsets]
+        maps = (maps, maps) if isinstance(maps, Map) else tuple(maps)
+        for m, ds in zip(maps, dsets):
+            if m.iterset != iterset:
+                raise MapValueError("Iterset of %s must be %s" % (m, iterset))
+            if m.toset != ds.set:
+                raise MapValueError("To set of %s doesn't match the set of %s" % (m, ds))
+        if diagonal is not None and dsets[0] != dsets[1]:
+            raise MatTypeError("Only a square ImplicitMat can have a diagonal")
+        self._sparsity = None
+        self._dsets = tuple(dsets)
+        self._kernel = kernel
+        self._iterset = iterset
+        self._maps = maps
+        self._args = tuple(args)
+        self._diagonal = diagonal
+        self._datatype = np.dtype(dtype)
+        self._name = name or "implicit_mat_%d" % ImplicitMat._globalcount
+        ImplicitMat._globalcount += 1
+
+    def __call__(self, access, path, flatten=False):
+        raise MatTypeError("An ImplicitMat cannot be passed to a par_loop")
+
+    def assemble(self):
+        """An ``ImplicitMat`` needs no assembly, this is a no-op."""
+        pass
+
+    def _assemble(self):
+        pass
+
+    def _action(self, x, y):
+        """Compute ``y = A x``, ``x`` and ``y`` are :class:`Dat`\s."""
+        y.zero()
+        par_loop(self._kernel, self._iterset,
+                 y(INC, self._maps[0]), x(READ, self._maps[1]), *self._args)
+        # The par_loop increments y from zero without versioning it
+        y._version_bump()
+
+    def _diagonal_action(self, d):
+        """Compute the diagonal of this matrix into the :class:`Dat` ``d``."""
+        if self._diagonal is None:
+            raise MatTypeError("No diagonal kernel given for %s" % self._name)
+        d.zero()
+        par_loop(self._diagonal, self._iterset,
+                 d(INC, self._maps[0]), *self._args)
+        d._version_bump()
+
+    @property
+    def dims(self):
+        return (self._dsets[0].cdim, self._dsets[1].cdim)
+
+    @property
+    def dsets(self):
+        """A pair of :class:`DataSet`\s for the left and right function
+        spaces this ``ImplicitMat`` maps between."""
+        return self._dsets
+
+    @property
+    def nbytes(self):
+        """An ``ImplicitMat`` stores no matrix entries, this is 0."""
+        return 0
+
+    @modifies_argn(1)
+    def mult(self, x, out):
+        """Compute the action ``out = A x`` into the existing :class:`Dat`
+        ``out``."""
+        self._action(x, out)
+
+    def __mul__(self, v):
+        """Multiply this :class:`ImplicitMat` with the :class:`Dat` ``v``."""
+        if not isinstance(v, Dat):
+            raise TypeError("Can only multiply ImplicitMat and Dat.")
+        y = _make_object('Dat', self._dsets[0], dtype=self.dtype)._use_pool(zero=False)
+        self.mult(v, y)
+        return y
+
+    def __str__(self):
+        return "OP2 ImplicitMat: %s, kernel %s, iterset %s, datatype %s" \
+               % (self._name, self._kernel.name, self._iterset, self._datatype.name)
+
+    def __repr__(self):
+        return "ImplicitMat(%r, %r, %r, %r)" \
+               % (self._dsets, self._kernel, self._iterset, self._maps)
+
+
 class JITModule(Cached):
 
     """Cached module encapsulating the generated :class:`ParLoop` stub.
@@ -3666,7 +4525,9 @@ class JITModule(Cached):
                 else:
                     idx = arg.idx
                 map_arity = arg.map.arity if arg.map else None
-                key += (arg.data.dim, arg.data.dtype, map_arity, idx, arg.access)
+                key += (arg.data.dim, arg.data.dtype, arg.data.compute_dtype,
+                        tuple((d._soa_storage, d._op2_stride) for d in arg.data),
+                        map_arity, idx, arg.access)
             elif arg._is_mat:
                 idxs = (arg.idx[0].__class__, arg.idx[0].index,
                         arg.idx[1].index)
@@ -3675,8 +4536,12 @@ class JITModule(Cached):
                 # "bottom") affect generated code, and therefore need
                 # to be part of cache key
                 map_bcs = (arg.map[0].implicit_bcs, arg.map[1].implicit_bcs)
+                # Blocked matrices are inserted into differently, as are
+                # matrices assembled through precomputed offsets
+                block_sparse = tuple(s.block_sparse for s in arg.data.sparsity)
                 key += (arg.data.dims, arg.data.dtype, idxs,
-                        map_arities, map_bcs, arg.access)
+                        map_arities, map_bcs, block_sparse,
+                        configuration['fast_reassembly'], arg.access)
 
         iterate = kwargs.get("iterate", None)
         if iterate is not None:
@@ -3818,25 +4683,86 @@ class ParLoop(LazyComputation):
     def _run(self):
         return self.compute()
 
+    @property
+    def _trace_name(self):
+        return self.kernel.name
+
     @collective
     @timed_function('ParLoop compute')
     @profile
     def compute(self):
         """Executes the kernel over all members of the iteration space."""
+        counter = self._loop_counter if configuration['loop_counters'] else None
+        if counter:
+            counter.count()
         self.halo_exchange_begin()
         self.maybe_set_dat_dirty()
-        self._compute(self.it_space.iterset.core_part)
+        self._compute_part(self.it_space.iterset.core_part, 'core', counter)
         self.halo_exchange_end()
-        self._compute(self.it_space.iterset.owned_part)
+        self._compute_part(self.it_space.iterset.owned_part, 'owned', counter)
         self.reduction_begin()
         if self._only_local:
             self.reverse_halo_exchange_begin()
             self.reverse_halo_exchange_end()
         if not self._only_local and self.needs_exec_halo:
-            self._compute(self.it_space.iterset.exec_part)
+            self._compute_part(self.it_space.iterset.exec_part, 'exec', counter)
         self.reduction_end()
         self.maybe_set_halo_update_needed()
 
+    def _compute_part(self, part, region, counter):
+        """Executes the kernel over ``part``, recording the time spent,
+        elements processed and bytes moved for ``region`` in the
+        :class:`~pyop2.profiling.LoopCounter` ``counter`` (if any)."""
+        with traced(self.kernel.name, 'kernel', region=region, size=part.size):
+            if counter is None:
+                return self._compute(part)
+            start = time()
+            self._compute(part)
+            counter.add(region, time() - start, *self._traffic(part))
+
+    @property
+    def _loop_counter(self):
+        """The :class:`~pyop2.profiling.LoopCounter` of this parallel loop,
+        keyed by kernel name and the key of the generated code."""
+        key = JITModule._cache_key(self.kernel, self.it_space, *self.args,
+                                   iterate=self.iteration_region)
+        return LoopCounter(self.kernel.name, md5(str(key)).hexdigest()[:8])
+
+    def _traffic(self, part):
+        """Return the number of elements processed computing over ``part``
+        and an estimate of the bytes of memory moved.
+
+        Every :class:`Dat` entry touched is counted once, read, written or
+        both depending on the access descriptor, as are the values of the
+        :class:`Map`\s used and the element matrices added to a
+        :class:`Mat`. Reuse of entries between the layers of an extruded
+        mesh is not accounted for."""
+        rows = slice(part.offset, part.offset + part.size)
+        iterset = self.it_space.iterset
+        if isinstance(iterset, Subset):
+            rows = iterset._indices[rows]
+        layers = self.it_space.layers - 1 if self._is_layered else 1
+        nbytes = 0
+        maps = set()
+        for arg in self.args:
+            if arg._is_global:
+                nbytes += arg.data.cdim * arg.data.dtype.itemsize
+            elif arg._is_dat:
+                factor = 1 if arg.access in (READ, WRITE) else 2
+                for i, d in enumerate(arg.data):
+                    m = arg.map.split[i] if arg.map is not None else None
+                    entries = part.size if m is None else m._touched(part, rows)
+                    nbytes += factor * layers * entries * d.cdim * d.dtype.itemsize
+                    if m is not None:
+                        maps.add(m)
+            elif arg._is_mat:
+                for m in arg.map:
+                    maps.update(m.split)
+                nbytes += layers * part.size * arg.map[0].arity * arg.map[1].arity * \
+                    np.prod(arg.data.dims) * arg.data.dtype.itemsize
+        nbytes += sum(part.size * m.arity * m.values_with_halo.itemsize for m in maps)
+        return part.size * layers, nbytes
+
     @collective
     def _compute(self, part):
         """Executes the kernel over all members of a MPI-part of the iteration space."""
@@ -37,7 +37,9 @@ import cPickle
 import gzip
 import os
 import zlib
+from time import time
 from mpi import MPI
+from profiling import write_table
 
 
 def report_cache(typ):
@@ -70,6 +72,77 @@ def report_cache(typ):
         print '%s: %d' % (name, v)
 
 
+class CacheStats(object):
+
+    """Hit and miss counters of a cache.
+
+    :param name: The name of the cache, used as unique identifier.
+
+    The counters are
+
+    * ``hits``: lookups served from the cache, from memory or disk
+    * ``disk_hits``: of those, lookups served from disk
+    * ``misses``: lookups not found, where the object was built
+    * ``stores``: objects stored in the cache
+    * ``uncached``: objects built without being looked up since they
+      are not to be cached
+    * ``miss_time``: the time spent building objects on misses
+    """
+
+    _stats = {}
+
+    def __new__(cls, name):
+        if name in cls._stats:
+            return cls._stats[name]
+        self = super(CacheStats, cls).__new__(cls)
+        self.name = name
+        self.hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+        self.stores = 0
+        self.uncached = 0
+        self.miss_time = 0.0
+        cls._stats[name] = self
+        return self
+
+    @classmethod
+    def of(cls, typ):
+        """Return the statistics of the cache of class ``typ``."""
+        return cls("%s.%s" % (typ.__module__, typ.__name__))
+
+    @property
+    def hit_rate(self):
+        """Fraction of lookups served from the cache."""
+        lookups = self.hits + self.misses
+        return float(self.hits) / lookups if lookups else 0.0
+
+
+def get_cache_stats():
+    """Return a dict of the :class:`CacheStats` of all caches used, keyed
+    by name."""
+    return CacheStats._stats
+
+
+def reset_cache_stats():
+    """Clear the statistics of all caches."""
+    CacheStats._stats = {}
+
+
+def report_cache_stats():
+    """Print a table of the :class:`CacheStats` of all caches used."""
+    stats = sorted(CacheStats._stats.values(), key=lambda s: s.name)
+    if not stats:
+        print "\nNo cache lookups"
+        return
+    column_heads = ("Cache", "Hits", "Disk hits", "Misses", "Stores",
+                    "Uncached", "Hit rate", "Miss time")
+    rows = [(s.name, s.hits, s.disk_hits, s.misses, s.stores, s.uncached,
+             '%.1f%%' % (100 * s.hit_rate), s.miss_time) for s in stats]
+    print "\nCache statistics"
+    print "================"
+    write_table(column_heads, rows)
+
+
 class ObjectCached(object):
     """Base class for objects that should be cached on another object.
 
@@ -141,9 +214,11 @@ class ObjectCached(object):
             obj.__init__(*args, **kwargs)
             return obj
 
+        stats = CacheStats.of(cls)
         # Don't bother looking in caches if we're not meant to cache
         # this object.
         if key is None:
+            stats.uncached += 1
             return make_obj()
 
         # Does the caching object know about the caches?
@@ -155,10 +230,16 @@ class ObjectCached(object):
         # OK, we have a cache, let's go ahead and try and find our
         # object in it.
         try:
-            return cache[key]
+            obj = cache[key]
+            stats.hits += 1
+            return obj
         except KeyError:
+            start = time()
             obj = make_obj()
             cache[key] = obj
+            stats.misses += 1
+            stats.stores += 1
+            stats.miss_time += time() - start
             return obj
 
 
@@ -192,15 +273,23 @@ class Cached(object):
             obj.__init__(*args, **kwargs)
             return obj
 
+        stats = CacheStats.of(cls)
         # Don't bother looking in caches if we're not meant to cache
         # this object.
         if key is None:
+            stats.uncached += 1
             return make_obj()
         try:
-            return cls._cache_lookup(key)
+            obj = cls._cache_lookup(key)
+            stats.hits += 1
+            return obj
         except (KeyError, IOError):
+            start = time()
             obj = make_obj()
             cls._cache_store(key, obj)
+            stats.misses += 1
+            stats.stores += 1
+            stats.miss_time += time() - start
             return obj
 
     @classmethod
@@ -279,6 +368,7 @@ class DiskCached(Cached):
 
         # Store in memory so we can save ourselves a disk lookup next time
         cls._cache[key] = val
+        CacheStats.of(cls).disk_hits += 1
         return val
 
     @classmethod
@@ -0,0 +1,464 @@
+# This file is part of PyOP2
+#
+# PyOP2 is Copyright (c) 2012, Imperial College London and
+# others. Please see the AUTHORS file in the main source directory for
+# a full list of copyright holders.  All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions
+# are met:
+#
+#     * Redistributions of source code must retain the above copyright
+#       notice, this list of conditions and the following disclaimer.
+#     * Redistributions in binary form must reproduce the above copyright
+#       notice, this list of conditions and the following disclaimer in the
+#       documentation and/or other materials provided with the distribution.
+#     * The name of Imperial College London or that of other
+#       contributors may not be used to endorse or promote products
+#       derived from this software without specific prior written
+#       permission.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTERS
+# ''AS IS'' AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT
+# LIMITED TO, THE IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS
+# FOR A PARTICULAR PURPOSE ARE DISCLAIMED. IN NO EVENT SHALL THE
+# COPYRIGHT HOLDERS OR CONTRIBUTORS BE LIABLE FOR ANY DIRECT,
+# INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES
+# (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR
+# SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION)
+# HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT,
+# STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE)
+# ARISING IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED
+# OF THE POSSIBILITY OF SUCH DAMAGE.
+
+
+"""Checkpointing of PyOP2 data carriers to disk."""
+
+from collections import OrderedDict
+import os
+import threading
+import time
+from Queue import Queue
+
+import numpy as np
+
+from backends import _make_object
+from base import Set, ExtrudedSet, MixedSet, DataSet, MixedDataSet, Halo, \
+    Map, MixedMap, Dat, MixedDat, Global, Const
+from hdf5 import open_file
+from logger import info
+from mpi import MPI, collective
+from profiling import timed_region
+from version import __version__ as version
+
+
+class CheckpointWriter(object):
+
+    """Write snapshots of :class:`Dat`\s and :class:`Global`\s to disk in
+    a background thread, so that computation proceeds during I/O.
+
+    :param format: The file format, one of ``"hdf5"`` (a single HDF5
+        file, requires :mod:`h5py`), ``"npz"`` (a single NumPy archive)
+        or ``"npy"`` (a directory of NumPy ``.npy`` files).
+    :param compression: Compress the data (optional). Pass ``True`` or,
+        for HDF5, the name of an HDF5 filter such as ``"lzf"``. The
+        ``"npy"`` format does not support compression.
+
+    :meth:`write` copies the data of the objects into one of two sets of
+    staging buffers and returns; a :class:`Dat` may then be modified
+    while its snapshot is written. A further :meth:`write` only waits
+    if both buffers are still being written. Each object is stored
+    under its name, so names must be unique within a checkpoint. In
+    parallel, every process writes the owned part of its data to its own
+    file, named by inserting the rank before the extension. ::
+
+      with op2.CheckpointWriter('npz', compression=True) as writer:
+          for step in range(nsteps):
+              ...
+              if step % 10 == 0:
+                  writer.write('state_%d.npz' % step, [u, p, t])
+      print writer.bandwidth
+    """
+
+    formats = ('hdf5', 'npz', 'npy')
+
+    def __init__(self, format='hdf5', compression=None):
+        if format not in self.formats:
+            raise ValueError("Unknown checkpoint format %s, must be one of %s"
+                             % (format, ', '.join(self.formats)))
+        if compression and format == 'npy':
+            raise ValueError("The npy checkpoint format does not support compression")
+        self._format = format
+        self._compression = compression
+        self._buffers = [{}, {}]
+        self._free = [threading.Event(), threading.Event()]
+        for e in self._free:
+            e.set()
+        self._count = 0
+        self._error = None
+        self._stats = []
+        self._queue = Queue()
+        self._thread = threading.Thread(target=self._run,
+                                        name="PyOP2 checkpoint writer")
+        self._thread.daemon = True
+        self._thread.start()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    @property
+    def stats(self):
+        """A list of ``(filename, bytes, seconds)`` tuples, one for each
+        completed write."""
+        return list(self._stats)
+
+    @property
+    def bandwidth(self):
+        """The write bandwidth in bytes per second over all completed
+        writes, or ``None`` if none has completed."""
+        stats = self.stats
+        seconds = sum(s for _, _, s in stats)
+        if not stats or seconds == 0:
+            return None
+        return sum(b for _, b, _ in stats) / seconds
+
+    @collective
+    def write(self, filename, objects):
+        """Snapshot the data of ``objects`` and write it to ``filename``
+        in the background.
+
+        :arg filename: The name of the file (or directory for the
+            ``"npy"`` format) to write.
+        :arg objects: An iterable of :class:`Dat`\s and :class:`Global`\s.
+            A :class:`MixedDat` is written as its component :class:`Dat`\s.
+        """
+        self._raise_error()
+        slot = self._count % 2
+        self._free[slot].wait()
+        self._raise_error()
+        self._free[slot].clear()
+        try:
+            with timed_region("Checkpoint snapshot"):
+                arrays = self._snapshot(self._buffers[slot], objects)
+        except Exception:
+            self._free[slot].set()
+            raise
+        self._count += 1
+        self._queue.put((slot, self._filename(filename), arrays))
+
+    def wait(self):
+        """Wait for all pending writes to complete."""
+        self._queue.join()
+        self._raise_error()
+
+    def close(self):
+        """Wait for all pending writes to complete and stop the writer."""
+        if self._thread.is_alive():
+            self._queue.join()
+            self._queue.put(None)
+            self._thread.join()
+        self._raise_error()
+
+    def _raise_error(self):
+        if self._error is not None:
+            error, self._error = self._error, None
+            raise error
+
+    def _filename(self, filename):
+        if MPI.parallel:
+            root, ext = os.path.splitext(filename)
+            return "%s.%d%s" % (root, MPI.comm.rank, ext)
+        return filename
+
+    def _snapshot(self, buffers, objects):
+        arrays = []
+        for obj in objects:
+            for o in (obj if isinstance(obj, MixedDat) else [obj]):
+                if not isinstance(o, (Dat, Global)):
+                    raise TypeError("Cannot checkpoint %r" % o)
+                if o.name in (n for n, _ in arrays):
+                    raise ValueError("Duplicate name %s in checkpoint" % o.name)
+                data = o.data_ro
+                buf = buffers.get(o.name)
+                if buf is None or buf.shape != data.shape or buf.dtype != data.dtype:
+                    buf = buffers[o.name] = np.empty_like(data)
+                buf[...] = data
+                arrays.append((o.name, buf))
+        # Drop the buffers of objects no longer checkpointed
+        for name in set(buffers) - set(n for n, _ in arrays):
+            del buffers[name]
+        return arrays
+
+    def _run(self):
+        while True:
+            job = self._queue.get()
+            if job is None:
+                self._queue.task_done()
+                return
+            slot, filename, arrays = job
+            try:
+                start = time.time()
+                getattr(self, '_write_' + self._format)(filename, arrays)
+                seconds = time.time() - start
+                nbytes = sum(a.nbytes for _, a in arrays)
+                self._stats.append((filename, nbytes, seconds))
+                info("Checkpoint %s: wrote %d bytes in %.3fs (%.1f MB/s)",
+                     filename, nbytes, seconds,
+                     nbytes / max(seconds, 1e-9) / 1024 ** 2)
+            except Exception as e:
+                self._error = e
+            finally:
+                self._free[slot].set()
+                self._queue.task_done()
+
+    def _write_hdf5(self, filename, arrays):
+        import h5py
+        compression = 'gzip' if self._compression is True else self._compression
+        with h5py.File(filename, 'w') as f:
+            for name, a in arrays:
+                f.create_dataset(name, data=a, compression=compression or None)
+
+    def _write_npz(self, filename, arrays):
+        save = np.savez_compressed if self._compression else np.savez
+        save(filename, **dict(arrays))
+
+    def _write_npy(self, filename, arrays):
+        if not os.path.isdir(filename):
+            os.makedirs(filename)
+        for name, a in arrays:
+            np.save(os.path.join(filename, name + '.npy'), a)
+
+
+FORMAT = 'pyop2-checkpoint'
+FORMAT_VERSION = 1
+
+
+def _collect(objects):
+    """Return the objects to checkpoint and the :class:`Set`\s they are
+    defined on, keyed by name, with every object after those it
+    depends on."""
+    named = OrderedDict()
+
+    def add(o):
+        if isinstance(o, DataSet) and not isinstance(o, MixedDataSet):
+            o = o.set
+        if isinstance(o, (ExtrudedSet, MixedSet, MixedMap, MixedDataSet)):
+            raise NotImplementedError("Cannot checkpoint %s" % o)
+        if isinstance(o, Map):
+            add(o.iterset)
+            add(o.toset)
+        elif isinstance(o, MixedDat):
+            # A MixedDat is unnamed and is written as its components
+            for d in o:
+                add(d)
+            return
+        elif isinstance(o, Dat):
+            add(o.dataset.set)
+        elif not isinstance(o, (Set, Global, Const)):
+            raise TypeError("Cannot checkpoint %r" % o)
+        if named.setdefault(o.name, o) is not o:
+            raise ValueError("Duplicate name %s in checkpoint" % o.name)
+
+    for o in objects:
+        add(o)
+    return named
+
+
+def _encode(d):
+    """Flatten a dict of arrays keyed by process into an array."""
+    parts = [np.empty(0, dtype=np.int64)]
+    for r in sorted(d):
+        parts += [[r, len(d[r])], d[r]]
+    return np.concatenate(parts).astype(np.int64)
+
+
+def _decode(a):
+    """Invert :func:`_encode`."""
+    d = {}
+    i = 0
+    while i < len(a):
+        r, n = int(a[i]), int(a[i + 1])
+        d[r] = a[i + 2:i + 2 + n].astype(np.int32)
+        i += 2 + n
+    return d
+
+
+def _serialise(o):
+    """Return the attributes of the object ``o``, the per-process arrays
+    and the arrays common to all processes to write for it."""
+    if isinstance(o, Set):
+        halo = o.halo
+        ragged = [('sizes', np.array([o.sizes], dtype=np.int64)),
+                  ('sends', _encode(halo.sends if halo else {})),
+                  ('receives', _encode(halo.receives if halo else {})),
+                  ('numbering', np.empty(0, dtype=np.int32)
+                   if halo is None or halo.global_to_petsc_numbering is None
+                   else np.asarray(halo.global_to_petsc_numbering, dtype=np.int32))]
+        return {'kind': 'Set', 'halo': halo is not None}, ragged, []
+    if isinstance(o, Map):
+        shared = [] if o.offset is None else [('offset', np.asarray(o.offset))]
+        return ({'kind': 'Map', 'iterset': o.iterset.name, 'toset': o.toset.name,
+                 'arity': o.arity},
+                [('values', o.values_with_halo)], shared)
+    if isinstance(o, Dat):
+        return ({'kind': 'Dat', 'set': o.dataset.set.name,
+                 'dim': np.array(o.dataset.dim), 'soa': bool(o.soa),
+                 'dtype': o.dtype.str, 'compute_dtype': o.compute_dtype.str},
+                [('data', o.data_ro_with_halos)], [])
+    kind = 'Global' if isinstance(o, Global) else 'Const'
+    return ({'kind': kind, 'dim': np.array(o.dim), 'dtype': o.dtype.str},
+            [], [('data', o.data_ro if isinstance(o, Global) else o.data)])
+
+
+@collective
+def checkpoint(path, objects):
+    """Write the state of a PyOP2 program to the HDF5 file ``path``.
+
+    :arg objects: An iterable of :class:`Set`\s, :class:`Map`\s,
+        :class:`Dat`\s, :class:`Global`\s and :class:`Const`\s, which must
+        have unique names. The :class:`Set`\s the :class:`Map`\s and
+        :class:`Dat`\s are defined on are written as well, and a
+        :class:`MixedDat` is written as its component :class:`Dat`\s.
+
+    The file describes every object, including the sizes of the
+    partitions and the :class:`Halo` of each :class:`Set` on every
+    process. Each process writes its local data (including halo entries)
+    into its own range of a dataset per object, in parallel through
+    MPI-IO if :mod:`h5py` was built with MPI support and one process
+    after another otherwise. See :func:`restore`.
+    """
+    comm = MPI.comm
+    rank = comm.rank
+    named = _collect(objects)
+    groups = [(name,) + _serialise(o) for name, o in named.iteritems()]
+    lengths = comm.allgather([len(a) for _, _, ragged, _ in groups for _, a in ragged])
+    # offsets[r, i] is the first row of process r in the i-th per-process array
+    offsets = np.cumsum([[0] * len(lengths[0])] + lengths, axis=0)
+
+    def create(f):
+        f.attrs.update({'format': FORMAT, 'format_version': FORMAT_VERSION,
+                        'pyop2_version': version, 'nranks': comm.size})
+        i = 0
+        for index, (name, attrs, ragged, shared) in enumerate(groups):
+            g = f.create_group(name)
+            g.attrs.update(attrs)
+            g.attrs['index'] = index
+            for key, a in ragged:
+                g.create_dataset(key, (offsets[-1, i],) + a.shape[1:], a.dtype)
+                g.create_dataset(key + '_offsets', data=offsets[:, i])
+                i += 1
+            for key, a in shared:
+                g.create_dataset(key, a.shape, a.dtype)
+
+    def fill(f):
+        i = 0
+        for name, _, ragged, shared in groups:
+            for key, a in ragged:
+                if len(a):
+                    f[name][key][offsets[rank, i]:offsets[rank + 1, i]] = a
+                i += 1
+            if rank == 0:
+                for key, a in shared:
+                    f[name][key][...] = a
+
+    with timed_region("Checkpoint write"):
+        import h5py
+        if comm.size > 1 and h5py.get_config().mpi:
+            with open_file(path, 'w', comm) as f:
+                create(f)
+                fill(f)
+            return
+        if rank == 0:
+            with h5py.File(path, 'w') as f:
+                create(f)
+        for r in range(comm.size):
+            comm.barrier()
+            if r == rank:
+                with h5py.File(path, 'r+') as f:
+                    fill(f)
+        comm.barrier()
+
+
+def _slab(g, key, rank):
+    """Read the rows of process ``rank`` of the per-process array ``key``."""
+    start, stop = g[key + '_offsets'][rank:rank + 2]
+    if start == stop:
+        return np.empty((0,) + g[key].shape[1:], dtype=g[key].dtype)
+    return g[key][start:stop]
+
+
+def _restore_dat(path, g, name, objects, rank, mmap):
+    dataset = _make_object('DataSet', objects[g.attrs['set']], tuple(g.attrs['dim']))
+    kwargs = dict(dtype=np.dtype(g.attrs['dtype']), name=name,
+                  soa=bool(g.attrs['soa']),
+                  compute_dtype=np.dtype(g.attrs['compute_dtype']))
+    slot = g['data']
+    start, stop = g['data_offsets'][rank:rank + 2]
+    offset = getattr(slot.id, 'get_offset', lambda: None)()
+    if mmap and stop > start and offset is not None \
+            and slot.chunks is None and slot.compression is None:
+        dat = _make_object('Dat', dataset, None, **kwargs)
+        # The data of a contiguous dataset in the storage order of the
+        # Dat are mapped straight from the file
+        if dat._order == 'C':
+            rowbytes = slot.dtype.itemsize * int(np.prod(slot.shape[1:]))
+            dat._use_mapped_data(dat._mmap(path, 'c', dat.dtype, dat.shape,
+                                           offset + start * rowbytes))
+            return dat
+    return _make_object('Dat', dataset, _slab(g, 'data', rank), **kwargs)
+
+
+@collective
+def restore(path, mmap=True):
+    """Read the state of a PyOP2 program written by :func:`checkpoint`.
+
+    :arg path: The name of the HDF5 file.
+    :arg mmap: Memory map the data of :class:`Dat`\s copy-on-write rather
+        than reading them, where possible (the default). Data in SoA order
+        are always read.
+    :returns: a dict of the objects read, keyed by name.
+
+    The state must be restored on the same number of processes it was
+    written from, and every process reads only its own data. A restored
+    :class:`Const` must not clash with an existing one.
+    """
+    comm = MPI.comm
+    rank = comm.rank
+    objects = OrderedDict()
+    with timed_region("Checkpoint restore"), open_file(path, 'r', comm) as f:
+        if f.attrs.get('format') != FORMAT:
+            raise ValueError("%s is not a PyOP2 checkpoint" % path)
+        if f.attrs['nranks'] != comm.size:
+            raise ValueError("Checkpoint %s was written on %d processes, cannot restore on %d"
+                             % (path, f.attrs['nranks'], comm.size))
+        for name in sorted(f, key=lambda n: f[n].attrs['index']):
+            # Names must be str rather than unicode
+            name = str(name)
+            g = f[name]
+            kind = g.attrs['kind']
+            if kind == 'Set':
+                halo = None
+                if g.attrs['halo']:
+                    numbering = _slab(g, 'numbering', rank)
+                    halo = Halo(_decode(_slab(g, 'sends', rank)),
+                                _decode(_slab(g, 'receives', rank)),
+                                comm=comm, gnn2unn=numbering if len(numbering) else None)
+                sizes = [int(s) for s in _slab(g, 'sizes', rank)[0]]
+                objects[name] = _make_object('Set', sizes, name, halo=halo)
+            elif kind == 'Map':
+                offset = g['offset'][...] if 'offset' in g else None
+                objects[name] = _make_object('Map', objects[g.attrs['iterset']],
+                                             objects[g.attrs['toset']], int(g.attrs['arity']),
+                                             _slab(g, 'values', rank), name, offset)
+            elif kind == 'Dat':
+                objects[name] = _restore_dat(path, g, name, objects, rank, mmap)
+            elif kind == 'Global':
+                objects[name] = _make_object('Global', tuple(g.attrs['dim']), g['data'][...],
+                                             np.dtype(g.attrs['dtype']), name)
+            else:
+                objects[name] = _make_object('Const', tuple(g.attrs['dim']), g['data'][...],
+                                             name, np.dtype(g.attrs['dtype']))
+    return dict(objects)
@@ -37,8 +37,11 @@ import subprocess
 import sys
 import ctypes
 from hashlib import md5
+from time import time
+from caching import CacheStats
 from configuration import configuration
 from logger import progress, INFO
+from profiling import timed_region
 from exceptions import CompilationError
 
 
@@ -90,18 +93,23 @@ class Compiler(object):
             basenames = MPI.comm.allgather(basename)
             if not all(b == basename for b in basenames):
                 raise CompilationError('Hashes of generated code differ on different ranks')
+        stats = CacheStats("pyop2.compilation.Compiler")
         try:
             # Are we in the cache?
-            return ctypes.CDLL(soname)
+            dll = ctypes.CDLL(soname)
+            stats.hits += 1
+            stats.disk_hits += 1
+            return dll
         except OSError:
             # No, let's go ahead and build
+            start = time()
             if MPI.comm.rank == 0:
                 # No need to do this on all ranks
                 if not os.path.exists(cachedir):
                     os.makedirs(cachedir)
                 logfile = os.path.join(cachedir, "%s.log" % basename)
                 errfile = os.path.join(cachedir, "%s.err" % basename)
-                with progress(INFO, 'Compiling wrapper'):
+                with progress(INFO, 'Compiling wrapper'), timed_region("Compilation"):
                     with file(cname, "w") as f:
                         f.write(src)
                     # Compiler also links
@@ -167,9 +175,14 @@ Compile errors in %s""" % (e.cmd, e.returncode, logfile, errfile))
                     # Atomically ensure soname exists
                     os.rename(tmpname, soname)
             # Wait for compilation to complete
-            MPI.comm.barrier()
+            with timed_region("Compilation wait"):
+                MPI.comm.barrier()
             # Load resulting library
-            return ctypes.CDLL(soname)
+            dll = ctypes.CDLL(soname)
+            stats.misses += 1
+            stats.stores += 1
+            stats.miss_time += time() - start
+            return dll
 
 
 class MacCompiler(Compiler):
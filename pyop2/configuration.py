@@ -62,6 +62,37 @@ class Configuration(object):
     :param print_summary: Should PyOP2 print a summary of timings at
         program exit?
     :param profiling: Profiling mode (CUDA kernels are launched synchronously)
+    :param sparsity_cache: Should PyOP2 cache sparsity patterns on disk
+        (in ``cache_dir``) and memory map them when reused?
+    :param fast_reassembly: Should PyOP2 add element matrices directly
+        into the values array of (serial, scalar CSR) matrices through
+        a precomputed table of offsets, rather than via MatSetValues?
+    :param host_linalg: Should pointwise linear algebra on :class:`Dat`\s
+        (``+``, ``*=``, :meth:`~Dat.inner`, ...) on host backends be
+        computed with NumPy, rather than by generated :func:`par_loop`\s?
+    :param dat_pool_max_bytes: How many bytes of storage of collected
+        temporary :class:`Dat`\s should PyOP2 keep for reuse? Pass `0` to
+        disable reuse.
+    :param soa_min_cdim: From how many components per set element should
+        :class:`Dat`\s created with ``soa="auto"`` be stored in SoA order
+        on host backends? Pass `0` (the default) to always store them in
+        AoS order, which was faster for 4 and 9 components per element in
+        both direct and indirect loops.
+    :param loop_counters: Should PyOP2 record performance counters of
+        each :func:`par_loop` kernel and print them at program exit?
+    :param peak_bandwidth: The peak memory bandwidth of the machine in
+        GB/s, to compare the bandwidth achieved by kernels against.
+    :param hdf5_chunk_size: How many bytes should a
+        :class:`~pyop2.hdf5.PartitionedFile` read from a dataset at once?
+    :param hw_counters: Should PyOP2 count hardware events (cycles,
+        instructions, cache misses) while executing each kernel on the
+        host and print them at program exit?
+    :param track_memory: Should PyOP2 account for the memory held by
+        :class:`Dat`\s, :class:`Map`\s, sparsities, plans, matrices and
+        halo buffers?
+    :param trace_file: Where should PyOP2 write a timeline of runtime
+        events in Chrome trace format at program exit? Empty to disable
+        tracing.
     """
     # name, env variable, type, default, write once
     DEFAULTS = {
@@ -81,6 +112,17 @@ class Configuration(object):
         "print_cache_size": ("PYOP2_PRINT_CACHE_SIZE", bool, False),
         "print_summary": ("PYOP2_PRINT_SUMMARY", bool, False),
         "profiling": ("PYOP2_PROFILING", bool, False),
+        "sparsity_cache": ("PYOP2_SPARSITY_CACHE", bool, False),
+        "fast_reassembly": ("PYOP2_FAST_REASSEMBLY", bool, False),
+        "host_linalg": ("PYOP2_HOST_LINALG", bool, True),
+        "dat_pool_max_bytes": ("PYOP2_DAT_POOL_MAX_BYTES", int, 256 * 1024 ** 2),
+        "soa_min_cdim": ("PYOP2_SOA_MIN_CDIM", int, 0),
+        "loop_counters": ("PYOP2_LOOP_COUNTERS", bool, False),
+        "peak_bandwidth": ("PYOP2_PEAK_BANDWIDTH", float, 0.0),
+        "hdf5_chunk_size": ("PYOP2_HDF5_CHUNK_SIZE", int, 64 * 1024 ** 2),
+        "trace_file": ("PYOP2_TRACE_FILE", str, ""),
+        "track_memory": ("PYOP2_TRACK_MEMORY", bool, True),
+        "hw_counters": ("PYOP2_HW_COUNTERS", bool, False),
         "dump_gencode_path": ("PYOP2_DUMP_GENCODE_PATH", str,
                               os.path.join(gettempdir(), "pyop2-gencode")),
     }
@@ -223,10 +223,24 @@ class DeviceDataMixin(object):
 
 class Dat(DeviceDataMixin, base.Dat):
 
+    # The data live on the device, use generated kernels for linear algebra
+    _host_linalg = False
+    # SoA data are transposed when copied to the device
+    _host_soa = False
+
     def __init__(self, dataset, data=None, dtype=None, name=None,
-                 soa=None, uid=None):
+                 soa=None, uid=None, compute_dtype=None):
         self.state = DeviceDataMixin.DEVICE_UNALLOCATED
-        base.Dat.__init__(self, dataset, data, dtype, name, soa, uid)
+        base.Dat.__init__(self, dataset, data, dtype, name, soa, uid,
+                          compute_dtype=compute_dtype)
+        if self._is_mixed_precision:
+            raise NotImplementedError("Dats with a compute dtype different from their storage dtype are not supported on device backends")
+
+    def _use_mapped_data(self, data):
+        base.Dat._use_mapped_data(self, data)
+        # The mapped host data supersede those on the device
+        if self.state is not DeviceDataMixin.DEVICE_UNALLOCATED:
+            self.state = DeviceDataMixin.HOST
 
     @property
     def array(self):
@@ -0,0 +1,353 @@
+# This file is part of PyOP2
+#
+# PyOP2 is Copyright (c) 2012, Imperial College London and
+# others. Please see the AUTHORS file in the main source directory for
+# a full list of copyright holders.  All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions
+# are met:
+#
+#     * Redistributions of source code must retain the above copyright
+#       notice, this list of conditions and the following disclaimer.
+#     * Redistributions in binary form must reproduce the above copyright
+#       notice, this list of conditions and the following disclaimer in the
+#       documentation and/or other materials provided with the distribution.
+#     * The name of Imperial College London or that of other
+#       contributors may not be used to endorse or promote products
+#       derived from this software without specific prior written
+#       permission.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTERS
+# ''AS IS'' AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT
+# LIMITED TO, THE IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS
+# FOR A PARTICULAR PURPOSE ARE DISCLAIMED. IN NO EVENT SHALL THE
+# COPYRIGHT HOLDERS OR CONTRIBUTORS BE LIABLE FOR ANY DIRECT,
+# INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES
+# (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR
+# SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION)
+# HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT,
+# STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE)
+# ARISING IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED
+# OF THE POSSIBILITY OF SUCH DAMAGE.
+
+
+"""Partitioned reading of PyOP2 data structures from HDF5 files.
+
+:meth:`Set.fromhdf5`, :meth:`Map.fromhdf5` and :meth:`Dat.fromhdf5`
+read entire datasets on every process. A :class:`PartitionedFile`
+instead reads only the rows of each dataset a process needs, given a
+partition vector assigning every set element to its owning process, and
+builds :class:`Set`\s with local numbering and :class:`Halo`\s from it.
+"""
+
+import numpy as np
+
+from backends import _make_object
+from base import DataSet, Halo
+from configuration import configuration
+from exceptions import ArityTypeError, SetValueError, SizeTypeError
+from mpi import MPI, _check_comm, collective
+from profiling import timed_function
+
+
+@collective
+def open_file(filename, mode, comm):
+    """Open the HDF5 file ``filename`` on all processes of ``comm``, with
+    the ``mpio`` driver (MPI-IO) if :mod:`h5py` was built with MPI
+    support."""
+    import h5py
+    if comm.size > 1 and h5py.get_config().mpi:
+        return h5py.File(filename, mode, driver='mpio', comm=comm)
+    return h5py.File(filename, mode)
+
+
+def _lookup(gids, query):
+    """Return the positions of the global numbers ``query`` in ``gids``,
+    all of which must be present."""
+    order = np.argsort(gids, kind='mergesort')
+    return order[np.searchsorted(gids, query, sorter=order)].astype(np.int32)
+
+
+def _group(ranks, values):
+    """Group ``values`` by the process in ``ranks``, returning a dict of
+    sorted arrays of unique values keyed by process."""
+    return dict((int(r), np.unique(values[ranks == r])) for r in np.unique(ranks))
+
+
+def _exchange(comm, send):
+    """Send the arrays in the dict ``send`` to the processes they are
+    keyed by and return a dict of the non-empty arrays received, keyed
+    by the sending process."""
+    empty = np.empty(0, dtype=np.int64)
+    recv = comm.alltoall([send.get(r, empty) for r in range(comm.size)])
+    return dict((r, np.asarray(a)) for r, a in enumerate(recv) if len(a) > 0)
+
+
+def _build_halo(comm, gids, nowned, requests, incoming):
+    """Build the :class:`Halo` of a set.
+
+    :arg gids: global numbers of the local set elements in local order.
+    :arg nowned: the number of owned set elements.
+    :arg requests: dict of the global numbers of halo elements, keyed by
+        the owning process.
+    :arg incoming: dict of the global numbers of owned elements other
+        processes hold in their halo, keyed by process.
+    """
+    sends = dict((r, _lookup(gids[:nowned], g)) for r, g in incoming.iteritems())
+    receives = dict((r, nowned + _lookup(gids[nowned:], g))
+                    for r, g in requests.iteritems())
+    # Number owned elements contiguously across processes and fetch the
+    # numbers of halo elements from their owners
+    offset = comm.scan(nowned) - nowned
+    numbers = _exchange(comm, dict((r, offset + s) for r, s in sends.iteritems()))
+    gnn2unn = np.empty(len(gids), dtype=np.int32)
+    gnn2unn[:nowned] = offset + np.arange(nowned)
+    for r, n in numbers.iteritems():
+        gnn2unn[receives[r]] = n
+    return Halo(sends, receives, comm=comm, gnn2unn=gnn2unn)
+
+
+class _Partition(object):
+
+    """A partition vector distributed over the processes of ``comm`` in
+    contiguous blocks: process ``r`` holds the owning processes of the
+    set elements ``offsets[r]`` to ``offsets[r + 1]`` in ``block``."""
+
+    def __init__(self, comm, offsets, block):
+        self.comm = comm
+        self.offsets = offsets
+        self.block = block
+
+    @collective
+    def owned(self):
+        """The sorted global numbers of the elements this process owns."""
+        lo = self.offsets[self.comm.rank]
+        gids = lo + np.arange(len(self.block), dtype=np.int64)
+        recv = _exchange(self.comm, _group(self.block, gids))
+        return np.sort(np.concatenate([np.empty(0, dtype=np.int64)] + recv.values()))
+
+    @collective
+    def owners(self, query):
+        """The owning processes of the elements with the global numbers
+        ``query``, fetched from the processes holding them."""
+        query = np.asarray(query, dtype=np.int64)
+        flat = query.reshape(-1)
+        holders = np.searchsorted(self.offsets, flat, side='right') - 1
+        asked = _group(holders, flat)
+        lo = self.offsets[self.comm.rank]
+        requests = _exchange(self.comm, asked)
+        replies = _exchange(self.comm, dict((r, self.block[q - lo])
+                                            for r, q in requests.iteritems()))
+        owners = np.empty(len(flat), dtype=self.block.dtype)
+        for r, q in asked.iteritems():
+            mask = holders == r
+            owners[mask] = replies[r][np.searchsorted(q, flat[mask])]
+        return owners.reshape(query.shape)
+
+
+class PartitionedFile(object):
+
+    """An HDF5 file from which every process reads only its partition.
+
+    :param f: An open :class:`h5py.File` or the name of an HDF5 file. A
+        named file is opened with the ``mpio`` driver (MPI-IO) if
+        :mod:`h5py` was built with MPI support.
+    :param comm: The MPI communicator (optional, defaults to the PyOP2
+        communicator).
+
+    The file uses the layout of :meth:`Set.fromhdf5`,
+    :meth:`Map.fromhdf5` and :meth:`Dat.fromhdf5`: a :class:`Set` is a
+    dataset holding its global size, a :class:`Map` a dataset of shape
+    ``(iterset size, arity)`` and a :class:`Dat` a dataset with one row
+    per set element. Rows are read in slabs of at most
+    ``configuration['hdf5_chunk_size']`` bytes covering only the rows
+    required. :class:`Const`\s are global and are read with
+    :meth:`Const.fromhdf5`.
+
+    A mesh is loaded by giving the owning process of each element of the
+    iteration set and target set of a :class:`Map` (see :meth:`load`),
+    after which :class:`Dat`\s on those sets can be read (see
+    :meth:`dat`): ::
+
+      f = PartitionedFile('mesh.h5')
+      cells, nodes, cell_node = f.load('cells', 'nodes', 'cell_node',
+                                       'cell_partition', 'node_partition')
+      coords = f.dat(op2.DataSet(nodes, 2), 'coords')
+    """
+
+    def __init__(self, f, comm=None):
+        self._comm = _check_comm(comm) if comm is not None else MPI.comm
+        self._owns_file = isinstance(f, basestring)
+        self._f = open_file(f, 'r', self._comm) if self._owns_file else f
+        self._numbering = {}
+
+    @property
+    def comm(self):
+        """The MPI communicator this file is read with."""
+        return self._comm
+
+    def close(self):
+        """Close the file if it was opened by this :class:`PartitionedFile`."""
+        if self._owns_file:
+            self._f.close()
+
+    def numbering(self, set):
+        """The global numbers of the elements of a :class:`Set` loaded
+        from this file, in local order."""
+        try:
+            return self._numbering[set]
+        except KeyError:
+            raise SetValueError("Set %s was not loaded from this file" % set.name)
+
+    def read_rows(self, name, rows):
+        """Read the rows ``rows`` of the dataset named ``name``.
+
+        :arg rows: the global row indices to read, in any order.
+        :returns: an array of the rows in the order requested.
+        """
+        slot = self._f[name]
+        rows = np.asarray(rows, dtype=np.int64)
+        out = np.empty((len(rows),) + slot.shape[1:], dtype=slot.dtype)
+        if len(rows) == 0:
+            return out
+        order = np.argsort(rows, kind='mergesort')
+        srows = rows[order]
+        if srows[0] < 0 or srows[-1] >= slot.shape[0]:
+            raise IndexError("Rows out of range for dataset %s of length %d"
+                             % (name, slot.shape[0]))
+        step = max(1, configuration['hdf5_chunk_size'] //
+                   max(1, slot.dtype.itemsize * int(np.prod(slot.shape[1:]))))
+        lo = 0
+        while lo < len(srows):
+            # Read the slab from the next row required, skipping any gap
+            start = srows[lo]
+            hi = np.searchsorted(srows, start + step)
+            slab = slot[start:srows[hi - 1] + 1]
+            out[order[lo:hi]] = slab[srows[lo:hi] - start]
+            lo = hi
+        return out
+
+    def _size(self, name):
+        slot = self._f[name]
+        if slot.shape != (1,):
+            raise SizeTypeError("Shape of %s is incorrect" % name)
+        return int(slot[0])
+
+    @collective
+    def _partition(self, partition, size):
+        """Distribute the partition vector of a set of ``size`` elements
+        in contiguous blocks over the processes. Only the block of each
+        process is read if ``partition`` names a dataset."""
+        comm = self.comm
+        offsets = np.array([size * r // comm.size for r in range(comm.size + 1)],
+                           dtype=np.int64)
+        rows = np.arange(offsets[comm.rank], offsets[comm.rank + 1])
+        if isinstance(partition, basestring):
+            length = len(self._f[partition])
+            if length == size:
+                block = self.read_rows(partition, rows).reshape(-1)
+        else:
+            partition = np.asarray(partition).reshape(-1)
+            length = len(partition)
+            block = partition[rows]
+        if length != size:
+            raise SizeTypeError("Partition vector has %d entries, set has %d"
+                                % (length, size))
+        invalid = len(block) > 0 and (block.min() < 0 or block.max() >= comm.size)
+        if comm.allreduce(int(invalid)):
+            raise SetValueError("Partition vector refers to nonexistent processes")
+        return _Partition(comm, offsets, block)
+
+    @collective
+    @timed_function("Load partitioned mesh")
+    def load(self, iterset, toset, map, iterset_partition, toset_partition):
+        """Load the :class:`Map` named ``map`` between the sets named
+        ``iterset`` and ``toset``, distributed by partition vectors.
+
+        :arg iterset: The name of the iteration set in the file.
+        :arg toset: The name of the target set in the file.
+        :arg map: The name of the map in the file.
+        :arg iterset_partition: The owning process of each element of the
+            iteration set, as an array or the name of a dataset in the
+            file, of which every process reads a contiguous block.
+        :arg toset_partition: The owning process of each element of the
+            target set, as for ``iterset_partition``.
+        :returns: a tuple of the iteration :class:`Set`, the target
+            :class:`Set` and the :class:`Map`.
+
+        Each process reads the map rows of the iteration set elements it
+        owns, and of those it executes redundantly because they touch
+        target set elements it owns (the exec halo). Target set elements
+        referenced but not owned form the target set halo. Local
+        elements are numbered core first, then owned, then halo, and
+        both :class:`Set`\s get a :class:`Halo` when running in parallel.
+        """
+        comm = self.comm
+        rank = comm.rank
+        ipart = self._partition(iterset_partition, self._size(iterset))
+        tpart = self._partition(toset_partition, self._size(toset))
+        arity = self._f[map].shape[1:]
+        if len(arity) != 1:
+            raise ArityTypeError("Unrecognised arity value %s" % arity)
+
+        # Owned iteration set elements touching target set elements owned
+        # by another process are in the exec halo of that process
+        iowned = ipart.owned()
+        ivalues = self.read_rows(map, iowned)
+        iowners = tpart.owners(ivalues)
+        rows, cols = np.nonzero(iowners != rank)
+        isends = _group(iowners[rows, cols], iowned[rows])
+        irecvs = _exchange(comm, isends)
+        iexec = np.unique(np.concatenate([np.empty(0, dtype=np.int64)] +
+                                         irecvs.values()))
+        xvalues = self.read_rows(map, iexec)
+
+        # Target set elements referenced by local iteration set elements
+        # but owned by another process are in the halo
+        touched = np.concatenate((ivalues.reshape(-1), xvalues.reshape(-1)))
+        towners = tpart.owners(touched)
+        remote = towners != rank
+        tnonexec = np.unique(touched[remote])
+        trecvs = _group(towners[remote], touched[remote])
+        tsends = _exchange(comm, trecvs)
+        towned = tpart.owned()
+
+        def renumber(owned, halo, sends):
+            # Owned elements sent to no other process are core
+            sent = np.concatenate([np.empty(0, dtype=np.int64)] + sends.values())
+            core = ~np.in1d(owned, sent)
+            gids = np.concatenate((owned[core], owned[~core], halo))
+            return gids, core, np.count_nonzero(core)
+
+        igids, icore, nicore = renumber(iowned, iexec, isends)
+        tgids, _, ntcore = renumber(towned, tnonexec, tsends)
+        ihalo = thalo = None
+        if comm.size > 1:
+            ihalo = _build_halo(comm, igids, len(iowned), irecvs, isends)
+            thalo = _build_halo(comm, tgids, len(towned), trecvs, tsends)
+        isizes = [nicore, len(iowned), len(igids), len(igids)]
+        tsizes = [ntcore, len(towned), len(towned), len(tgids)]
+        iset = _make_object('Set', isizes, iterset, halo=ihalo)
+        tset = _make_object('Set', tsizes, toset, halo=thalo)
+        self._numbering[iset] = igids
+        self._numbering[tset] = tgids
+
+        values = np.concatenate((ivalues[icore], ivalues[~icore], xvalues))
+        values = _lookup(tgids, values.reshape(-1)).reshape(values.shape)
+        return iset, tset, _make_object('Map', iset, tset, arity[0], values, map)
+
+    @collective
+    def dat(self, dataset, name):
+        """Read the :class:`Dat` named ``name`` on a :class:`Set` loaded
+        with :meth:`load`, reading only the rows of local set elements.
+
+        :arg dataset: The :class:`DataSet` (or :class:`Set`) of the
+            :class:`Dat`.
+        :arg name: The name of the dataset in the file.
+        """
+        set = dataset.set if isinstance(dataset, DataSet) else dataset
+        slot = self._f[name]
+        data = self.read_rows(name, self.numbering(set))
+        soa = slot.attrs.get('type', '').find(':soa') > 0
+        return _make_object('Dat', dataset, data, name=name, soa=soa)
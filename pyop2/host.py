@@ -41,6 +41,7 @@ import compilation
 from base import *
 from mpi import collective
 from configuration import configuration
+from profiling import timed_region
 from utils import as_tuple
 
 from coffee.base import Node
@@ -91,16 +92,76 @@ class Arg(base.Arg):
     def c_offset_name(self, i, j):
         return self.c_arg_name() + "_off%d_%d" % (i, j)
 
+    @property
+    def _uses_csr_offsets(self):
+        """Is this matrix argument assembled by adding directly into the
+        values array of the matrix, through the table of offsets given
+        by :meth:`Sparsity._insertion_offsets`?
+
+        This is only the case for scalar CSR (serial AIJ) matrices and
+        non-extruded iteration with either scalar fields or flattened
+        vector fields, otherwise we fall back to MatSetValues."""
+        if not (configuration['fast_reassembly'] and self._is_mat) or self._is_mixed_mat:
+            return False
+        return MPI.comm.size == 1 and not self.data.sparsity.block_sparse and \
+            not self.map[0].iterset._extruded and \
+            (self.data._is_scalar_field or self._flatten)
+
+    def c_offsets_name(self):
+        return self.c_arg_name() + "_offsets"
+
+    @property
+    def _is_soa_storage(self):
+        """Are the data of (any component of) this argument stored in SoA
+        order?"""
+        return self._is_dat and self.data._soa_storage
+
+    @property
+    def _is_strided(self):
+        """Is this argument passed to the kernel straight from its SoA
+        storage?  The kernel indexes the components of direct arguments
+        of :class:`Dat`\s created with ``soa=True`` with ``OP2_STRIDE``."""
+        return self._is_direct and not self._is_mixed and \
+            self._is_soa_storage and self.data._op2_stride and \
+            not self._is_mixed_precision
+
+    @property
+    def _is_staged(self):
+        """Is this argument passed to the kernel through a staging buffer,
+        since the kernel sees the data in a different precision or layout
+        than they are stored in? Arguments accessed in an iteration space
+        are already gathered into a buffer."""
+        return self._is_mixed_precision or \
+            (self._is_soa_storage and not (self._uses_itspace or self._is_strided))
+
+    def c_stride_name(self, i=0):
+        return self.c_arg_name(i) + "_stride"
+
+    def c_component(self, j, i=0):
+        """The offset of component ``j`` of an element of component ``i``
+        of the data."""
+        if self.data[i]._soa_storage:
+            return "%s * %s" % (j, self.c_stride_name(i))
+        return str(j)
+
+    def _elem_stride(self, i=0):
+        """The offset between consecutive elements of component ``i`` of
+        the data."""
+        return 1 if self.data[i]._soa_storage else self.data[i].cdim
+
     def c_wrapper_arg(self):
         if self._is_mat:
             val = "Mat %s_" % self.c_arg_name()
         else:
-            val = ', '.join(["%s *%s" % (self.ctype, self.c_arg_name(i))
-                             for i in range(len(self.data))])
+            val = ', '.join(["%s *%s" % (self.ctype, self.c_arg_name(i)) +
+                             (", int %s" % self.c_stride_name(i) if d._soa_storage else "")
+                             for i, d in enumerate(self.data)])
         if self._is_indirect or self._is_mat:
             for i, map in enumerate(as_tuple(self.map, Map)):
                 for j, m in enumerate(map):
                     val += ", int *%s" % self.c_map_name(i, j)
+        if self._uses_csr_offsets:
+            val += ", int *%s" % self.c_offsets_name()
         return val
 
     def c_vec_dec(self, is_facet=False):
@@ -124,8 +185,19 @@ class Arg(base.Arg):
         elif self._is_mat:
             val += "Mat %(iname)s = %(name)s_;\n" % {'name': self.c_arg_name(),
                                                      'iname': self.c_arg_name(0, 0)}
+            if self._uses_csr_offsets:
+                val += "PetscScalar *%(name)s_vals;\nMatSeqAIJGetArray(%(iname)s, &%(name)s_vals);\n" % \
+                    {'name': self.c_arg_name(),
+                     'iname': self.c_arg_name(0, 0)}
         return val
 
+    def c_wrapper_finalise(self):
+        if self._uses_csr_offsets:
+            return "MatSeqAIJRestoreArray(%(iname)s, &%(name)s_vals)" % \
+                {'name': self.c_arg_name(),
+                 'iname': self.c_arg_name(0, 0)}
+        return ""
+
     def c_ind_data(self, idx, i, j=0, is_top=False, layers=1, offset=None):
         return "%(name)s + (%(map_name)s[i * %(arity)s + %(idx)s]%(top)s%(off_mul)s%(off_add)s)* %(dim)s%(off)s" % \
             {'name': self.c_arg_name(i),
@@ -133,8 +205,8 @@ class Arg(base.Arg):
              'arity': self.map.split[i].arity,
              'idx': idx,
              'top': ' + start_layer' if is_top else '',
-             'dim': self.data[i].cdim,
-             'off': ' + %d' % j if j else '',
+             'dim': self._elem_stride(i),
+             'off': ' + %s' % self.c_component(j, i) if j else '',
              'off_mul': ' * %d' % offset if is_top and offset is not None else '',
              'off_add': ' + %d' % offset if not is_top and offset is not None else ''}
 
@@ -144,8 +216,8 @@ class Arg(base.Arg):
              'map_name': self.c_map_name(i, 0),
              'idx': idx,
              'top': ' + start_layer' if is_top else '',
-             'dim': 1 if self._flatten else str(self.data[i].cdim),
-             'off': ' + %d' % j if j else '',
+             'dim': 1 if self._flatten else self._elem_stride(i),
+             'off': ' + %s' % self.c_component(j, i) if j else '',
              'offset': ' * _'+self.c_offset_name(i, 0)+'['+idx+']' if is_top else ''}
 
     def c_kernel_arg_name(self, i, j):
@@ -158,6 +230,8 @@ class Arg(base.Arg):
         return self.c_kernel_arg_name(i, j)
 
     def c_kernel_arg(self, count, i=0, j=0, shape=(0,), is_top=False, layers=1):
+        if self._is_staged:
+            return self.c_staging_vec_name() if self._is_vec_map else self.c_staging_name()
         if self._uses_itspace:
             if self._is_mat:
                 if self.data[i, j]._is_vector_field:
@@ -173,11 +247,12 @@ class Arg(base.Arg):
                 if self.data is not None and self.data.dataset._extruded:
                     return self.c_ind_data_xtr("i_%d" % self.idx.index, i, is_top=is_top, layers=layers)
                 elif self._flatten:
-                    return "%(name)s + %(map_name)s[i * %(arity)s + i_0 %% %(arity)d] * %(dim)s + (i_0 / %(arity)d)" % \
+                    return "%(name)s + %(map_name)s[i * %(arity)s + i_0 %% %(arity)d] * %(dim)s + %(cmpt)s" % \
                         {'name': self.c_arg_name(),
                          'map_name': self.c_map_name(0, i),
                          'arity': self.map.arity,
-                         'dim': self.data[i].cdim}
+                         'dim': self._elem_stride(i),
+                         'cmpt': self.c_component("(i_0 / %d)" % self.map.arity, i)}
                 else:
                     return self.c_ind_data("i_%d" % self.idx.index, i)
         elif self._is_indirect:
@@ -188,23 +263,22 @@ class Arg(base.Arg):
             return self.c_global_reduction_name(count)
         elif isinstance(self.data, Global):
             return self.c_arg_name(i)
+        elif self._is_strided:
+            return "%s + i" % self.c_arg_name(i)
         else:
             return "%(name)s + i * %(dim)s" % {'name': self.c_arg_name(i),
                                                'dim': self.data[i].cdim}
 
-    def c_vec_init(self, is_top, layers, is_facet=False):
+    def _c_vec_entries(self, is_top, layers, is_facet=False):
+        """The pointers into the data the entries of the vector of
+        pointers passed to the kernel point to, in order."""
         val = []
-        vec_idx = 0
         for i, (m, d) in enumerate(zip(self.map, self.data)):
             if self._flatten:
                 for k in range(d.dataset.cdim):
                     for idx in range(m.arity):
-                        val.append("%(vec_name)s[%(idx)s] = %(data)s" %
-                                   {'vec_name': self.c_vec_name(),
-                                    'idx': vec_idx,
-                                    'data': self.c_ind_data(idx, i, k, is_top=is_top, layers=layers,
-                                                            offset=m.offset[idx] if is_top else None)})
-                        vec_idx += 1
+                        val.append(self.c_ind_data(idx, i, k, is_top=is_top, layers=layers,
+                                                   offset=m.offset[idx] if is_top else None))
                     # In the case of interior horizontal facets the map for the
                     # vertical does not exist so it has to be dynamically
                     # created by adding the offset to the map of the current
@@ -213,29 +287,109 @@ class Arg(base.Arg):
                     # to stage in the data for the entire map spanning the facet.
                     if is_facet:
                         for idx in range(m.arity):
-                            val.append("%(vec_name)s[%(idx)s] = %(data)s" %
-                                       {'vec_name': self.c_vec_name(),
-                                        'idx': vec_idx,
-                                        'data': self.c_ind_data(idx, i, k, is_top=is_top, layers=layers,
-                                                                offset=m.offset[idx])})
-                            vec_idx += 1
+                            val.append(self.c_ind_data(idx, i, k, is_top=is_top, layers=layers,
+                                                       offset=m.offset[idx]))
             else:
                 for idx in range(m.arity):
-                    val.append("%(vec_name)s[%(idx)s] = %(data)s" %
-                               {'vec_name': self.c_vec_name(),
-                                'idx': vec_idx,
-                                'data': self.c_ind_data(idx, i, is_top=is_top, layers=layers,
-                                                        offset=m.offset[idx] if is_top else None)})
-                    vec_idx += 1
+                    val.append(self.c_ind_data(idx, i, is_top=is_top, layers=layers,
+                                               offset=m.offset[idx] if is_top else None))
                 if is_facet:
                     for idx in range(m.arity):
-                        val.append("%(vec_name)s[%(idx)s] = %(data)s" %
-                                   {'vec_name': self.c_vec_name(),
-                                    'idx': vec_idx,
-                                    'data': self.c_ind_data(idx, i, is_top=is_top, layers=layers,
-                                                            offset=m.offset[idx])})
-                        vec_idx += 1
-        return ";\n".join(val)
+                        val.append(self.c_ind_data(idx, i, is_top=is_top, layers=layers,
+                                                   offset=m.offset[idx]))
+        return val
+
+    def c_vec_init(self, is_top, layers, is_facet=False):
+        return ";\n".join(["%(vec_name)s[%(idx)s] = %(data)s" %
+                           {'vec_name': self.c_vec_name(),
+                            'idx': idx,
+                            'data': data}
+                           for idx, data in enumerate(self._c_vec_entries(is_top, layers, is_facet))])
+
+    def c_staging_name(self):
+        return self.c_arg_name() + "_cast"
+
+    def c_staging_vec_name(self):
+        return self.c_staging_name() + "_vec"
+
+    def _c_staged_data(self, is_facet=False):
+        """The pointers to the stored data staged for the kernel, each with
+        the component of the data it points into, the number of values at
+        it and their offset in the staging buffer."""
+        if self._is_vec_map:
+            # Staged from the vector of pointers into the stored data,
+            # which is offset for each layer of an extruded set
+            comps = []
+            for i, (m, d) in enumerate(zip(self.map, self.data)):
+                n = m.arity * (d.cdim if self._flatten else 1) * (2 if is_facet else 1)
+                comps += [(i, 1 if self._flatten else d.cdim)] * n
+            data = ["%s[%d]" % (self.c_vec_name(), idx) for idx in range(len(comps))]
+        elif self._is_indirect:
+            comps, data = [(0, self.data.cdim)], [self.c_ind_data(self.idx, 0)]
+        else:
+            comps = [(0, self.data.cdim)]
+            data = ["%s + i * %d" % (self.c_arg_name(), self._elem_stride())]
+        val = []
+        ofs = 0
+        for d, (i, dim) in zip(data, comps):
+            val.append((d, i, dim, ofs))
+            ofs += dim
+        return val
+
+    def c_staging_dec(self, is_facet=False):
+        """Declare the buffer holding the data of the argument as the
+        kernel sees them, and point the entries of the vector of pointers
+        passed to the kernel into it."""
+        data = self._c_staged_data(is_facet)
+        val = "%(type)s %(name)s[%(size)d]" % \
+            {'type': self.data.compute_ctype,
+             'name': self.c_staging_name(),
+             'size': sum(dim for _, _, dim, _ in data)}
+        if self._is_vec_map:
+            val += ";\n%(type)s *%(vec_name)s[%(size)d];\n" % \
+                {'type': self.data.compute_ctype,
+                 'vec_name': self.c_staging_vec_name(),
+                 'size': len(data)}
+            val += ";\n".join(["%(vec_name)s[%(idx)d] = %(name)s + %(ofs)d" %
+                               {'vec_name': self.c_staging_vec_name(),
+                                'idx': idx,
+                                'name': self.c_staging_name(),
+                                'ofs': ofs}
+                               for idx, (_, _, _, ofs) in enumerate(data)])
+        return val
+
+    def c_staging_gather(self, is_facet=False):
+        """Copy the stored data into the staging buffer, converting them
+        to the compute precision, or zero it if the data are not read."""
+        data = self._c_staged_data(is_facet)
+        if self.access._mode in ['WRITE', 'INC']:
+            return "for (int c_ = 0; c_ < %(size)d; ++c_) %(name)s[c_] = (%(type)s)0" % \
+                {'size': sum(dim for _, _, dim, _ in data),
+                 'name': self.c_staging_name(),
+                 'type': self.data.compute_ctype}
+        return ";\n".join(["for (int c_ = 0; c_ < %(dim)d; ++c_) %(name)s[%(ofs)d + c_] = (%(type)s)(%(data)s)[%(cmpt)s]" %
+                           {'dim': dim,
+                            'name': self.c_staging_name(),
+                            'ofs': ofs,
+                            'type': self.data.compute_ctype,
+                            'data': d,
+                            'cmpt': self.c_component("c_", i)}
+                           for d, i, dim, ofs in data])
+
+    def c_staging_scatter(self, is_facet=False):
+        """Copy the values the kernel wrote or incremented back to the
+        stored data, converting them to the storage precision."""
+        if self.access._mode not in ['WRITE', 'RW', 'INC']:
+            return ""
+        return ";\n".join(["for (int c_ = 0; c_ < %(dim)d; ++c_) (%(data)s)[%(cmpt)s] %(op)s (%(type)s)%(name)s[%(ofs)d + c_]" %
+                           {'dim': dim,
+                            'data': d,
+                            'cmpt': self.c_component("c_", i),
+                            'op': "+=" if self.access._mode == 'INC' else "=",
+                            'type': self.ctype,
+                            'name': self.c_staging_name(),
+                            'ofs': ofs}
+                           for d, i, dim, ofs in self._c_staged_data(is_facet)])
 
     def c_addto_scalar_field(self, i, j, buf_name, extruded=None, is_facet=False):
         maps = as_tuple(self.map, Map)
@@ -257,6 +411,50 @@ class Arg(base.Arg):
              'cols': cols_str,
              'insert': self.access == WRITE}
 
+    def c_addto_vector_field_blocked(self, i, j, buf_name, extruded=None):
+        """Insert the whole element matrix for block ``(i, j)`` of a
+        blocked matrix with a single call, rather than entry by entry."""
+        maps = as_tuple(self.map, Map)
+        nrows = maps[0].split[i].arity
+        ncols = maps[1].split[j].arity
+        rdim, cdim = self.data.sparsity[i, j].dims
+        rows_str = "%s + i * %s" % (self.c_map_name(0, i), nrows)
+        cols_str = "%s + i * %s" % (self.c_map_name(1, j), ncols)
+
+        if extruded is not None:
+            rows_str = extruded + self.c_map_name(0, i)
+            cols_str = extruded + self.c_map_name(1, j)
+
+        return 'addto_vector_blocked(%(mat)s, %(vals)s, %(nrows)s, %(rows)s, %(ncols)s, %(cols)s, %(rdim)s, %(cdim)s, %(insert)d)' % \
+            {'mat': self.c_arg_name(i, j),
+             'vals': buf_name,
+             'nrows': nrows,
+             'ncols': ncols,
+             'rows': rows_str,
+             'cols': cols_str,
+             'rdim': rdim,
+             'cdim': cdim,
+             'insert': self.access == WRITE}
+
+    def c_addto_csr(self, buf_name):
+        """Add the element matrix directly into the values array of the
+        matrix, through the precomputed table of offsets."""
+        maps = as_tuple(self.map, Map)
+        rdim, cdim = self.data.sparsity.dims
+        size = maps[0].arity * rdim * maps[1].arity * cdim
+        return 'addto_csr(%(vals)s, %(offsets)s + i * %(size)s, %(buf)s, %(size)s, %(insert)d)' % \
+            {'vals': self.c_arg_name() + "_vals",
+             'offsets': self.c_offsets_name(),
+             'buf': buf_name,
+             'size': size,
+             'insert': self.access == WRITE}
+
+    def _is_blocked_addto(self, i, j, is_facet=False):
+        """Can block ``(i, j)`` of this matrix argument be inserted
+        with :meth:`c_addto_vector_field_blocked`?"""
+        return self._is_mat and self._flatten and not is_facet and \
+            self.data[i, j]._is_vector_field and self.data.sparsity[i, j].block_sparse
+
     def c_addto_vector_field(self, i, j, buf_name, indices, xtr="", is_facet=False):
         maps = as_tuple(self.map, Map)
         nrows = maps[0].split[i].arity
@@ -339,7 +537,7 @@ class Arg(base.Arg):
                                 'i': idx,
                                 'j': vec_idx,
                                 'offset': self.c_offset_name(i, 0),
-                                'dim': d.dataset.cdim})
+                                'dim': self._elem_stride(i)})
                     vec_idx += 1
                 if is_facet:
                     for idx in range(m.arity):
@@ -348,7 +546,7 @@ class Arg(base.Arg):
                                     'i': idx,
                                     'j': vec_idx,
                                     'offset': self.c_offset_name(i, 0),
-                                    'dim': d.dataset.cdim})
+                                    'dim': self._elem_stride(i)})
                         vec_idx += 1
         return '\n'.join(val)+'\n'
 
@@ -418,9 +616,9 @@ for ( int i = 0; i < %(dim)s; i++ ) %(combine)s;
                                        {'name': self.c_map_name(i, j),
                                         'dim': m.arity,
                                         'ind': idx,
-                                        'dat_dim': d.cdim,
+                                        'dat_dim': self._elem_stride(j),
                                         'ind_flat': m.arity * k + idx,
-                                        'offset': ' + '+str(k) if k > 0 else '',
+                                        'offset': ' + ' + self.c_component(k, j) if k > 0 else '',
                                         'off_top': ' + start_layer * '+str(m.offset[idx]) if is_top else ''})
                     else:
                         val.append("xtr_%(name)s[%(ind)s] = *(%(name)s + i * %(dim)s + %(ind)s)%(off_top)s;" %
@@ -436,9 +634,9 @@ for ( int i = 0; i < %(dim)s; i++ ) %(combine)s;
                                            {'name': self.c_map_name(i, j),
                                             'dim': m.arity,
                                             'ind': idx,
-                                            'dat_dim': d.cdim,
+                                            'dat_dim': self._elem_stride(j),
                                             'ind_flat': m.arity * (k + d.cdim) + idx,
-                                            'offset': ' + '+str(k) if k > 0 else '',
+                                            'offset': ' + ' + self.c_component(k, j) if k > 0 else '',
                                             'off': ' + ' + str(m.offset[idx])})
                         else:
                             val.append("xtr_%(name)s[%(ind)s] = *(%(name)s + i * %(dim)s + %(ind_zero)s)%(off_top)s%(off)s;" %
@@ -518,7 +716,7 @@ for ( int i = 0; i < %(dim)s; i++ ) %(combine)s;
                                         'off': self.c_offset_name(i, j),
                                         'ind': idx,
                                         'ind_flat': m.arity * k + idx,
-                                        'dim': d.cdim})
+                                        'dim': self._elem_stride(j)})
                     else:
                         val.append("xtr_%(name)s[%(ind)s] += %(off)s[%(ind)s];" %
                                    {'name': self.c_map_name(i, j),
@@ -533,7 +731,7 @@ for ( int i = 0; i < %(dim)s; i++ ) %(combine)s;
                                             'off': self.c_offset_name(i, j),
                                             'ind': idx,
                                             'ind_flat': m.arity * (k + d.cdim) + idx,
-                                            'dim': d.cdim})
+                                            'dim': self._elem_stride(j)})
                         else:
                             val.append("xtr_%(name)s[%(ind)s] += %(off)s[%(ind_zero)s];" %
                                        {'name': self.c_map_name(i, j),
@@ -569,11 +767,12 @@ for ( int i = 0; i < %(dim)s; i++ ) %(combine)s;
 
     def c_buffer_gather(self, size, idx, buf_name):
         dim = 1 if self._flatten else self.data.cdim
-        return ";\n".join(["%(name)s[i_0*%(dim)d%(ofs)s] = *(%(ind)s%(ofs)s);\n" %
+        return ";\n".join(["%(name)s[i_0*%(dim)d%(ofs)s] = *(%(ind)s%(cmpt)s);\n" %
                            {"name": buf_name,
                             "dim": dim,
                             "ind": self.c_kernel_arg(idx),
-                            "ofs": " + %s" % j if j else ""} for j in range(dim)])
+                            "ofs": " + %s" % j if j else "",
+                            "cmpt": " + %s" % self.c_component(j) if j else ""} for j in range(dim)])
 
     def c_buffer_scatter_mm(self, i, j, mxofs, buf_name, buf_scat_name):
         return "%(name_scat)s[i_0][i_1] = %(buf_name)s[%(row)d + i_0][%(col)d + i_1];" % \
@@ -584,11 +783,12 @@ for ( int i = 0; i < %(dim)s; i++ ) %(combine)s;
 
     def c_buffer_scatter_vec(self, count, i, j, mxofs, buf_name):
         dim = 1 if self._flatten else self.data.split[i].cdim
-        return ";\n".join(["*(%(ind)s%(nfofs)s) %(op)s %(name)s[i_0*%(dim)d%(nfofs)s%(mxofs)s]" %
+        return ";\n".join(["*(%(ind)s%(cmpt)s) %(op)s %(name)s[i_0*%(dim)d%(nfofs)s%(mxofs)s]" %
                            {"ind": self.c_kernel_arg(count, i, j),
                             "op": "=" if self._access._mode == "WRITE" else "+=",
                             "name": buf_name,
                             "dim": dim,
+                            "cmpt": " + %s" % self.c_component(o, i) if o else "",
                             "nfofs": " + %d" % o if o else "",
                             "mxofs": " + %d" % (mxofs[0] * dim) if mxofs else ""}
                            for o in range(dim)])
@@ -661,29 +861,31 @@ class JITModule(base.JITModule):
                 externc_open = 'extern "C" {'
                 externc_close = '}'
         headers = "\n".join([compiler.get('vect_header', ""), blas_header])
-        if any(arg._is_soa for arg in self._args):
-            kernel_code = """
-            #define OP2_STRIDE(a, idx) a[idx]
-            %(header)s
-            %(namespace)s
-            %(externc_open)s
-            %(code)s
-            #undef OP2_STRIDE
-            """ % {'code': self._kernel.code,
-                   'externc_open': externc_open,
-                   'namespace': blas_namespace,
-                   'header': headers}
-        else:
-            kernel_code = """
-            %(header)s
-            %(namespace)s
-            %(externc_open)s
-            %(code)s
-            """ % {'code': self._kernel.code,
-                   'externc_open': externc_open,
-                   'namespace': blas_namespace,
-                   'header': headers}
-        code_to_compile = strip(dedent(self._wrapper) % self.generate_code())
+        op2_stride, op2_stride_undef = "", ""
+        if any(arg._is_strided for arg in self._args):
+            # Components of arguments passed straight from SoA storage are
+            # op2stride apart, which the wrapper sets
+            op2_stride = "static int op2stride;\n" + \
+                "#define OP2_STRIDE(a, idx) (a)[op2stride * (idx)]"
+            op2_stride_undef = "#undef OP2_STRIDE"
+        elif any(arg._is_soa for arg in self._args):
+            op2_stride = "#define OP2_STRIDE(a, idx) a[idx]"
+            op2_stride_undef = "#undef OP2_STRIDE"
+        kernel_code = """
+        %(op2_stride)s
+        %(header)s
+        %(namespace)s
+        %(externc_open)s
+        %(code)s
+        %(op2_stride_undef)s
+        """ % {'code': self._kernel.code,
+               'externc_open': externc_open,
+               'namespace': blas_namespace,
+               'header': headers,
+               'op2_stride': op2_stride,
+               'op2_stride_undef': op2_stride_undef}
+        with timed_region("JITModule code generation"):
+            code_to_compile = strip(dedent(self._wrapper) % self.generate_code())
 
         _const_decs = '\n'.join([const._format_declaration()
                                 for const in Const._definitions()]) + '\n'
@@ -776,8 +978,26 @@ class JITModule(base.JITModule):
         # Pass in the is_facet flag to mark the case when it's an interior horizontal facet in
         # an extruded mesh.
         _wrapper_decs = ';\n'.join([arg.c_wrapper_dec(is_facet=is_facet) for arg in self._args])
-
-        _vec_decs = ';\n'.join([arg.c_vec_dec(is_facet=is_facet) for arg in self._args if arg._is_vec_map])
+        _wrapper_finalise = ';\n'.join([arg.c_wrapper_finalise() for arg in self._args
+                                        if arg._uses_csr_offsets])
+
+        # All arguments passed straight from SoA storage are direct, so
+        # their components are the same number of elements apart
+        _strided_args = [arg for arg in self._args if arg._is_strided]
+        if _strided_args:
+            _wrapper_decs += ';\nop2stride = %s' % _strided_args[0].c_stride_name()
+
+        # Arguments stored with a different precision or layout than the
+        # kernel sees are staged through a buffer in the compute precision
+        for arg in self._args:
+            if arg._is_mixed_precision and (arg._is_mixed or arg._uses_itspace or self._itspace._extruded):
+                raise NotImplementedError("Dats with a compute dtype different from their storage dtype are only supported as non-mixed arguments of non-extruded par_loops without iteration spaces")
+            if arg._is_direct and arg._is_mixed_precision and arg._is_soa_storage and arg.data._op2_stride:
+                raise NotImplementedError("Direct arguments of Dats created with soa=True must have a compute dtype equal to their storage dtype")
+        _staged_args = [arg for arg in self._args if arg._is_staged]
+        _vec_decs = ';\n'.join([arg.c_vec_dec(is_facet=is_facet) for arg in self._args
+                                if arg._is_vec_map] +
+                               [arg.c_staging_dec(is_facet=is_facet) for arg in _staged_args])
 
         if len(Const._defs) > 0:
             _const_args = ', '
@@ -801,6 +1021,8 @@ class JITModule(base.JITModule):
 
         _vec_inits = ';\n'.join([arg.c_vec_init(is_top, self._itspace.layers, is_facet) for arg in self._args
                                  if not arg._is_mat and arg._is_vec_map])
+        _staging_gather = ';\n'.join([arg.c_staging_gather(is_facet=is_facet) for arg in _staged_args])
+        _staging_scatter = ';\n'.join([arg.c_staging_scatter(is_facet=is_facet) for arg in _staged_args])
 
         indent = lambda t, i: ('\n' + '  ' * i).join(t.split('\n'))
 
@@ -900,18 +1122,28 @@ class JITModule(base.JITModule):
             _itspace_loop_close = '\n'.join('  ' * n + '}' for n in range(nloops - 1, -1, -1))
             _addto_buf_name = _buf_scatter_name or _buf_name
             _buffer_indices = "[i_0*%d + i_1]" % shape[1] if self._kernel._applied_blas else "[i_0][i_1]"
+            # Vector field blocks of blocked matrices are inserted whole,
+            # outside the iteration space loops, like scalar fields
             if self._itspace._extruded:
                 _addtos_scalar_field_extruded = ';\n'.join([arg.c_addto_scalar_field(i, j, _addto_buf_name, "xtr_", is_facet=is_facet) for arg in self._args
-                                                            if arg._is_mat and arg.data[i, j]._is_scalar_field])
+                                                            if arg._is_mat and arg.data[i, j]._is_scalar_field] +
+                                                           [arg.c_addto_vector_field_blocked(i, j, _addto_buf_name, "xtr_") for arg in self._args
+                                                            if arg._is_blocked_addto(i, j, is_facet=is_facet)])
                 _addtos_vector_field = ';\n'.join([arg.c_addto_vector_field(i, j, _addto_buf_name, _buffer_indices, "xtr_", is_facet=is_facet)
-                                                   for arg in self._args if arg._is_mat and arg.data[i, j]._is_vector_field])
+                                                   for arg in self._args if arg._is_mat and arg.data[i, j]._is_vector_field and
+                                                   not arg._is_blocked_addto(i, j, is_facet=is_facet)])
                 _addtos_scalar_field = ""
             else:
                 _addtos_scalar_field_extruded = ""
                 _addtos_scalar_field = ';\n'.join([arg.c_addto_scalar_field(i, j, _addto_buf_name) for count, arg in enumerate(self._args)
-                                                   if arg._is_mat and arg.data[i, j]._is_scalar_field])
+                                                   if arg._is_mat and arg.data[i, j]._is_scalar_field and not arg._uses_csr_offsets] +
+                                                  [arg.c_addto_vector_field_blocked(i, j, _addto_buf_name) for arg in self._args
+                                                   if arg._is_blocked_addto(i, j)] +
+                                                  [arg.c_addto_csr(_addto_buf_name) for arg in self._args
+                                                   if arg._uses_csr_offsets])
                 _addtos_vector_field = ';\n'.join([arg.c_addto_vector_field(i, j, _addto_buf_name, _buffer_indices) for arg in self._args
-                                                  if arg._is_mat and arg.data[i, j]._is_vector_field])
+                                                  if arg._is_mat and arg.data[i, j]._is_vector_field and
+                                                  not (arg._is_blocked_addto(i, j) or arg._uses_csr_offsets)])
 
             if not _addtos_vector_field and not _buf_scatter:
                 _itspace_loops = ''
@@ -947,9 +1179,12 @@ class JITModule(base.JITModule):
                 'wrapper_args': _wrapper_args,
                 'user_code': self._kernel._user_code,
                 'wrapper_decs': indent(_wrapper_decs, 1),
+                'wrapper_finalise': indent(_wrapper_finalise, 1),
                 'const_args': _const_args,
                 'const_inits': indent(_const_inits, 1),
                 'vec_inits': indent(_vec_inits, 2),
+                'staging_gather': indent(_staging_gather, 2),
+                'staging_scatter': indent(_staging_scatter, 2),
                 'off_args': _off_args,
                 'layer_arg': _layer_arg,
                 'map_decl': indent(_map_decl, 2),
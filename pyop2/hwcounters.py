@@ -0,0 +1,241 @@
+# This file is part of PyOP2
+#
+# PyOP2 is Copyright (c) 2012, Imperial College London and
+# others. Please see the AUTHORS file in the main source directory for
+# a full list of copyright holders.  All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions
+# are met:
+#
+#     * Redistributions of source code must retain the above copyright
+#       notice, this list of conditions and the following disclaimer.
+#     * Redistributions in binary form must reproduce the above copyright
+#       notice, this list of conditions and the following disclaimer in the
+#       documentation and/or other materials provided with the distribution.
+#     * The name of Imperial College London or that of other
+#       contributors may not be used to endorse or promote products
+#       derived from this software without specific prior written
+#       permission.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTERS
+# ''AS IS'' AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT
+# LIMITED TO, THE IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS
+# FOR A PARTICULAR PURPOSE ARE DISCLAIMED. IN NO EVENT SHALL THE
+# COPYRIGHT HOLDERS OR CONTRIBUTORS BE LIABLE FOR ANY DIRECT,
+# INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES
+# (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR
+# SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION)
+# HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT,
+# STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE)
+# ARISING IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED
+# OF THE POSSIBILITY OF SUCH DAMAGE.
+
+
+"""Hardware performance counters of kernel execution, read through the
+Linux ``perf_event`` interface.
+
+When the configuration option ``hw_counters`` is set, the host backends
+count CPU cycles, instructions retired and last level cache misses while
+executing the generated code of each kernel (see :func:`counted`), and
+aggregate them per kernel in :class:`HardwareCounters`. The counters are
+opened with the ``perf_event_open`` system call via :mod:`ctypes`, so no
+extra dependency is needed. If they cannot be opened, e.g. since the
+platform is not Linux or ``/proc/sys/kernel/perf_event_paranoid``
+forbids it, a warning is printed once and nothing is recorded.
+
+Only user space events of the thread launching the kernel are counted,
+so with the OpenMP backend the counts do not include the work done by
+other threads.
+"""
+
+from contextlib import contextmanager
+import ctypes
+import os
+import platform
+import struct
+import sys
+import threading
+
+from configuration import configuration
+from logger import warning
+from profiling import write_table
+
+# Number of the perf_event_open system call per architecture
+_SYSCALLS = {'x86_64': 298, 'i386': 336, 'i686': 336, 'aarch64': 241,
+             'armv7l': 364, 'ppc64': 319, 'ppc64le': 319}
+
+_PERF_TYPE_HARDWARE = 0
+_PERF_FORMAT_TOTAL_TIME_ENABLED = 1 << 0
+_PERF_FORMAT_TOTAL_TIME_RUNNING = 1 << 1
+_PERF_FORMAT_GROUP = 1 << 3
+_EXCLUDE_KERNEL = 1 << 5
+_EXCLUDE_HV = 1 << 6
+
+EVENTS = (("cycles", 0), ("instructions", 1), ("cache misses", 3))
+"""The events counted, as pairs of name and ``PERF_COUNT_HW_*`` config."""
+
+
+class _perf_event_attr(ctypes.Structure):
+    # The leading fields of struct perf_event_attr up to
+    # PERF_ATTR_SIZE_VER0, the rest is zero
+    _fields_ = [("type", ctypes.c_uint32),
+                ("size", ctypes.c_uint32),
+                ("config", ctypes.c_uint64),
+                ("sample_period", ctypes.c_uint64),
+                ("sample_type", ctypes.c_uint64),
+                ("read_format", ctypes.c_uint64),
+                ("flags", ctypes.c_uint64),
+                ("wakeup_events", ctypes.c_uint32),
+                ("bp_type", ctypes.c_uint32),
+                ("config1", ctypes.c_uint64)]
+
+
+class _CounterGroup(object):
+
+    """The :data:`EVENTS` of the calling thread, opened as a group so that
+    they are scheduled and read together. Events not supported are left
+    out; if none can be opened, :class:`OSError` is raised."""
+
+    def __init__(self):
+        nr = _SYSCALLS.get(platform.machine())
+        if not sys.platform.startswith('linux') or nr is None:
+            raise OSError("perf_event_open is not available on %s %s"
+                          % (sys.platform, platform.machine()))
+        libc = ctypes.CDLL(None, use_errno=True)
+        self.names = []
+        self._fds = []
+        error = None
+        for name, config in EVENTS:
+            attr = _perf_event_attr(type=_PERF_TYPE_HARDWARE,
+                                    size=ctypes.sizeof(_perf_event_attr),
+                                    config=config,
+                                    read_format=_PERF_FORMAT_GROUP |
+                                    _PERF_FORMAT_TOTAL_TIME_ENABLED |
+                                    _PERF_FORMAT_TOTAL_TIME_RUNNING,
+                                    flags=_EXCLUDE_KERNEL | _EXCLUDE_HV)
+            leader = self._fds[0] if self._fds else -1
+            # Count the calling thread on any CPU
+            fd = libc.syscall(nr, ctypes.byref(attr), 0, -1, leader, 0)
+            if fd < 0:
+                errno = ctypes.get_errno()
+                error = OSError(errno, "Cannot count %s: %s" % (name, os.strerror(errno)))
+                continue
+            self._fds.append(fd)
+            self.names.append(name)
+        if not self._fds:
+            raise error
+        self._fmt = '%dQ' % (3 + len(self._fds))
+        self._nbytes = struct.calcsize(self._fmt)
+
+    def read(self):
+        """Return the time enabled, the time running and the values of
+        all events counted so far."""
+        return struct.unpack(self._fmt, os.read(self._fds[0], self._nbytes))[1:]
+
+    def close(self):
+        for fd in self._fds:
+            os.close(fd)
+        self._fds = []
+
+
+class HardwareCounters(object):
+
+    """Hardware events counted while executing each kernel on this rank.
+
+    When the PMU cannot count all events all the time, the counts are
+    scaled by the fraction of time they were counted for, as ``perf``
+    does."""
+
+    _counts = {}
+    _local = threading.local()
+    _unavailable = None
+
+    @classmethod
+    def _group(cls):
+        """The :class:`_CounterGroup` of the calling thread, or ``None`` if
+        counters are unavailable."""
+        group = getattr(cls._local, 'group', None)
+        if group is None and cls._unavailable is None:
+            try:
+                group = cls._local.group = _CounterGroup()
+            except OSError as e:
+                cls._unavailable = str(e)
+                warning("Hardware counters unavailable, not recording them: %s", e)
+        return group
+
+    @classmethod
+    def add(cls, name, counts):
+        """Record a call of kernel ``name``.
+
+        :arg counts: A dict of the number of each event counted.
+        """
+        entry = cls._counts.setdefault(name, [0, {}])
+        entry[0] += 1
+        for event, n in counts.iteritems():
+            entry[1][event] = entry[1].get(event, 0) + n
+
+    @classmethod
+    def available(cls):
+        """Can hardware counters be read in this process?"""
+        return cls._group() is not None
+
+    @classmethod
+    def get_counts(cls):
+        """Return a dict of pairs of the number of calls and a dict of the
+        events counted, keyed by kernel name."""
+        return cls._counts
+
+    @classmethod
+    def summary(cls, filename=None):
+        """Print a table of the events counted per kernel, ordered by
+        cycles, or write CSV to filename. Besides the raw counts, the
+        table shows the instructions per cycle and the cache misses per
+        thousand instructions where available."""
+        if not cls._counts:
+            return
+        events = [name for name, config in EVENTS]
+        column_heads = ("Kernel", "Calls") + tuple(e.capitalize() for e in events) + \
+            ("IPC", "Misses/kinstr")
+        rows = []
+        for name, (calls, totals) in sorted(cls._counts.items(),
+                                            key=lambda (k, v): -v[1].get("cycles", 0)):
+            cycles = totals.get("cycles")
+            instructions = totals.get("instructions")
+            misses = totals.get("cache misses")
+            rows.append((name, calls) + tuple(totals.get(e, '') for e in events) +
+                        (float(instructions) / cycles if cycles and instructions is not None else '',
+                         1e3 * misses / instructions if instructions and misses is not None else ''))
+        write_table(column_heads, rows, filename, fmt='%.3g')
+
+    @classmethod
+    def reset_all(cls):
+        """Clear all counts recorded."""
+        cls._counts = {}
+
+
+@contextmanager
+def counted(name):
+    """A context manager counting hardware events while executing its
+    block and recording them for kernel ``name`` in
+    :class:`HardwareCounters`, if the configuration option
+    ``hw_counters`` is set and counters are available."""
+    group = HardwareCounters._group() if configuration['hw_counters'] else None
+    if group is None:
+        yield
+        return
+    start = group.read()
+    try:
+        yield
+    finally:
+        end = group.read()
+        enabled, running = end[0] - start[0], end[1] - start[1]
+        scale = float(enabled) / running if running else 0.0
+        HardwareCounters.add(name, dict((event, int(round(scale * (e - s))))
+                                        for event, s, e in zip(group.names, start[2:], end[2:])))
+
+
+def hw_summary(filename=None):
+    """Print a table of the hardware events counted per kernel or write
+    CSV to filename (see :meth:`HardwareCounters.summary`)."""
+    HardwareCounters.summary(filename)
@@ -29,4 +29,47 @@ static inline void addto_vector(Mat mat, const void *values,
                 insert ? INSERT_VALUES : ADD_VALUES );
 }
 
+/* Insert an element matrix into a blocked matrix.  The element
+ * matrix rows (columns) are ordered by component, then by node, as
+ * for flattened vector fields, whereas PETSc expects them ordered by
+ * node (block), then by component. */
+static inline void addto_vector_blocked(Mat mat, const void *values,
+                  int nrows, const int *irows,
+                  int ncols, const int *icols,
+                  int rdim, int cdim, int insert)
+{
+  assert( mat && values && irows && icols );
+  // FIMXE: this assumes we're getting a PetscScalar
+  const PetscScalar * v = (const PetscScalar *)values;
+  const int ld = ncols * cdim;
+  PetscScalar blocked[nrows * rdim * ld];
+  for ( int i = 0; i < nrows; i++ )
+    for ( int r = 0; r < rdim; r++ )
+      for ( int j = 0; j < ncols; j++ )
+        for ( int c = 0; c < cdim; c++ )
+          blocked[(i * rdim + r) * ld + j * cdim + c] = v[(r * nrows + i) * ld + c * ncols + j];
+  MatSetValuesBlockedLocal( mat,
+                nrows, (const PetscInt *)irows,
+                ncols, (const PetscInt *)icols,
+                blocked,
+                insert ? INSERT_VALUES : ADD_VALUES );
+}
+
+/* Add (or insert) an element matrix directly into the values array
+ * of an assembled CSR matrix, using the precomputed offset of each
+ * entry of the element matrix into that array. */
+static inline void addto_csr(PetscScalar *vals, const int *offsets,
+                  const void *values, int n, int insert)
+{
+  assert( vals && offsets && values );
+  // FIMXE: this assumes we're getting a PetscScalar
+  const PetscScalar * v = (const PetscScalar *)values;
+  // Negative offsets mark masked entries, which are dropped
+  if ( insert ) {
+    for ( int k = 0; k < n; k++ ) if ( offsets[k] >= 0 ) vals[offsets[k]] = v[k];
+  } else {
+    for ( int k = 0; k < n; k++ ) if ( offsets[k] >= 0 ) vals[offsets[k]] += v[k];
+  }
+}
+
 #endif // _MAT_UTILS_H
@@ -0,0 +1,256 @@
+# This file is part of PyOP2
+#
+# PyOP2 is Copyright (c) 2012, Imperial College London and
+# others. Please see the AUTHORS file in the main source directory for
+# a full list of copyright holders.  All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions
+# are met:
+#
+#     * Redistributions of source code must retain the above copyright
+#       notice, this list of conditions and the following disclaimer.
+#     * Redistributions in binary form must reproduce the above copyright
+#       notice, this list of conditions and the following disclaimer in the
+#       documentation and/or other materials provided with the distribution.
+#     * The name of Imperial College London or that of other
+#       contributors may not be used to endorse or promote products
+#       derived from this software without specific prior written
+#       permission.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTERS
+# ''AS IS'' AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT
+# LIMITED TO, THE IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS
+# FOR A PARTICULAR PURPOSE ARE DISCLAIMED. IN NO EVENT SHALL THE
+# COPYRIGHT HOLDERS OR CONTRIBUTORS BE LIABLE FOR ANY DIRECT,
+# INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES
+# (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR
+# SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION)
+# HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT,
+# STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE)
+# ARISING IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED
+# OF THE POSSIBILITY OF SUCH DAMAGE.
+
+
+"""Readers for Triangle and Gmsh meshes.
+
+The text files are parsed with vectorised NumPy operations rather than
+line by line. The arrays read are cached as ``.npy`` files in
+``configuration['cache_dir']``, keyed by the hash of the mesh files, and
+later reads of the same mesh memory map the cached arrays instead of
+parsing again.
+"""
+
+import os
+import re
+from hashlib import md5
+
+import numpy as np
+
+from backends import _make_object
+from configuration import configuration
+from logger import debug, warning
+
+# Bump when the arrays returned by the readers change
+_CACHE_VERSION = 1
+
+# Gmsh element types in order of preference as cells: (type, number of
+# vertices, permutation of the vertices, type of the facets)
+_GMSH_CELLS = [(4, 4, None, 2),                         # tetrahedra
+               (2, 3, None, 1),                         # triangles
+               (5, 8, [0, 1, 3, 2, 4, 5, 7, 6], 3),     # hexahedra
+               (3, 4, [0, 1, 3, 2], 1)]                 # quadrilaterals
+_GMSH_VERTICES = {1: 2, 2: 3, 3: 4, 4: 4, 5: 8, 15: 1}
+
+
+def _parse(text, dtype=np.float64):
+    """Parse the whitespace separated numbers in ``text``, ignoring
+    comments starting with ``#``."""
+    return np.fromstring(re.sub(r'#[^\n]*', '', text), dtype=dtype, sep=' ')
+
+
+def _parse_rows(text):
+    """Parse lines of whitespace separated integers of varying length.
+
+    :returns: the flat array of values and the offsets of the lines into
+        it (one more than the number of non-blank lines).
+    """
+    a = np.frombuffer(text, dtype=np.uint8)
+    space = np.in1d(a, np.frombuffer(' \t\r\n', dtype=np.uint8))
+    # Tokens start at a non-space preceded by a space or the start
+    starts = np.flatnonzero(~space & np.append(True, space[:-1]))
+    lines = np.searchsorted(np.flatnonzero(a == ord('\n')), starts)
+    counts = np.bincount(lines)
+    return (np.fromstring(text, dtype=np.int64, sep=' '),
+            np.append(0, np.cumsum(counts[counts > 0])))
+
+
+def _section(text, name):
+    """Return the body of the Gmsh section ``$name``."""
+    try:
+        start = text.index('\n', text.index('$%s' % name)) + 1
+        return text[start:text.index('$End%s' % name, start)]
+    except ValueError:
+        raise ValueError("Gmsh mesh has no %s section" % name)
+
+
+def _renumber(ids, values):
+    """Replace the entity ids ``ids[i]`` in ``values`` by ``i``."""
+    order = np.argsort(ids, kind='mergesort')
+    return order[np.searchsorted(ids, values, sorter=order)].astype(np.int32)
+
+
+def read_triangle_arrays(prefix):
+    """Read the Triangle mesh with files ``prefix.node`` and
+    ``prefix.ele``. Attributes and boundary markers are ignored.
+
+    :returns: a dict with the vertex ``coords`` and the zero-based
+        vertex numbers of the ``cells``.
+    """
+    with open(prefix + '.node') as f:
+        values = _parse(f.read())
+    nnodes, dim, nattrs, nmarkers = values[:4].astype(int)
+    try:
+        rows = values[4:].reshape(nnodes, 1 + dim + nattrs + nmarkers)
+    except ValueError:
+        raise ValueError("%s.node does not contain %d vertices" % (prefix, nnodes))
+    index = rows[:, 0].astype(np.int64)
+    base = index.min() if nnodes else 0
+    coords = np.empty((nnodes, dim), dtype=np.float64)
+    coords[index - base] = rows[:, 1:1 + dim]
+
+    with open(prefix + '.ele') as f:
+        values = _parse(f.read())
+    ncells, arity, nattrs = values[:3].astype(int)
+    try:
+        rows = values[3:].reshape(ncells, 1 + arity + nattrs).astype(np.int64)
+    except ValueError:
+        raise ValueError("%s.ele does not contain %d cells" % (prefix, ncells))
+    cells = np.empty((ncells, arity), dtype=np.int32)
+    if ncells:
+        cells[rows[:, 0] - rows[:, 0].min()] = rows[:, 1:1 + arity] - base
+    return {'coords': coords, 'cells': cells}
+
+
+def read_gmsh_arrays(filename):
+    """Read the ASCII Gmsh 2 mesh ``filename``.
+
+    The cells are the tetrahedra, triangles, hexahedra or quadrilaterals
+    of the mesh (in this order of preference), with vertices ordered as
+    by ``gmsh2triangle``, and the facets the elements of the dimension
+    below.
+
+    :returns: a dict with the vertex ``coords`` (with as many components
+        as the dimension of the cells), the zero-based vertex numbers of
+        the ``cells`` and ``facets`` and the physical ids of the cells
+        and facets (``cell_ids`` and ``facet_ids``).
+    """
+    with open(filename) as f:
+        text = f.read()
+    version = _section(text, 'MeshFormat').split()
+    if version[0] not in ('2', '2.1', '2.2') or version[1] != '0':
+        raise ValueError("%s is not an ASCII Gmsh 2 mesh" % filename)
+
+    values = _parse(_section(text, 'Nodes'))
+    nodes = values[1:].reshape(int(values[0]), 4)
+    ids = nodes[:, 0].astype(np.int64)
+
+    body = _section(text, 'Elements')
+    body = body[body.index('\n') + 1:]
+    values, offsets = _parse_rows(body)
+    types = values[offsets[:-1] + 1]
+    unknown = np.setdiff1d(types, _GMSH_VERTICES.keys())
+    if len(unknown):
+        raise ValueError("Unknown Gmsh element types %s" % unknown)
+    # The vertices are the last entries of each element, preceded by the
+    # number of tags and the tags, the first of which is the physical id
+    ntags = values[offsets[:-1] + 2]
+
+    def elements(typ, perm=None):
+        sel = types == typ
+        n = _GMSH_VERTICES[typ]
+        vertices = values[offsets[1:][sel][:, None] - n + np.arange(n)]
+        if perm is not None:
+            vertices = vertices[:, perm]
+        physical = np.where(ntags[sel] > 0, values[offsets[:-1][sel] + 3], 0)
+        return _renumber(ids, vertices), physical.astype(np.int32)
+
+    for typ, _, perm, facet_typ in _GMSH_CELLS:
+        if (types == typ).any():
+            break
+    else:
+        raise ValueError("%s contains no cells" % filename)
+    dim = 3 if typ in (4, 5) else 2
+    cells, cell_ids = elements(typ, perm)
+    facets, facet_ids = elements(facet_typ)
+    return {'coords': nodes[:, 1:1 + dim].copy(), 'cells': cells,
+            'cell_ids': cell_ids, 'facets': facets, 'facet_ids': facet_ids}
+
+
+def _cached(reader, filenames, cache=True):
+    """Return the arrays read by ``reader`` from ``filenames``, memory
+    mapped (copy-on-write) from the cache if they were read before."""
+    if not cache:
+        return reader(*filenames)
+    h = md5(reader.__name__ + str(_CACHE_VERSION))
+    for filename in filenames:
+        with open(filename, 'rb') as f:
+            for chunk in iter(lambda: f.read(1 << 24), ''):
+                h.update(chunk)
+    path = os.path.join(configuration['cache_dir'], 'mesh-' + h.hexdigest())
+    if os.path.exists(os.path.join(path, 'complete')):
+        debug("Memory mapping mesh %s from %s", filenames[0], path)
+        return dict((name[:-4], np.load(os.path.join(path, name), mmap_mode='c'))
+                    for name in os.listdir(path) if name.endswith('.npy'))
+    arrays = reader(*filenames)
+    try:
+        if not os.path.exists(path):
+            os.makedirs(path)
+        # Write through temporary files renamed into place, such that
+        # concurrent readers never see partially written arrays
+        for name, a in arrays.iteritems():
+            tmp = os.path.join(path, '%s.npy.%d' % (name, os.getpid()))
+            with open(tmp, 'wb') as f:
+                np.save(f, a)
+            os.rename(tmp, os.path.join(path, name + '.npy'))
+        open(os.path.join(path, 'complete'), 'w').close()
+    except (IOError, OSError) as e:
+        warning("Could not cache mesh %s: %s", filenames[0], e)
+    return arrays
+
+
+def _build(arrays, layers=None):
+    coords = arrays['coords']
+    cells = arrays['cells']
+    nodes = _make_object('Set', len(coords), "nodes")
+    elements = _make_object('Set', len(cells), "elements")
+    if layers is not None:
+        elements = _make_object('ExtrudedSet', elements, layers=layers)
+    return (nodes,
+            _make_object('Dat', nodes ** coords.shape[1], coords, name="coords"),
+            elements,
+            _make_object('Map', elements, nodes, cells.shape[1], cells, "elem_node"))
+
+
+def read_triangle(prefix, layers=None, cache=True):
+    """Read the Triangle mesh with files ``prefix.node`` and ``prefix.ele``
+    into OP2 data structures (see :func:`read_triangle_arrays`).
+
+    :arg layers: The number of layers of an extruded mesh (optional).
+    :arg cache: Cache the arrays read in ``configuration['cache_dir']``,
+        keyed by the hash of the mesh files, and memory map the cached
+        arrays rather than parsing the files if they were read before.
+    :returns: a tuple ``(nodes, coords, elements, elem_node)`` of the
+        vertex :class:`Set`, the coordinate :class:`Dat`, the cell
+        :class:`Set` (an :class:`ExtrudedSet` if ``layers`` is given) and
+        the cell to vertex :class:`Map`.
+    """
+    return _build(_cached(read_triangle_arrays, [prefix + '.node', prefix + '.ele'],
+                          cache), layers)
+
+
+def read_gmsh(filename, layers=None, cache=True):
+    """Read the Gmsh mesh ``filename`` into OP2 data structures (see
+    :func:`read_gmsh_arrays`), returning the same tuple as
+    :func:`read_triangle`."""
+    return _build(_cached(read_gmsh_arrays, [filename], cache), layers)
@@ -34,6 +34,7 @@
 """The PyOP2 API specification."""
 
 import atexit
+from contextlib import contextmanager
 
 import backends
 import base
@@ -46,14 +47,17 @@ from utils import validate_type
 from exceptions import MatTypeError, DatTypeError
 from coffee.plan import init_coffee
 from versioning import modifies_arguments
+from hdf5 import PartitionedFile
+from checkpointing import CheckpointWriter, checkpoint, restore
 
 __all__ = ['configuration', 'READ', 'WRITE', 'RW', 'INC', 'MIN', 'MAX',
            'ON_BOTTOM', 'ON_TOP', 'ON_INTERIOR_FACETS', 'ALL',
            'i', 'debug', 'info', 'warning', 'error', 'critical', 'initialised',
            'set_log_level', 'MPI', 'init', 'exit', 'Kernel', 'Set', 'ExtrudedSet',
            'LocalSet', 'MixedSet', 'Subset', 'DataSet', 'MixedDataSet', 'Halo',
-           'Dat', 'MixedDat', 'Mat', 'Const', 'Global', 'Map', 'MixedMap',
-           'Sparsity', 'Solver', 'par_loop', 'solve']
+           'Dat', 'MixedDat', 'Mat', 'ImplicitMat', 'Const', 'Global', 'Map', 'MixedMap',
+           'Sparsity', 'Solver', 'par_loop', 'solve', 'inner_many', 'scratch_dat',
+           'PartitionedFile', 'CheckpointWriter', 'checkpoint', 'restore']
 
 
 def initialised():
@@ -119,14 +123,35 @@ def init(**kwargs):
 def exit():
     """Exit OP2 and clean up"""
     if configuration['print_cache_size'] and MPI.comm.rank == 0:
-        from caching import report_cache, Cached, ObjectCached
+        from caching import report_cache, report_cache_stats, Cached, ObjectCached
         print '**** PyOP2 cache sizes at exit ****'
         report_cache(typ=ObjectCached)
         report_cache(typ=Cached)
-    if configuration['print_summary'] and MPI.comm.rank == 0:
-        from profiling import summary
-        print '**** PyOP2 timings summary ****'
+        report_cache_stats()
+    if configuration['print_summary']:
+        from profiling import summary, tree_summary
+        if MPI.comm.rank == 0:
+            print '**** PyOP2 timings summary ****'
         summary()
+        if MPI.comm.rank == 0:
+            print '**** PyOP2 timings call tree (rank 0) ****'
+            tree_summary()
+        if configuration['track_memory']:
+            from profiling import memory_summary
+            if MPI.comm.rank == 0:
+                print '**** PyOP2 memory summary ****'
+            memory_summary()
+    if configuration['loop_counters'] and MPI.comm.rank == 0:
+        from profiling import loop_summary
+        print '**** PyOP2 par_loop counters ****'
+        loop_summary()
+    if configuration['hw_counters'] and MPI.comm.rank == 0:
+        from hwcounters import hw_summary
+        print '**** PyOP2 hardware counters ****'
+        hw_summary()
+    if configuration['trace_file']:
+        from profiling import write_trace
+        write_trace()
     configuration.reset()
 
     if backends.get_backend() != 'pyop2.void':
@@ -181,6 +206,10 @@ class Mat(base.Mat):
     __metaclass__ = backends._BackendSelector
 
 
+class ImplicitMat(base.ImplicitMat):
+    __metaclass__ = backends._BackendSelector
+
+
 class Const(base.Const):
     __metaclass__ = backends._BackendSelector
 
@@ -288,3 +317,42 @@ def solve(A, x, b):
     :arg b: The :class:`Dat` containing the RHS.
     """
     Solver().solve(A, x, b)
+
+
+@collective
+@validate_type(('x', base.Dat, DatTypeError))
+def inner_many(x, ys):
+    """Compute the l2 inner products of ``x`` with each of ``ys`` in a single
+    pass over the data with a single reduction (see :meth:`Dat.inner_many`).
+
+    :arg x: The :class:`Dat` to compute the inner products of.
+    :arg ys: An iterable of :class:`Dat`\s to compute the inner products
+        against.
+    :returns: a numpy array of the inner products
+    """
+    return x.inner_many(ys)
+
+
+@contextmanager
+def scratch_dat(dataset, dtype=None, name=None):
+    """A context manager for a zeroed temporary :class:`Dat` on ``dataset``
+    whose storage is taken from the pool of temporary storage
+    (:data:`pyop2.base.dat_pool`) and returned to it when the context
+    exits, e.g. ::
+
+      with op2.scratch_dat(nodes) as tmp:
+          tmp.lincomb([1.0, dt], [u, du])
+          ...
+
+    :arg dataset: The :class:`DataSet` or :class:`Set` of the :class:`Dat`.
+    :arg dtype: The type of the data (optional, defaults to ``float64``).
+    :arg name: A name for the :class:`Dat` (optional).
+
+    The :class:`Dat` must not be used after the context exits. Its
+    storage is only reused once no views of its data are left.
+    """
+    dat = Dat(dataset, dtype=dtype, name=name)._use_pool()
+    try:
+        yield dat
+    finally:
+        dat._release_to_pool()
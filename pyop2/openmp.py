@@ -45,6 +45,7 @@ from exceptions import *
 import device
 import host
 from host import Kernel  # noqa: for inheritance
+from hwcounters import counted
 from logger import warning
 import plan as _plan
 from petsc_base import *
@@ -171,9 +172,11 @@ void %(wrapper_name)s(int boffset,
         %(map_init)s;
         %(extr_loop)s
         %(map_bcs_m)s;
+        %(staging_gather)s;
         %(buffer_decl)s;
         %(buffer_gather)s
         %(kernel_name)s(%(kernel_args)s);
+        %(staging_scatter)s;
         %(layout_decl)s;
         %(layout_loop)s
             %(layout_assign)s;
@@ -186,6 +189,7 @@ void %(wrapper_name)s(int boffset,
     }
     %(interm_globals_writeback)s;
   }
+  %(wrapper_finalise)s;
 }
 """
 
@@ -232,6 +236,9 @@ class ParLoop(device.ParLoop, host.ParLoop):
                         # evaluation of the trace
                         self._argtypes.append(d._argtype)
                         self._jit_args.append(d._data)
+                        if d._soa_storage:
+                            self._argtypes.append(ctypes.c_int)
+                            self._jit_args.append(d.dataset.total_size)
 
                 if arg._is_indirect or arg._is_mat:
                     maps = as_tuple(arg.map, Map)
@@ -240,6 +247,11 @@ class ParLoop(device.ParLoop, host.ParLoop):
                             self._argtypes.append(m._argtype)
                             self._jit_args.append(m.values_with_halo)
 
+                if arg._uses_csr_offsets:
+                    offsets = arg.data.sparsity._insertion_offsets(*arg.map)
+                    self._argtypes.append(ndpointer(offsets.dtype, shape=offsets.shape))
+                    self._jit_args.append(offsets)
+
             for c in Const._definitions():
                 self._argtypes.append(c._argtype)
                 self._jit_args.append(c.data)
@@ -288,7 +300,7 @@ class ParLoop(device.ParLoop, host.ParLoop):
                 nblocks = plan.ncolblk[c]
                 self._jit_args[0] = boffset
                 self._jit_args[1] = nblocks
-                with timed_region("ParLoop kernel"):
+                with timed_region("ParLoop kernel"), counted(self.kernel.name):
                     fun(*self._jit_args)
                 boffset += nblocks
         else:
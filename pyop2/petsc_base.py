@@ -39,18 +39,17 @@ required to implement backend-specific features.
 .. _MatMPIAIJSetPreallocation: http://www.mcs.anl.gov/petsc/petsc-current/docs/manualpages/Mat/MatMPIAIJSetPreallocation.html
 """
 
-from contextlib import contextmanager
+from contextlib import contextmanager, nested
 from petsc4py import PETSc, __version__ as petsc4py_version
 
 import base
 from base import *
 from backends import _make_object
 from logger import debug, warning
-from versioning import CopyOnWrite, modifies, zeroes
-from profiling import timed_region
+from versioning import CopyOnWrite, modifies, modifies_argn, zeroes
+from profiling import timed_region, MemoryTracker
 import mpi
 from mpi import collective
-import sparsity
 
 
 if petsc4py_version < '3.4':
@@ -79,6 +78,10 @@ mpi.MPI = MPI
 
 class Dat(base.Dat):
 
+    _host_linalg = True
+    # SoA data are stored in SoA order in host memory
+    _host_soa = True
+
     @contextmanager
     def vec_context(self, readonly=True):
         """A context manager for a :class:`PETSc.Vec` from a :class:`Dat`.
@@ -90,6 +93,12 @@ class Dat(base.Dat):
         acc = (lambda d: d.data_ro) if readonly else (lambda d: d.data)
         # Getting the Vec needs to ensure we've done all current computation.
         self._force_evaluation()
+        if self.dtype != PETSc.ScalarType or self._soa_storage:
+            # The Vec cannot share storage of a different precision or
+            # layout, so the data are converted on the way in and out
+            with self._converted_vec_context(acc(self), readonly) as v:
+                yield v
+            return
         if not hasattr(self, '_vec'):
             size = (self.dataset.size * self.cdim, None)
             self._vec = PETSc.Vec().createWithArray(acc(self), size=size)
@@ -102,6 +111,22 @@ class Dat(base.Dat):
         if not readonly:
             self.needs_halo_update = True
 
+    @contextmanager
+    def _converted_vec_context(self, data, readonly=True):
+        """A context manager for a :class:`PETSc.Vec` holding a copy of
+        ``data``, the owned data of this :class:`Dat`, converted to
+        ``PetscScalar`` in AoS order.  Unless ``readonly``, the values of
+        the Vec are converted back on exit."""
+        if not hasattr(self, '_vec'):
+            self._vec = PETSc.Vec().create()
+            self._vec.setSizes((self.dataset.size * self.cdim, None))
+            self._vec.setUp()
+        self._vec.setArray(data.reshape(-1))
+        yield self._vec
+        if not readonly:
+            data[:] = self._vec.array_r.reshape(data.shape)
+            self.needs_halo_update = True
+
     @property
     @modifies
     @collective
@@ -144,8 +169,17 @@ class MixedDat(base.MixedDat):
            The :class:`~PETSc.Vec` obtained from this context is in
            the correct order to be left multiplied by a compatible
            :class:`MixedMat`.  In parallel it is *not* just a
-           concatenation of the underlying :class:`Dat`\s."""
+           concatenation of the underlying :class:`Dat`\s.
 
+           For a :class:`MixedDat` with :attr:`contiguous` storage, no
+           component of which has halo entries, the
+           :class:`~PETSc.Vec` wraps that storage and no scatters are
+           needed."""
+
+        if self._vec_wraps_data:
+            with self._contiguous_vec_context(readonly) as v:
+                yield v
+            return
         acc = (lambda d: d.vec_ro) if readonly else (lambda d: d.vec)
         # Allocate memory for the contiguous vector, create the scatter
         # contexts and stash them on the object for later reuse
@@ -191,6 +225,37 @@ class MixedDat(base.MixedDat):
                                      mode=PETSc.ScatterMode.REVERSE)
             self.needs_halo_update = True
 
+    @property
+    def _vec_wraps_data(self):
+        """Can the PETSc Vec of this :class:`MixedDat` share its storage?
+        Halo entries would be interleaved with the owned entries, which
+        must be contiguous in the Vec."""
+        return self.contiguous and self.dtype == PETSc.ScalarType and \
+            all(d.dataset.total_size == d.dataset.size for d in self._dats)
+
+    @contextmanager
+    def _contiguous_vec_context(self, readonly=True):
+        """A context manager for a :class:`PETSc.Vec` sharing the
+        contiguous storage of this :class:`MixedDat`.
+
+        :param readonly: Access the data read-only (use :meth:`Dat.data_ro`)
+                         or read-write (use :meth:`Dat.data`). Read-write
+                         access requires a halo update."""
+
+        acc = (lambda d: d.data_ro) if readonly else (lambda d: d.data)
+        # Accessing the data of the components ensures we've done all
+        # current computation on them.
+        for d in self._dats:
+            acc(d)
+        if not hasattr(self, '_vec'):
+            size = (self._contiguous_data.size, None)
+            self._vec = PETSc.Vec().createWithArray(self._contiguous_data, size=size)
+        # The data may have been changed behind the Vec's back.
+        self._vec.stateIncrease()
+        yield self._vec
+        if not readonly:
+            self.needs_halo_update = True
+
     @property
     @modifies
     @collective
@@ -240,10 +305,25 @@ class Mat(base.Mat, CopyOnWrite):
 
     def _init_block(self):
         self._blocks = [[self]]
+        with timed_region("Mat creation"):
+            self._handle = self._create_block()
+        MemoryTracker.track("Mat", self, self.nbytes)
+        # Matrices start zeroed.
+        self._version_set_zero()
+
+    def _create_block(self):
+        """Create the PETSc matrix for a single block, preallocated
+        directly from the :class:`Sparsity`'s CSR arrays."""
         mat = PETSc.Mat()
         row_lg = PETSc.LGMap()
         col_lg = PETSc.LGMap()
         rdim, cdim = self.sparsity.dims
+        # A blocked sparsity is built on block rows and columns, with
+        # the data set dimension as block size.  Otherwise, we're
+        # building a scalar matrix, so need to scale the number of rows
+        # and columns by the sparsity dimensions.
+        block = self.sparsity.block_sparse
+        cmult = 1 if block else cdim
         if MPI.comm.size == 1:
             # The PETSc local to global mapping is the identity in the sequential case
             row_lg.create(
@@ -252,28 +332,42 @@ class Mat(base.Mat, CopyOnWrite):
             col_lg.create(
                 indices=np.arange(self.sparsity.ncols, dtype=PETSc.IntType),
                 bsize=cdim)
-            self._array = np.zeros(self.sparsity.nz, dtype=PETSc.RealType)
-            # We're not currently building a blocked matrix, so need to scale the
-            # number of rows and columns by the sparsity dimensions
-            # FIXME: This needs to change if we want to do blocked sparse
+            size = (self.sparsity.nrows * rdim, self.sparsity.ncols * cdim)
             # NOTE: using _rowptr and _colidx since we always want the host values
-            mat.createAIJWithArrays(
-                (self.sparsity.nrows * rdim, self.sparsity.ncols * cdim),
-                (self.sparsity._rowptr, self.sparsity._colidx, self._array))
+            # The matrix is assembled on creation with explicit zeros in
+            # all the places we might eventually put a value.
+            if block:
+                mat.createBAIJ(size, rdim,
+                               csr=(self.sparsity._rowptr, self.sparsity._colidx))
+            else:
+                self._array = np.zeros(self.sparsity.nz, dtype=PETSc.RealType)
+                mat.createAIJWithArrays(
+                    size, (self.sparsity._rowptr, self.sparsity._colidx, self._array))
         else:
             # We get the PETSc local to global mapping from the halo.
-            # This gives us "block" indices, we need to splat those
-            # out to dof indices for vector fields since we don't
-            # currently assemble into block matrices.
+            # This gives us "block" indices, which PETSc splats out to
+            # dof indices for vector fields.
             rindices = self.sparsity.rmaps[0].toset.halo.global_to_petsc_numbering
             cindices = self.sparsity.cmaps[0].toset.halo.global_to_petsc_numbering
             row_lg.create(indices=rindices, bsize=rdim)
             col_lg.create(indices=cindices, bsize=cdim)
 
-            mat.createAIJ(size=((self.sparsity.nrows * rdim, None),
-                                (self.sparsity.ncols * cdim, None)),
-                          nnz=(self.sparsity.nnz, self.sparsity.onnz),
-                          bsize=(rdim, cdim))
+            # The sparsity's column indices are process-local, PETSc
+            # wants global ones, sorted within each row.
+            rowptr = np.asarray(self.sparsity._rowptr, dtype=PETSc.IntType)
+            colidx = self.sparsity._colidx
+            gcols = np.asarray(cindices, dtype=PETSc.IntType)[colidx // cmult] * cmult + colidx % cmult
+            rows = np.repeat(np.arange(len(rowptr) - 1), np.diff(rowptr))
+            gcols = gcols[np.lexsort((gcols, rows))]
+            size = ((self.sparsity.nrows * rdim, None),
+                    (self.sparsity.ncols * cdim, None))
+            # Preallocating with the CSR structure inserts explicit
+            # zeros in all the places we might eventually put a value
+            # and assembles the matrix.
+            if block:
+                mat.createBAIJ(size, rdim, csr=(rowptr, gcols))
+            else:
+                mat.createAIJ(size, bsize=(rdim, cdim), csr=(rowptr, gcols))
         mat.setBlockSizes(rdim, cdim)
         mat.setLGMap(rmap=row_lg, cmap=col_lg)
         # Do not stash entries destined for other processors, just drop them
@@ -282,26 +376,13 @@ class Mat(base.Mat, CopyOnWrite):
         # Any add or insertion that would generate a new entry that has not
         # been preallocated will raise an error
         mat.setOption(mat.Option.NEW_NONZERO_ALLOCATION_ERR, True)
-        # Do not ignore zeros while we fill the initial matrix so that
-        # petsc doesn't compress things out.
-        mat.setOption(mat.Option.IGNORE_ZERO_ENTRIES, False)
         # When zeroing rows (e.g. for enforcing Dirichlet bcs), keep those in
         # the nonzero structure of the matrix. Otherwise PETSc would compact
         # the sparsity and render our sparsity caching useless.
         mat.setOption(mat.Option.KEEP_NONZERO_PATTERN, True)
-        # We completely fill the allocated matrix when zeroing the
-        # entries, so raise an error if we "missed" one.
-        mat.setOption(mat.Option.UNUSED_NONZERO_LOCATION_ERR, True)
-
-        # Put zeros in all the places we might eventually put a value.
-        sparsity.fill_with_zeros(mat, self.sparsity.dims, self.sparsity.maps)
-
-        # Now we've filled up our matrix, so the sparsity is
-        # "complete", we can ignore subsequent zero entries.
+        # The sparsity is complete, so we can ignore subsequent zero entries.
         mat.setOption(mat.Option.IGNORE_ZERO_ENTRIES, True)
-        self._handle = mat
-        # Matrices start zeroed.
-        self._version_set_zero()
+        return mat
 
     def __getitem__(self, idx):
         """Return :class:`Mat` block with row and column given by ``idx``
@@ -417,11 +498,15 @@ class Mat(base.Mat, CopyOnWrite):
     @property
     @modifies
     def array(self):
-        """Array of non-zero values."""
-        if not hasattr(self, '_array'):
-            self._init()
+        """Array of non-zero values.
+
+        For a sequential scalar matrix this is the storage PETSc works on.
+        A blocked matrix keeps its values in a block layout of its own, so
+        this is a copy of them in CSR order."""
         base._trace.evaluate(set([self]), set())
         self._assemble()
+        if not hasattr(self, '_array'):
+            return self.handle.getValuesCSR()[2]
         return self._array
 
     @property
@@ -438,28 +523,126 @@ class Mat(base.Mat, CopyOnWrite):
             self._init()
         return self._handle
 
+    @collective
+    def _product(self, op, out, *vecs):
+        """Apply the PETSc product ``op`` to the :class:`Dat`\s ``vecs``,
+        storing the result in the :class:`Dat` ``out``.
+
+        PETSc writes straight into the storage of ``out`` (for a
+        :class:`MixedDat` the cached scatters of
+        :meth:`MixedDat.vecscatter` are used), hence no temporary
+        vectors are allocated."""
+        base._trace.evaluate(set([self]) | set(vecs), set([out]))
+        self._assemble()
+        with nested(*[v.vec_ro for v in vecs]) as petsc_vecs:
+            with out.vec as y:
+                op(*(list(petsc_vecs) + [y]))
+
+    @modifies_argn(1)
+    def mult(self, x, out):
+        """Compute the matrix-vector product ``out = A x``, writing the
+        result into the existing :class:`Dat` ``out``.
+
+        :arg x: :class:`Dat` or :class:`MixedDat` on the column space
+        :arg out: :class:`Dat` or :class:`MixedDat` on the row space,
+            must not be ``x``"""
+        self._product(self.handle.mult, out, x)
+
+    @modifies_argn(2)
+    def mult_add(self, x, y, out):
+        """Compute ``out = y + A x``, writing the result into the existing
+        :class:`Dat` ``out``, which may be ``y``.
+
+        :arg x: :class:`Dat` or :class:`MixedDat` on the column space
+        :arg y: :class:`Dat` or :class:`MixedDat` on the row space
+        :arg out: :class:`Dat` or :class:`MixedDat` on the row space"""
+        self._product(self.handle.multAdd, out, x, y)
+
+    @modifies_argn(1)
+    def mult_transpose(self, x, out):
+        """Compute the transpose product ``out = A^T x``, writing the
+        result into the existing :class:`Dat` ``out``.
+
+        :arg x: :class:`Dat` or :class:`MixedDat` on the row space
+        :arg out: :class:`Dat` or :class:`MixedDat` on the column space,
+            must not be ``x``"""
+        self._product(self.handle.multTranspose, out, x)
+
     def __mul__(self, v):
         """Multiply this :class:`Mat` with the vector ``v``."""
         if not isinstance(v, (base.Dat, PETSc.Vec)):
             raise TypeError("Can only multiply Mat and Dat or PETSc Vec.")
-        if isinstance(v, base.Dat):
-            with v.vec_ro as vec:
-                y = self.handle * vec
-        else:
-            y = self.handle * v
         if isinstance(v, base.MixedDat):
             dat = _make_object('MixedDat', self.sparsity.dsets[0])
-            offset = 0
-            for d in dat:
-                sz = d.dataset.set.size
-                d.data[:] = y.getSubVector(PETSc.IS().createStride(sz, offset, 1)).array[:]
-                offset += sz
         else:
             dat = _make_object('Dat', self.sparsity.dsets[0])
-            dat.data[:] = y.array[:]
-        dat.needs_halo_update = True
+        # All owned entries are overwritten by the product
+        dat._use_pool(zero=False)
+        if isinstance(v, base.Dat):
+            self.mult(v, dat)
+        else:
+            base._trace.evaluate(set([self]), set())
+            self._assemble()
+            with dat.vec as y:
+                self.handle.mult(v, y)
         return dat
 
+
+class _ImplicitMatContext(object):
+    """Python context of the PETSc shell matrix of an :class:`ImplicitMat`."""
+
+    def __init__(self, mat):
+        self._mat = mat
+
+    def mult(self, A, x, y):
+        self._mat._mult(x, y)
+
+    def getDiagonal(self, A, d):
+        self._mat._get_diagonal(d)
+
+
+class ImplicitMat(base.ImplicitMat):
+    """Matrix-free OP2 matrix, see :class:`base.ImplicitMat`.
+
+    The PETSc matrix :attr:`handle` is a shell (``python``) matrix
+    whose multiplication and diagonal are computed by running the
+    corresponding :func:`par_loop`."""
+
+    @collective
+    def _init(self):
+        if not self.dtype == PETSc.ScalarType:
+            raise RuntimeError("Can only create a matrix of type %s, %s is not supported"
+                               % (PETSc.ScalarType, self.dtype))
+        rdim, cdim = self.dims
+        size = ((self._dsets[0].size * rdim, None),
+                (self._dsets[1].size * cdim, None))
+        mat = PETSc.Mat().createPython(size, _ImplicitMatContext(self))
+        mat.setUp()
+        # Work vectors the PETSc Vecs are copied to and from
+        self._x = _make_object('Dat', self._dsets[1], dtype=self.dtype)
+        self._y = _make_object('Dat', self._dsets[0], dtype=self.dtype)
+        self._handle = mat
+
+    @property
+    def handle(self):
+        """Petsc4py shell Mat computing the action of this matrix."""
+        if not hasattr(self, '_handle'):
+            self._init()
+        return self._handle
+
+    def _mult(self, x, y):
+        with self._x.vec as xv:
+            x.copy(xv)
+        self._action(self._x, self._y)
+        with self._y.vec_ro as yv:
+            yv.copy(y)
+
+    def _get_diagonal(self, d):
+        self._diagonal_action(self._y)
+        with self._y.vec_ro as yv:
+            yv.copy(d)
+
+
 # FIXME: Eventually (when we have a proper OpenCL solver) this wants to go in
 # sequential
 
@@ -479,9 +662,17 @@ class Solver(base.Solver, PETSc.KSP):
         self._reasons = dict([(getattr(converged_reason, r), r)
                               for r in dir(converged_reason)
                               if not r.startswith('_')])
+        # Parameters last passed to PETSc and snapshot of the operator the
+        # preconditioner was last set up for
+        self._parameters_set = None
+        self._operator_snapshot = None
 
     @collective
     def _set_parameters(self):
+        # Processing the options database is expensive, only do it when
+        # the parameters changed since the last solve
+        if self.parameters == self._parameters_set:
+            return False
         opts = PETSc.Options(self._opt_prefix)
         for k, v in self.parameters.iteritems():
             if type(v) is bool:
@@ -492,6 +683,8 @@ class Solver(base.Solver, PETSc.KSP):
             else:
                 opts[k] = v
         self.setFromOptions()
+        self._parameters_set = self.parameters.copy()
+        return True
 
     def __del__(self):
         # Remove stuff from the options database
@@ -503,10 +696,13 @@ class Solver(base.Solver, PETSc.KSP):
             delattr(self, '_opt_prefix')
 
     @collective
-    def _solve(self, A, x, b):
-        self._set_parameters()
+    def _setup(self, A):
+        if self.parameters['pc_type'] == 'fieldsplit' and isinstance(A, base.ImplicitMat):
+            raise MatTypeError("Cannot precondition an ImplicitMat with fieldsplit")
+        new_parameters = self._set_parameters()
         # Set up the operator only if it has changed
-        if not self.getOperators()[0] == A.handle:
+        new_operator = not self.getOperators()[0] == A.handle
+        if new_operator:
             self.setOperators(A.handle)
             if self.parameters['pc_type'] == 'fieldsplit' and A.sparsity.shape != (1, 1):
                 rows, cols = A.sparsity.shape
@@ -526,6 +722,29 @@ class Solver(base.Solver, PETSc.KSP):
                         ises.append((str(i), PETSc.IS().createStride(nrows, first=offset, step=1)))
                         offset += nrows
                 self.getPC().setFieldSplitIS(*ises)
+        # Rebuild the preconditioner only if the parameters or the values
+        # of the operator changed since it was last set up. Reassembling
+        # an unmodified matrix bumps the PETSc object state, but not its
+        # version. The action of an ImplicitMat may depend on data not
+        # tracked by its version, hence its preconditioner is always
+        # rebuilt.
+        reuse = not (new_parameters or new_operator) \
+            and self._operator_snapshot is not None \
+            and self._operator_snapshot.is_valid()
+        # KSPSetReusePreconditioner is only available from PETSc 3.5
+        if hasattr(self, 'setReusePreconditioner'):
+            self.setReusePreconditioner(reuse)
+        if isinstance(A, base.ImplicitMat):
+            # A snapshot of a previous operator must not carry over
+            self._operator_snapshot = None
+        elif not reuse:
+            self._operator_snapshot = A.create_snapshot()
+        self.setUp()
+
+    @collective
+    def _solve(self, A, x, b):
+        with timed_region("PETSc Krylov solver setup"):
+            self._setup(A)
         if self.parameters['plot_convergence']:
             self.reshist = []
 
@@ -36,7 +36,7 @@ Cython implementation of the Plan construction.
 """
 
 import base
-from profiling import timed_region
+from profiling import timed_region, MemoryTracker
 from utils import align, as_tuple
 import math
 import numpy
@@ -506,6 +506,10 @@ class Plan(base.Cached, _Plan):
             return
         with timed_region("Plan construction"):
             _Plan.__init__(self, iset, *args, **kwargs)
+        MemoryTracker.track("Plan", self, sum(a.nbytes for a in (
+            self.nelems, self.ind_map, self.loc_map, self.ind_sizes,
+            self.nindirect, self.ind_offs, self.offset, self.thrcol,
+            self.nthrcol, self.ncolblk, self.blkmap) if a is not None))
         Plan._cache_hit[self] = 0
         self._initialized = True
 
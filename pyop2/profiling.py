@@ -33,11 +33,16 @@
 
 """Profiling classes/functions."""
 
-import numpy as np
+from math import sqrt
+from thread import get_ident
 from time import time
+import weakref
 from contextlib import contextmanager
 from decorator import decorator
 
+from configuration import configuration
+from mpi import MPI
+
 import __builtin__
 
 
@@ -62,6 +67,27 @@ except AttributeError:
     memprof = _profile
 
 
+def write_table(column_heads, rows, filename=None, fmt='%g'):
+    """Print rows as a table under column_heads, or write them as CSV to
+    filename if given. Floats are printed with the format fmt."""
+    if isinstance(filename, str):
+        import csv
+        with open(filename, 'wb') as f:
+            f.write(','.join(column_heads) + "\n")
+            dialect = csv.excel
+            dialect.lineterminator = '\n'
+            csv.writer(f, dialect=dialect).writerows(rows)
+        return
+    rows = [tuple(fmt % v if isinstance(v, float) else str(v) for v in row)
+            for row in rows]
+    widths = [max([len(h)] + [len(row[i]) for row in rows])
+              for i, h in enumerate(column_heads)]
+    fmt = " | ".join("%%%ds" % w for w in widths)
+    print fmt % column_heads
+    for row in rows:
+        print fmt % row
+
+
 class Timer(object):
 
     """Generic timer class.
@@ -69,9 +95,18 @@ class Timer(object):
     :param name: The name of the timer, used as unique identifier.
     :param timer: The timer function to use. Takes no parameters and returns
         the current time. Defaults to time.time.
+
+    Timings are accumulated as running statistics (number of calls, total,
+    minimum, maximum and variance) rather than kept individually, so the
+    memory used does not grow with the number of calls. Timers started
+    while others are running are nested inside them, and the time spent
+    along every path of nested timers is recorded in a call tree (see
+    :meth:`tree_summary`).
     """
 
     _timers = {}
+    _stack = []
+    _tree = {}
 
     def __new__(cls, name=None, timer=time):
         n = name or 'timer' + str(len(cls._timers))
@@ -86,32 +121,55 @@ class Timer(object):
         self._name = n
         self._timer = timer
         self._start = None
-        self._timings = []
+        self.reset()
 
     def start(self):
         """Start the timer."""
         if self._name not in Timer._timers:
             self.reset()
             Timer._timers[self._name] = self
+        Timer._stack.append(self._name)
         self._start = self._timer()
 
     def stop(self):
         """Stop the timer."""
         assert self._start, "Timer %s has not been started yet." % self._name
         t = self._timer() - self._start
-        self._timings.append(t)
+        # Innermost running instance of this timer
+        i = len(Timer._stack) - 1 - Timer._stack[::-1].index(self._name)
+        path = tuple(Timer._stack[:i + 1])
+        del Timer._stack[i]
+        self._record(t, path)
+        if configuration['trace_file'] and self._timer is time:
+            Tracer.record(self._name, 'timer', self._start, t)
         self._start = None
         return t
 
     def reset(self):
         """Reset the timer."""
-        self._timings = []
+        self._ncalls = 0
+        self._total = 0.0
+        self._min = float('inf')
+        self._max = 0.0
+        self._m2 = 0.0
 
     def add(self, t):
         """Add a timing."""
         if self._name not in Timer._timers:
             Timer._timers[self._name] = self
-        self._timings.append(t)
+        self._record(t, tuple(Timer._stack) + (self._name,))
+
+    def _record(self, t, path):
+        # Welford's update of the running mean and sum of squared deviations
+        delta = t - self.average
+        self._ncalls += 1
+        self._total += t
+        self._m2 += delta * (t - self.average)
+        self._min = min(self._min, t)
+        self._max = max(self._max, t)
+        node = Timer._tree.setdefault(path, [0, 0.0])
+        node[0] += 1
+        node[1] += t
 
     @property
     def name(self):
@@ -127,49 +185,116 @@ class Timer(object):
     @property
     def ncalls(self):
         """Total number of recorded events."""
-        return len(self._timings)
+        return self._ncalls
 
     @property
     def total(self):
         """Total time spent for all recorded events."""
-        return sum(self._timings)
+        return self._total
 
     @property
     def average(self):
         """Average time spent per recorded event."""
-        return np.average(self._timings)
+        return self._total / self._ncalls if self._ncalls else 0.0
+
+    @property
+    def min(self):
+        """Minimum time spent for a recorded event."""
+        return self._min if self._ncalls else 0.0
+
+    @property
+    def max(self):
+        """Maximum time spent for a recorded event."""
+        return self._max
+
+    @property
+    def std(self):
+        """Standard deviation of the time spent per recorded event."""
+        return sqrt(self._m2 / self._ncalls) if self._ncalls else 0.0
 
     @classmethod
-    def summary(cls, filename=None):
-        """Print a summary table for all timers or write CSV to filename."""
-        if not cls._timers:
+    def _reduce(cls, comm):
+        """Reduce the totals and number of calls of all timers over the
+        ranks of comm.
+
+        :returns: a list of tuples ``(name, calls, min, mean, max)`` of
+            the total times across ranks, sorted by name. A timer not
+            started on a rank contributes zero time there.
+        """
+        local = dict((t.name, (t.total, t.ncalls)) for t in cls._timers.values())
+        ranks = comm.allgather(local)
+        rows = []
+        for name in sorted(set().union(*ranks)):
+            totals = [r.get(name, (0.0, 0))[0] for r in ranks]
+            calls = sum(r.get(name, (0.0, 0))[1] for r in ranks)
+            rows.append((name, calls, min(totals),
+                         sum(totals) / len(totals), max(totals)))
+        return rows
+
+    @classmethod
+    def summary(cls, filename=None, comm=None):
+        """Print a summary table for all timers or write it to filename.
+
+        :arg filename: The file to write to (optional). The output is JSON,
+            including the call tree, if the name ends in ``.json`` and CSV
+            otherwise.
+        :arg comm: The communicator to reduce the timings over (optional),
+            defaults to the PyOP2 communicator. When run on more than one
+            rank, the table shows the minimum, mean and maximum total time
+            of each timer across ranks and the load imbalance (maximum over
+            mean), and is only printed or written by rank 0.
+        """
+        comm = comm or MPI.comm
+        if comm.size > 1:
+            column_heads = ("Timer", "Calls", "Min total", "Mean total",
+                            "Max total", "Imbalance")
+            rows = [r + (r[4] / r[3] if r[3] > 0 else 1.0, )
+                    for r in cls._reduce(comm)]
+            if comm.rank != 0:
+                return
+        else:
+            column_heads = ("Timer", "Total time", "Calls", "Average time",
+                            "Min time", "Max time", "Std dev")
+            rows = [(t.name, t.total, t.ncalls, t.average, t.min, t.max, t.std)
+                    for t in sorted(cls._timers.values(), key=lambda k: k.name)]
+        if not rows:
             return
-        column_heads = ("Timer", "Total time", "Calls", "Average time")
-        if isinstance(filename, str):
-            import csv
-            with open(filename, 'wb') as f:
-                f.write(','.join(column_heads) + "\n")
-                dialect = csv.excel
-                dialect.lineterminator = '\n'
-                w = csv.writer(f, dialect=dialect)
-                w.writerows([(t.name, t.total, t.ncalls, t.average)
-                            for t in cls._timers.values()])
+        if isinstance(filename, str) and filename.endswith('.json'):
+            import json
+            with open(filename, 'w') as f:
+                json.dump({'ranks': comm.size,
+                           'timers': [dict(zip(column_heads, r)) for r in rows],
+                           'tree': [{'path': list(p), 'calls': n, 'total': t}
+                                    for p, n, t in cls.call_tree()]},
+                          f, indent=1)
         else:
-            namecol = max([len(column_heads[0])] + [len(t.name)
-                          for t in cls._timers.values()])
-            totalcol = max([len(column_heads[1])] + [len('%g' % t.total)
-                           for t in cls._timers.values()])
-            ncallscol = max([len(column_heads[2])] + [len('%d' % t.ncalls)
-                            for t in cls._timers.values()])
-            averagecol = max([len(column_heads[3])] + [len('%g' % t.average)
-                             for t in cls._timers.values()])
-            fmt = "%%%ds | %%%ds | %%%ds | %%%ds" % (
-                namecol, totalcol, ncallscol, averagecol)
-            print fmt % column_heads
-            fmt = "%%%ds | %%%dg | %%%dd | %%%dg" % (
-                namecol, totalcol, ncallscol, averagecol)
-            for t in sorted(cls._timers.values(), key=lambda k: k.name):
-                print fmt % (t.name, t.total, t.ncalls, t.average)
+            write_table(column_heads, rows, filename)
+
+    @classmethod
+    def call_tree(cls):
+        """Return the call tree of this rank as a list of tuples
+        ``(path, calls, total)``, where path is the tuple of names of the
+        nested timers from the outermost to the one timed. Every path
+        directly follows its parent."""
+        return [(p, n, t) for p, (n, t) in sorted(cls._tree.items())]
+
+    @classmethod
+    def tree_summary(cls):
+        """Print the call tree of this rank, with the total time spent in
+        each timer along each path, the time not spent in any nested timer
+        and the number of calls."""
+        tree = cls.call_tree()
+        if not tree:
+            return
+        inner = {}
+        for p, n, t in tree:
+            inner[p[:-1]] = inner.get(p[:-1], 0.0) + t
+        labels = ['  ' * (len(p) - 1) + p[-1] for p, n, t in tree]
+        width = max(len(l) for l in labels + ["Timer"])
+        fmt = "%%-%ds | %%12s | %%12s | %%8s" % width
+        print fmt % ("Timer", "Total time", "Self time", "Calls")
+        for l, (p, n, t) in zip(labels, tree):
+            print fmt % (l, '%g' % t, '%g' % (t - inner.get(p, 0.0)), n)
 
     @classmethod
     def get_timers(cls):
@@ -179,11 +304,329 @@ class Timer(object):
     @classmethod
     def reset_all(cls):
         """Clear all timer information previously recorded."""
+        cls._tree = {}
         if not cls._timers:
             return
         cls._timers = {}
 
 
+class LoopCounter(object):
+
+    """Performance counters of the :func:`~pyop2.op2.par_loop`\s executing
+    a kernel.
+
+    :param name: The name of the kernel.
+    :param key: A key identifying the code generated for the kernel.
+
+    There is one counter per ``(name, key)`` pair, recording the number of
+    calls and, for each of the core, owned and exec parts of the iteration
+    set, the time spent, the elements processed and an estimate of the
+    bytes of memory moved.
+    """
+
+    _counters = {}
+    regions = ('core', 'owned', 'exec')
+
+    def __new__(cls, name, key):
+        if (name, key) in cls._counters:
+            return cls._counters[(name, key)]
+        self = super(LoopCounter, cls).__new__(cls)
+        self._name = name
+        self._key = key
+        self._calls = 0
+        self._times = dict((r, 0.0) for r in cls.regions)
+        self._elements = 0
+        self._bytes = 0
+        cls._counters[(name, key)] = self
+        return self
+
+    def count(self):
+        """Record a call."""
+        self._calls += 1
+
+    def add(self, region, seconds, elements, nbytes):
+        """Record computing over a part of the iteration set.
+
+        :arg region: The part, one of ``"core"``, ``"owned"`` or ``"exec"``.
+        :arg seconds: The time spent.
+        :arg elements: The number of elements processed.
+        :arg nbytes: The bytes of memory moved.
+        """
+        self._times[region] += seconds
+        self._elements += elements
+        self._bytes += nbytes
+
+    @property
+    def name(self):
+        """Name of the kernel."""
+        return self._name
+
+    @property
+    def key(self):
+        """Key of the generated code."""
+        return self._key
+
+    @property
+    def calls(self):
+        """Number of calls."""
+        return self._calls
+
+    @property
+    def times(self):
+        """Dict of the time spent computing over each part."""
+        return dict(self._times)
+
+    @property
+    def time(self):
+        """Total time spent computing."""
+        return sum(self._times.values())
+
+    @property
+    def elements(self):
+        """Total number of elements processed."""
+        return self._elements
+
+    @property
+    def bytes(self):
+        """Total bytes of memory moved."""
+        return self._bytes
+
+    @property
+    def bandwidth(self):
+        """Achieved memory bandwidth in bytes per second."""
+        return self._bytes / self.time if self.time > 0 else 0.0
+
+    @classmethod
+    def summary(cls, filename=None, peak_bandwidth=0):
+        """Print a table of all counters, ordered by time spent, or write
+        CSV to filename.
+
+        :arg peak_bandwidth: The peak memory bandwidth in GB/s (optional),
+            to show the fraction of it achieved by each kernel.
+        """
+        if not cls._counters:
+            return
+        column_heads = ("Kernel", "Key", "Calls", "Core time", "Owned time",
+                        "Exec time", "Elements", "GB", "GB/s", "% peak")
+        rows = []
+        for c in sorted(cls._counters.values(), key=lambda c: -c.time):
+            gbs = c.bandwidth / 1e9
+            rows.append((c.name, c.key, c.calls) +
+                        tuple(c.times[r] for r in cls.regions) +
+                        (c.elements, c.bytes / 1e9, gbs,
+                         100 * gbs / peak_bandwidth if peak_bandwidth else float('nan')))
+        write_table(column_heads, rows, filename)
+
+    @classmethod
+    def get_counters(cls):
+        """Return a dict containing all counters, keyed by ``(name, key)``."""
+        return cls._counters
+
+    @classmethod
+    def reset_all(cls):
+        """Clear all counters."""
+        cls._counters = {}
+
+
+class Tracer(object):
+
+    """Timeline of runtime events on this rank, written in the Chrome
+    trace event format which can be viewed with ``chrome://tracing`` or
+    Perfetto.
+
+    Events are recorded while the configuration option ``trace_file`` is
+    set: a span for every :class:`Timer` measuring wall clock time stopped,
+    as well as the spans and instants recorded explicitly with
+    :func:`traced` and :meth:`instant`. Each event is tagged with the MPI
+    rank and the thread it happened on.
+    """
+
+    _events = []
+
+    @classmethod
+    def record(cls, name, cat, start, duration, args=None):
+        """Record a span of time.
+
+        :arg name: The name of the event.
+        :arg cat: The category of the event.
+        :arg start: The start time in seconds since the epoch.
+        :arg duration: The duration in seconds.
+        :arg args: A dict of additional information (optional).
+        """
+        event = {'name': name, 'cat': cat, 'ph': 'X',
+                 'ts': start * 1e6, 'dur': duration * 1e6,
+                 'pid': MPI.comm.rank, 'tid': get_ident()}
+        if args:
+            event['args'] = args
+        cls._events.append(event)
+
+    @classmethod
+    def instant(cls, name, cat, args=None):
+        """Record an event happening now, see :meth:`record`."""
+        event = {'name': name, 'cat': cat, 'ph': 'i', 's': 't',
+                 'ts': time() * 1e6, 'pid': MPI.comm.rank, 'tid': get_ident()}
+        if args:
+            event['args'] = args
+        cls._events.append(event)
+
+    @classmethod
+    def write(cls, filename, comm=None):
+        """Gather the events of all ranks of comm (defaults to the PyOP2
+        communicator) and write them to filename on rank 0. Times are
+        relative to the earliest event recorded."""
+        comm = comm or MPI.comm
+        events = comm.gather(cls._events, root=0)
+        if comm.rank != 0:
+            return
+        import json
+        events = [e for r in events for e in r]
+        epoch = min([e['ts'] for e in events] or [0])
+        trace = [dict(e, ts=e['ts'] - epoch) for e in events]
+        trace += [{'name': 'process_name', 'ph': 'M', 'pid': r,
+                   'args': {'name': 'Rank %d' % r}} for r in range(comm.size)]
+        with open(filename, 'w') as f:
+            json.dump({'traceEvents': trace, 'displayTimeUnit': 'ms'}, f)
+
+    @classmethod
+    def get_events(cls):
+        """Return the list of events recorded on this rank."""
+        return cls._events
+
+    @classmethod
+    def reset_all(cls):
+        """Clear all events recorded."""
+        cls._events = []
+
+
+@contextmanager
+def traced(name, cat, **args):
+    """A context manager recording the time spent in a code region as an
+    event of the :class:`Tracer`, if tracing is enabled. Unlike
+    :func:`timed_region`, the region is not timed otherwise.
+
+    :arg name: The name of the event.
+    :arg cat: The category of the event.
+    :arg args: Additional information to attach to the event.
+    """
+    if not configuration['trace_file']:
+        yield
+        return
+    start = time()
+    try:
+        yield
+    finally:
+        Tracer.record(name, cat, start, time() - start, args)
+
+
+class MemoryTracker(object):
+
+    """Accounting of the memory held by PyOP2 objects on this rank, by
+    category (e.g. ``"Dat"``, ``"Map"``, ``"Sparsity"``).
+
+    Objects are registered with :meth:`track` when their storage is
+    allocated and hold a weak reference with a callback, which releases
+    their bytes when they are collected. For each category, the tracker
+    keeps the bytes and number of objects live and the peak of the bytes
+    live, as well as the peak of the total over all categories.
+    Registration is disabled by the configuration option
+    ``track_memory``.
+    """
+
+    _live = {}
+    _count = {}
+    _peak = {}
+    _total = 0
+    _total_peak = 0
+    _refs = {}
+    # Bumped on reset, so that releases of objects registered before
+    # are ignored
+    _generation = 0
+
+    @classmethod
+    def track(cls, category, obj, nbytes=None):
+        """Account for the memory of ``obj`` under ``category`` until it
+        is collected.
+
+        :arg category: The category to account the memory under.
+        :arg obj: The object holding the memory, which must support weak
+            references, e.g. a NumPy array.
+        :arg nbytes: The bytes held (optional), defaults to ``obj.nbytes``.
+        :returns: ``obj``
+
+        Registering an object already tracked has no effect.
+        """
+        if not configuration['track_memory'] or obj is None:
+            return obj
+        key = id(obj)
+        ref = cls._refs.get(key)
+        if ref is not None and ref() is obj:
+            return obj
+        nbytes = obj.nbytes if nbytes is None else nbytes
+        generation = cls._generation
+
+        def release(ref):
+            if generation != cls._generation:
+                return
+            if cls._refs.get(key) is ref:
+                del cls._refs[key]
+            cls._live[category] -= nbytes
+            cls._count[category] -= 1
+            cls._total -= nbytes
+        cls._refs[key] = weakref.ref(obj, release)
+        live = cls._live.get(category, 0) + nbytes
+        cls._live[category] = live
+        cls._count[category] = cls._count.get(category, 0) + 1
+        cls._peak[category] = max(cls._peak.get(category, 0), live)
+        cls._total += nbytes
+        cls._total_peak = max(cls._total_peak, cls._total)
+        return obj
+
+    @classmethod
+    def live(cls, category=None):
+        """Bytes live in ``category``, or in total if not given."""
+        return cls._total if category is None else cls._live.get(category, 0)
+
+    @classmethod
+    def peak(cls, category=None):
+        """Peak of the bytes live in ``category``, or of the total if not
+        given."""
+        return cls._total_peak if category is None else cls._peak.get(category, 0)
+
+    @classmethod
+    def count(cls, category):
+        """Number of objects live in ``category``."""
+        return cls._count.get(category, 0)
+
+    @classmethod
+    def summary(cls, filename=None, comm=None):
+        """Print a table of the memory live and peak per category on each
+        rank of comm (defaults to the PyOP2 communicator), or write CSV to
+        filename. This is a collective operation, the table is printed or
+        written by rank 0 only."""
+        comm = comm or MPI.comm
+        rows = [(c, cls._count[c], cls._live[c], cls._peak[c])
+                for c in sorted(cls._live)]
+        rows.append(("Total", sum(cls._count.values()), cls._total, cls._total_peak))
+        ranks = comm.gather(rows, root=0)
+        if comm.rank != 0:
+            return
+        column_heads = ("Rank", "Category", "Objects", "Live MB", "Peak MB")
+        rows = [(r, c, n, live / 1e6, peak / 1e6)
+                for r, rank in enumerate(ranks) for c, n, live, peak in rank]
+        write_table(column_heads, rows, filename)
+
+    @classmethod
+    def reset_all(cls):
+        """Clear all memory accounting."""
+        cls._live = {}
+        cls._count = {}
+        cls._peak = {}
+        cls._total = 0
+        cls._total_peak = 0
+        cls._refs = {}
+        cls._generation += 1
+
+
 class timed_function(Timer):
 
     """Decorator to time function calls."""
@@ -220,9 +663,34 @@ def timed_region(name):
         toc(name)
 
 
-def summary(filename=None):
-    """Print a summary table for all timers or write CSV to filename."""
-    Timer.summary(filename)
+def summary(filename=None, comm=None):
+    """Print a summary table for all timers or write it to filename (see
+    :meth:`Timer.summary`)."""
+    Timer.summary(filename, comm)
+
+
+def tree_summary():
+    """Print the call tree of all timers (see :meth:`Timer.tree_summary`)."""
+    Timer.tree_summary()
+
+
+def loop_summary(filename=None):
+    """Print a table of the performance counters of all kernels executed
+    or write CSV to filename (see :class:`LoopCounter`)."""
+    LoopCounter.summary(filename, configuration['peak_bandwidth'])
+
+
+def memory_summary(filename=None):
+    """Print a table of the memory held by PyOP2 objects per category and
+    rank or write CSV to filename (see :class:`MemoryTracker`)."""
+    MemoryTracker.summary(filename)
+
+
+def write_trace(filename=None):
+    """Write the timeline of runtime events recorded on all ranks to
+    filename, defaulting to the configuration option ``trace_file`` (see
+    :class:`Tracer`)."""
+    Tracer.write(filename or configuration['trace_file'])
 
 
 def get_timers(reset=False):
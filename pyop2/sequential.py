@@ -42,6 +42,7 @@ import host
 from mpi import collective
 from petsc_base import *
 from host import Kernel, Arg  # noqa: needed by BackendSelector
+from hwcounters import counted
 from profiling import lineprof
 from utils import as_tuple
 
@@ -68,9 +69,11 @@ void %(wrapper_name)s(int start, int end,
     %(map_init)s;
     %(extr_loop)s
     %(map_bcs_m)s;
+    %(staging_gather)s;
     %(buffer_decl)s;
     %(buffer_gather)s
     %(kernel_name)s(%(kernel_args)s);
+    %(staging_scatter)s;
     %(layout_decl)s;
     %(layout_loop)s
         %(layout_assign)s;
@@ -80,6 +83,7 @@ void %(wrapper_name)s(int start, int end,
     %(apply_offset)s;
     %(extr_loop_close)s
   }
+  %(wrapper_finalise)s;
 }
 """
 
@@ -109,6 +113,9 @@ class ParLoop(host.ParLoop):
                         # evaluation of the trace
                         self._argtypes.append(d._argtype)
                         self._jit_args.append(d._data)
+                        if d._soa_storage:
+                            self._argtypes.append(ctypes.c_int)
+                            self._jit_args.append(d.dataset.total_size)
 
                 if arg._is_indirect or arg._is_mat:
                     maps = as_tuple(arg.map, Map)
@@ -117,6 +124,11 @@ class ParLoop(host.ParLoop):
                             self._argtypes.append(m._argtype)
                             self._jit_args.append(m.values_with_halo)
 
+                if arg._uses_csr_offsets:
+                    offsets = arg.data.sparsity._insertion_offsets(*arg.map)
+                    self._argtypes.append(ndpointer(offsets.dtype, shape=offsets.shape))
+                    self._jit_args.append(offsets)
+
             for c in Const._definitions():
                 self._argtypes.append(c._argtype)
                 self._jit_args.append(c.data)
@@ -148,10 +160,11 @@ class ParLoop(host.ParLoop):
 
         self._jit_args[0] = part.offset
         self._jit_args[1] = part.offset + part.size
-        # Must call fun on all processes since this may trigger
-        # compilation.
-        with timed_region("ParLoop kernel"):
-            fun(*self._jit_args, argtypes=self._argtypes, restype=None)
+        # Must call compile on all processes since compilation is
+        # collective.
+        fun = fun.compile(argtypes=self._argtypes, restype=None)
+        with timed_region("ParLoop kernel"), counted(self.kernel.name):
+            fun(*self._jit_args)
 
 
 def _setup():
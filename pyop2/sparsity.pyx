@@ -68,7 +68,10 @@ cdef build_sparsity_pattern(int rmult, int cmult, list maps, bool have_odiag):
 
     The sparsity pattern is built from the outer products of the pairs
     of maps.  This code works for both the serial and (MPI-) parallel
-    case."""
+    case.  In both cases the returned row pointer and column index
+    arrays describe the full (CSR) pattern of the process-local rows in
+    process-local column numbering, with each row's process-diagonal
+    columns (sorted) preceding its process-off-diagonal ones (sorted)."""
     cdef:
         int e, i, r, d, c
         int layer, layer_start, layer_end
@@ -93,7 +96,7 @@ cdef build_sparsity_pattern(int rmult, int cmult, list maps, bool have_odiag):
     if local_nrows == 0:
         # We don't own any rows, return something appropriate.
         dummy = np.empty(0, dtype=np.int32).reshape(-1)
-        return 0, 0, dummy, dummy, dummy, dummy
+        return 0, 0, dummy, dummy, np.zeros(1, dtype=np.int32), dummy
 
     s_diag = vector[vecset[int]](local_nrows)
     if have_odiag:
@@ -186,40 +189,38 @@ cdef build_sparsity_pattern(int rmult, int cmult, list maps, bool have_odiag):
     # Create final sparsity structure
     cdef np.ndarray[np.int32_t, ndim=1] dnnz = np.zeros(local_nrows, dtype=np.int32)
     cdef np.ndarray[np.int32_t, ndim=1] onnz = np.zeros(local_nrows, dtype=np.int32)
-    cdef np.ndarray[np.int32_t, ndim=1] rowptr
+    cdef np.ndarray[np.int32_t, ndim=1] rowptr = np.empty(local_nrows + 1, dtype=np.int32)
     cdef np.ndarray[np.int32_t, ndim=1] colidx
     cdef int dnz, onz
-    if have_odiag:
-        # Don't need these, so create dummy arrays
-        rowptr = np.empty(0, dtype=np.int32).reshape(-1)
-        colidx = np.empty(0, dtype=np.int32).reshape(-1)
-    else:
-        rowptr = np.empty(local_nrows + 1, dtype=np.int32)
 
     dnz = 0
     onz = 0
-    if have_odiag:
-        # Have off-diagonals (i.e. we're in parallel).
-        for row in range(local_nrows):
-            dnnz[row] = s_diag[row].size()
-            dnz += dnnz[row]
+    # Build the explicit row pointer and column index data structure
+    # petsc wants.  In parallel (when we have off-diagonals) this
+    # allows direct preallocation of the matrix from the CSR arrays,
+    # rather than inserting zeros to define the nonzero structure.
+    rowptr[0] = 0
+    for row in range(local_nrows):
+        dnnz[row] = s_diag[row].size()
+        dnz += dnnz[row]
+        if have_odiag:
             onnz[row] = s_odiag[row].size()
             onz += onnz[row]
-    else:
-        # Not in parallel, in which case build the explicit row
-        # pointer and column index data structure petsc wants.
-        rowptr[0] = 0
-        for row in range(local_nrows):
-            dnnz[row] = s_diag[row].size()
-            rowptr[row+1] = rowptr[row] + dnnz[row]
-            dnz += dnnz[row]
-        colidx = np.empty(dnz, dtype=np.int32)
-        for row in range(local_nrows):
-            # each row's entries in colidx need to be sorted.
-            s_diag[row].sort()
-            i = rowptr[row]
-            it = s_diag[row].begin()
-            while it != s_diag[row].end():
+        rowptr[row+1] = rowptr[row] + dnnz[row] + onnz[row]
+    colidx = np.empty(dnz + onz, dtype=np.int32)
+    for row in range(local_nrows):
+        # each row's entries in colidx need to be sorted.
+        s_diag[row].sort()
+        i = rowptr[row]
+        it = s_diag[row].begin()
+        while it != s_diag[row].end():
+            colidx[i] = deref(it)
+            inc(it)
+            i += 1
+        if have_odiag:
+            s_odiag[row].sort()
+            it = s_odiag[row].begin()
+            while it != s_odiag[row].end():
                 colidx[i] = deref(it)
                 inc(it)
                 i += 1
@@ -348,9 +349,19 @@ def fill_with_zeros(PETSc.Mat mat not None, dims, maps):
     mat.assemble()
 
 
-def build_sparsity(object sparsity, bool parallel):
+def build_sparsity(object sparsity, bool parallel, bool block=False):
+    """Build a sparsity pattern and attach it to ``sparsity``.
+
+    :arg sparsity: the :class:`Sparsity` to build the pattern for.
+    :arg parallel: are we running in parallel (do we need to
+        distinguish process-diagonal and off-diagonal columns)?
+    :arg block: build the pattern on block rows and columns, ignoring
+        the dimensions of the sparsity (for use with blocked matrices)."""
     cdef int rmult, cmult
-    rmult, cmult = sparsity._dims
+    if block:
+        rmult, cmult = 1, 1
+    else:
+        rmult, cmult = sparsity._dims
 
     pattern = build_sparsity_pattern(rmult, cmult, sparsity.maps, have_odiag=parallel)
 
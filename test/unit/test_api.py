@@ -951,6 +951,29 @@ class TestDatAPI:
         with pytest.raises(exceptions.DataTypeError):
             op2.Dat(dset, dtype='illegal_type')
 
+    def test_dat_compute_dtype(self, backend, dset):
+        "Default compute data type should be the storage data type."
+        d = op2.Dat(dset, dtype=np.float32)
+        assert d.compute_dtype == np.float32
+        d = op2.Dat(dset, dtype=np.float32, compute_dtype=np.float64)
+        assert d.dtype == np.float32 and d.compute_dtype == np.float64
+
+    def test_dat_illegal_compute_dtype(self, backend, dset):
+        "Converting non floating point data should raise DataTypeError."
+        with pytest.raises(exceptions.DataTypeError):
+            op2.Dat(dset, dtype=np.int32, compute_dtype=np.float64)
+
+    def test_dat_soa_auto(self, backend, set, skip_cuda, skip_opencl):
+        "SoA order should be chosen for Dats with enough components on the host."
+        assert not op2.Dat(set ** 4, soa="auto").soa
+        min_cdim = op2.configuration['soa_min_cdim']
+        try:
+            op2.configuration['soa_min_cdim'] = 4
+            assert op2.Dat(set ** 4, soa="auto").soa
+            assert not op2.Dat(set ** 2, soa="auto").soa
+        finally:
+            op2.configuration['soa_min_cdim'] = min_cdim
+
     def test_dat_illegal_length(self, backend, dset):
         "Mismatching data length should raise DataValueError."
         with pytest.raises(exceptions.DataValueError):
@@ -1080,6 +1103,22 @@ class TestMixedDatAPI:
         dat = op2.Dat(op2.Set(3) ** 2)
         assert op2.MixedDat((set, dset, dat)).split == (op2.Dat(set), op2.Dat(dset), dat)
 
+    def test_mixed_dat_contiguous(self, backend, mdset):
+        """Constructing a contiguous MixedDat should create Dats that are
+        views into a single allocation."""
+        mdat = op2.MixedDat(mdset, contiguous=True)
+        assert mdat.contiguous
+        assert mdat.dataset == mdset
+        for d in mdat:
+            assert d._data.base is mdat._contiguous_data
+        mdat[-1].data[:] = 1.0
+        assert (mdat[0].data_ro == 0.0).all()
+
+    def test_mixed_dat_contiguous_from_dats(self, backend, dats):
+        """A contiguous MixedDat cannot be constructed from existing Dats."""
+        with pytest.raises(exceptions.DataValueError):
+            op2.MixedDat(dats, contiguous=True)
+
     def test_mixed_dat_getitem(self, backend, mdat):
         "MixedDat should return the corresponding Dat when indexed."
         for i, d in enumerate(mdat):
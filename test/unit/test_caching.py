@@ -36,6 +36,7 @@ import numpy
 import random
 from pyop2 import plan
 from pyop2 import op2
+from pyop2 import caching
 
 from coffee.base import *
 
@@ -978,6 +979,79 @@ class TestSparsityCache:
         assert mat1._colidx is mat2._colidx
         assert mat1._rowptr is mat2._rowptr
 
+    def test_sparsity_disk_cache(self, backend, tmpdir, m1, ds2):
+        """Sparsities built from maps with the same values should be read
+        back from the on-disk cache."""
+        cache_dir = op2.configuration['cache_dir']
+        try:
+            op2.configuration['cache_dir'] = str(tmpdir)
+            op2.configuration['sparsity_cache'] = True
+            sp1 = op2.Sparsity(ds2, m1)
+            s3 = op2.Set(5)
+            s4 = op2.Set(5)
+            m3 = op2.Map(s3, s4, 1, m1.values)
+            sp2 = op2.Sparsity(op2.DataSet(s4, 1), m3)
+            assert sp1 is not sp2
+            assert isinstance(sp2._d_nnz, numpy.memmap)
+            assert sp1.nz == sp2.nz and sp1.onz == sp2.onz
+            assert (sp1.nnz == sp2.nnz).all()
+            assert (sp1.onnz == sp2.onnz).all()
+            assert (sp1._rowptr == sp2._rowptr).all()
+            assert (sp1._colidx == sp2._colidx).all()
+        finally:
+            op2.configuration['cache_dir'] = cache_dir
+            op2.configuration['sparsity_cache'] = False
+
+    def test_sparsity_disk_cache_stats(self, backend, tmpdir, m1, ds2):
+        cache_dir = op2.configuration['cache_dir']
+        try:
+            op2.configuration['cache_dir'] = str(tmpdir)
+            op2.configuration['sparsity_cache'] = True
+            caching.reset_cache_stats()
+            op2.Sparsity(ds2, m1)
+            s3 = op2.Set(5)
+            m3 = op2.Map(s3, op2.Set(5), 1, m1.values)
+            op2.Sparsity(op2.DataSet(m3.toset, 1), m3)
+            stats = caching.get_cache_stats()['pyop2.base.Sparsity on disk']
+            assert (stats.disk_hits, stats.misses, stats.stores) == (1, 1, 1)
+        finally:
+            op2.configuration['cache_dir'] = cache_dir
+            op2.configuration['sparsity_cache'] = False
+
+
+class TestCacheStats:
+
+    """
+    Cache statistics tests.
+    """
+
+    def test_kernel_hit_miss(self, backend):
+        op2.base.Kernel._cache.clear()
+        caching.reset_cache_stats()
+        code = "void k(void *x) {}"
+        k = op2.Kernel(code, 'k')
+        op2.Kernel(code, 'k')
+        op2.Kernel(code, 'k')
+        stats = caching.CacheStats.of(type(k))
+        assert (stats.hits, stats.misses, stats.stores) == (2, 1, 1)
+        assert stats.hit_rate == 2.0 / 3
+        assert stats.miss_time >= 0
+
+    def test_object_cached_hit_miss(self, backend):
+        caching.reset_cache_stats()
+        s = op2.Set(2)
+        s ** 1
+        s ** 1
+        stats = caching.get_cache_stats()['pyop2.base.DataSet']
+        assert (stats.hits, stats.misses) == (1, 1)
+
+    def test_report(self, backend, capsys):
+        caching.reset_cache_stats()
+        op2.Set(2) ** 1
+        caching.report_cache_stats()
+        out, err = capsys.readouterr()
+        assert 'pyop2.base.DataSet' in out and 'Hit rate' in out
+
 if __name__ == '__main__':
     import os
     pytest.main(os.path.abspath(__file__))
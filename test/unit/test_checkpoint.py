@@ -0,0 +1,243 @@
+# This file is part of PyOP2
+#
+# PyOP2 is Copyright (c) 2012, Imperial College London and
+# others. Please see the AUTHORS file in the main source directory for
+# a full list of copyright holders.  All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions
+# are met:
+#
+#     * Redistributions of source code must retain the above copyright
+#       notice, this list of conditions and the following disclaimer.
+#     * Redistributions in binary form must reproduce the above copyright
+#       notice, this list of conditions and the following disclaimer in the
+#       documentation and/or other materials provided with the distribution.
+#     * The name of Imperial College London or that of other
+#       contributors may not be used to endorse or promote products
+#       derived from this software without specific prior written
+#       permission.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTERS
+# ''AS IS'' AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT
+# LIMITED TO, THE IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS
+# FOR A PARTICULAR PURPOSE ARE DISCLAIMED. IN NO EVENT SHALL THE
+# COPYRIGHT HOLDERS OR CONTRIBUTORS BE LIABLE FOR ANY DIRECT,
+# INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES
+# (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR
+# SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION)
+# HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT,
+# STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE)
+# ARISING IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED
+# OF THE POSSIBILITY OF SUCH DAMAGE.
+
+
+import os
+import pytest
+import numpy as np
+
+from pyop2 import op2
+
+nelems = 5
+
+
+@pytest.fixture(scope='module')
+def s():
+    return op2.Set(nelems)
+
+
+@pytest.fixture
+def d1(s):
+    return op2.Dat(s, range(nelems), dtype=np.float64, name='d1')
+
+
+@pytest.fixture
+def g():
+    return op2.Global(2, [1, 2], dtype=np.int32, name='g')
+
+
+class TestCheckpointWriter:
+
+    """
+    Checkpoint writer tests
+    """
+
+    def test_write_npz(self, backend, tmpdir, d1, g):
+        "Checkpointed data should be written to an npz archive."
+        filename = str(tmpdir.join('state.npz'))
+        with op2.CheckpointWriter('npz') as writer:
+            writer.write(filename, [d1, g])
+        f = np.load(filename)
+        assert (f['d1'] == d1.data_ro).all()
+        assert (f['g'] == g.data_ro).all()
+
+    def test_write_npz_compressed(self, backend, tmpdir, d1):
+        "Compressed checkpoints should read back unchanged."
+        filename = str(tmpdir.join('state.npz'))
+        with op2.CheckpointWriter('npz', compression=True) as writer:
+            writer.write(filename, [d1])
+        assert (np.load(filename)['d1'] == np.arange(nelems)).all()
+
+    def test_write_npy(self, backend, tmpdir, d1, g):
+        "The npy format should write a directory of npy files."
+        dirname = str(tmpdir.join('state'))
+        with op2.CheckpointWriter('npy') as writer:
+            writer.write(dirname, [d1, g])
+        assert sorted(os.listdir(dirname)) == ['d1.npy', 'g.npy']
+        assert (np.load(os.path.join(dirname, 'd1.npy')) == d1.data_ro).all()
+
+    def test_write_hdf5(self, backend, tmpdir, d1):
+        "The hdf5 format should write one dataset per object."
+        h5py = pytest.importorskip("h5py")
+        filename = str(tmpdir.join('state.h5'))
+        with op2.CheckpointWriter('hdf5', compression=True) as writer:
+            writer.write(filename, [d1])
+        with h5py.File(filename, 'r') as f:
+            assert (f['d1'][...] == d1.data_ro).all()
+
+    def test_write_snapshots(self, backend, tmpdir, d1):
+        "Modifying a Dat after writing it should not change its checkpoint."
+        writer = op2.CheckpointWriter('npz')
+        first = str(tmpdir.join('first.npz'))
+        second = str(tmpdir.join('second.npz'))
+        writer.write(first, [d1])
+        d1.data[:] = -1
+        writer.write(second, [d1])
+        d1.data[:] = -2
+        writer.close()
+        assert (np.load(first)['d1'] == np.arange(nelems)).all()
+        assert (np.load(second)['d1'] == -1).all()
+
+    def test_write_mixed_dat(self, backend, tmpdir, s):
+        "A MixedDat should be written as its components."
+        mdat = op2.MixedDat([op2.Dat(s, name='a'), op2.Dat(s, name='b')])
+        filename = str(tmpdir.join('state.npz'))
+        with op2.CheckpointWriter('npz') as writer:
+            writer.write(filename, [mdat])
+        assert sorted(np.load(filename).files) == ['a', 'b']
+
+    def test_write_bandwidth(self, backend, tmpdir, d1):
+        "The writer should record the size of completed writes."
+        filename = str(tmpdir.join('state.npz'))
+        with op2.CheckpointWriter('npz') as writer:
+            assert writer.bandwidth is None
+            writer.write(filename, [d1])
+            writer.wait()
+            assert writer.stats[0][:2] == (filename, d1.data_ro.nbytes)
+
+    def test_write_duplicate_names(self, backend, tmpdir, d1):
+        "Objects in a checkpoint should have unique names."
+        with op2.CheckpointWriter('npz') as writer:
+            with pytest.raises(ValueError):
+                writer.write(str(tmpdir.join('state.npz')), [d1, d1])
+
+    def test_npy_compression(self, backend):
+        "The npy format should not accept compression."
+        with pytest.raises(ValueError):
+            op2.CheckpointWriter('npy', compression=True)
+
+    def test_write_error(self, backend, tmpdir, d1):
+        "Errors in the background write should be raised on waiting."
+        filename = str(tmpdir.join('nonexistent', 'state.npz'))
+        writer = op2.CheckpointWriter('npz')
+        writer.write(filename, [d1])
+        with pytest.raises(IOError):
+            writer.wait()
+        writer.close()
+
+
+@pytest.fixture
+def h5py():
+    return pytest.importorskip("h5py")
+
+
+@pytest.fixture
+def m(s):
+    toset = op2.Set(3, name='toset')
+    return op2.Map(s, toset, 2, [0, 1, 1, 2, 2, 0, 0, 1, 1, 2], name='m')
+
+
+class TestCheckpointRestore:
+
+    """
+    Whole-state checkpoint and restore tests
+    """
+
+    def test_restore(self, backend, h5py, tmpdir, s, m, d1, g):
+        "Restoring a checkpoint should recreate the objects and their sets."
+        path = str(tmpdir.join('state.h5'))
+        op2.checkpoint(path, [m, d1, g])
+        state = op2.restore(path)
+        assert sorted(state) == sorted([s.name, 'toset', 'm', 'd1', 'g'])
+        assert state[s.name].sizes == s.sizes
+        assert state['m'].iterset is state[s.name]
+        assert state['m'].toset.size == 3
+        assert (state['m'].values == m.values).all()
+        assert state['d1'].dataset.set is state[s.name]
+        assert (state['d1'].data_ro == d1.data_ro).all()
+        assert state['g'].dtype == np.int32 and (state['g'].data_ro == [1, 2]).all()
+
+    def test_restore_mmap(self, backend, h5py, tmpdir, d1):
+        "Dats should be memory mapped copy-on-write when restored."
+        path = str(tmpdir.join('state.h5'))
+        op2.checkpoint(path, [d1])
+        d = op2.restore(path)['d1']
+        assert isinstance(d._numpy_data, np.memmap)
+        d.data[:] = -1
+        assert (op2.restore(path)['d1'].data_ro == np.arange(nelems)).all()
+
+    def test_restore_no_mmap(self, backend, h5py, tmpdir, d1):
+        "Dats should be read into memory without mmap."
+        path = str(tmpdir.join('state.h5'))
+        op2.checkpoint(path, [d1])
+        d = op2.restore(path, mmap=False)['d1']
+        assert not isinstance(d._numpy_data, np.memmap)
+        assert (d.data_ro == d1.data_ro).all()
+
+    def test_restore_soa(self, backend, h5py, tmpdir, s):
+        "A Dat in SoA order should be restored in SoA order."
+        d = op2.Dat(s ** 2, np.arange(2 * nelems), soa=True, name='soa')
+        path = str(tmpdir.join('state.h5'))
+        op2.checkpoint(path, [d])
+        r = op2.restore(path)['soa']
+        assert r.soa and (r.data_ro == d.data_ro).all()
+
+    def test_restore_mixed_dat(self, backend, h5py, tmpdir, s):
+        "A MixedDat should be restored as its components."
+        mdat = op2.MixedDat([op2.Dat(s, np.ones(nelems), name='a'),
+                             op2.Dat(s, np.zeros(nelems), name='b')])
+        path = str(tmpdir.join('state.h5'))
+        op2.checkpoint(path, [mdat])
+        state = op2.restore(path)
+        assert sorted(state) == sorted([s.name, 'a', 'b'])
+        assert (state['a'].data_ro == 1).all() and (state['b'].data_ro == 0).all()
+
+    def test_restore_const(self, backend, h5py, tmpdir):
+        "A Const should be restored into the namespace of Consts."
+        c = op2.Const(2, [3, 4], name='checkpoint_const', dtype=np.float64)
+        path = str(tmpdir.join('state.h5'))
+        op2.checkpoint(path, [c])
+        c.remove_from_namespace()
+        r = op2.restore(path)['checkpoint_const']
+        try:
+            assert (r.data == [3, 4]).all()
+        finally:
+            r.remove_from_namespace()
+
+    def test_checkpoint_duplicate_names(self, backend, h5py, tmpdir, s):
+        "Objects in a checkpoint should have unique names."
+        d = op2.Dat(s, name='x')
+        e = op2.Dat(s, name='x')
+        with pytest.raises(ValueError):
+            op2.checkpoint(str(tmpdir.join('state.h5')), [d, e])
+
+    def test_restore_not_checkpoint(self, backend, h5py, tmpdir):
+        "Restoring an HDF5 file not written by checkpoint should raise."
+        path = str(tmpdir.join('other.h5'))
+        h5py.File(path, 'w').close()
+        with pytest.raises(ValueError):
+            op2.restore(path)
+
+
+if __name__ == '__main__':
+    pytest.main(os.path.abspath(__file__))
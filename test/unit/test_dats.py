@@ -34,7 +34,7 @@
 import pytest
 import numpy as np
 
-from pyop2 import op2
+from pyop2 import op2, base, exceptions
 
 nelems = 5
 
@@ -54,6 +54,11 @@ def mdat(d1):
     return op2.MixedDat([d1, d1])
 
 
+@pytest.fixture
+def x32(s):
+    return op2.Dat(s, range(nelems), dtype=np.float32, compute_dtype=np.float64)
+
+
 class TestDat:
 
     """
@@ -139,6 +144,173 @@ class TestDat:
         mdat2.load(output)
         assert all(all(d.data_ro == d_.data_ro) for d, d_ in zip(mdat, mdat2))
 
+    def test_dat_load_mmap(self, backend, tmpdir, d1, s):
+        """Loading with mmap_mode should use the mapped file as storage."""
+        output = tmpdir.join('output').strpath
+        d1.save(output)
+        d2 = op2.Dat(s)
+        d2.load(output, mmap_mode='r')
+        assert isinstance(d2._data, np.memmap)
+        assert (d1.data_ro == d2.data_ro).all()
+
+    def test_dat_fromfile_readonly(self, backend, tmpdir, s):
+        """A Dat mapped read-only from a raw file should be readable in a
+        par_loop, but not writable."""
+        output = tmpdir.join('output').strpath
+        np.arange(nelems, dtype=np.float64).tofile(output)
+        d = op2.Dat.fromfile(s, output, dtype=np.float64)
+        assert not d.needs_halo_update
+        assert (d.data_ro == np.arange(nelems)).all()
+        d2 = op2.Dat(d)
+        assert (d2.data_ro == np.arange(nelems)).all()
+        with pytest.raises(exceptions.ModeValueError):
+            d(op2.WRITE)
+
+    def test_dat_fromfile_copy_on_write(self, backend, tmpdir, d1, s):
+        """Modifying a Dat mapped copy-on-write should not modify the
+        file."""
+        output = tmpdir.join('output.npy').strpath
+        d1.save(output)
+        d = op2.Dat.fromfile(s, output, mode='c')
+        assert d.needs_halo_update
+        d += d
+        assert (d.data_ro == 2 * d1.data_ro).all()
+        assert (np.load(output) == d1.data_ro).all()
+
+    def test_dat_fromfile_wrong_size(self, backend, tmpdir, s):
+        """Mapping a file of the wrong shape should raise an error."""
+        output = tmpdir.join('output.npy').strpath
+        np.save(output, np.arange(nelems + 1, dtype=np.float64))
+        with pytest.raises(exceptions.DataValueError):
+            op2.Dat.fromfile(s, output)
+
+
+class TestDatPool:
+
+    """
+    Test the reuse of the storage of temporary Dats
+    """
+
+    def test_scratch_dat_reuses_storage(self, backend):
+        """The storage of a scratch Dat should be reused, zeroed, by the next
+        scratch Dat on the same DataSet."""
+        dset = op2.Set(nelems) ** 1
+        with op2.scratch_dat(dset) as tmp:
+            assert (tmp.data_ro == 0).all()
+            tmp.data[:] = 1.0
+        hits = base.dat_pool.hits
+        with op2.scratch_dat(dset) as tmp:
+            assert (tmp.data_ro == 0).all()
+        assert base.dat_pool.hits == hits + 1
+
+    def test_temporary_dat_reuses_storage(self, backend):
+        """The storage of a collected temporary Dat should be reused."""
+        x = op2.Dat(op2.Set(nelems), range(nelems), dtype=np.float64)
+        y = x + x
+        assert (y.data_ro == 2 * x.data_ro).all()
+        del y
+        hits, saved = base.dat_pool.hits, base.dat_pool.bytes_saved
+        y = x * 3.0
+        assert (y.data_ro == 3 * x.data_ro).all()
+        assert base.dat_pool.hits == hits + 1
+        assert base.dat_pool.bytes_saved == saved + x.nbytes
+
+    def test_dat_pool_keeps_referenced_storage(self, backend):
+        """The storage of a collected Dat should not be reused while a view
+        of its data is still referenced."""
+        x = op2.Dat(op2.Set(nelems), range(nelems), dtype=np.float64)
+        view = (x + x).data_ro
+        y = x * 3.0
+        assert (y.data_ro == 3 * x.data_ro).all()
+        assert (view == 2 * x.data_ro).all()
+
+    def test_dat_pool_keeps_storage_of_derived_views(self, backend):
+        """The storage of a collected Dat should not be reused while a view
+        of a view of its data is still referenced."""
+        x = op2.Dat(op2.Set(nelems), range(nelems), dtype=np.float64)
+        view = np.asarray((x + x).data_ro[1:])[::2]
+        y = x * 3.0
+        assert (y.data_ro == 3 * x.data_ro).all()
+        assert (view == 2 * x.data_ro[1::2]).all()
+
+    def test_dat_pool_unzeroed_version(self, backend):
+        """A Dat taken from the pool without zeroing holds the values of a
+        previous Dat, hence it should not be at the zero version."""
+        dset = op2.Set(nelems) ** 1
+        with op2.scratch_dat(dset) as tmp:
+            tmp.data[:] = 1.0
+        d = op2.Dat(dset)._use_pool(zero=False)
+        assert d._version != 0
+
+    def test_dat_pool_disabled(self, backend):
+        """No storage should be kept if the pool size is zero."""
+        max_bytes = op2.configuration['dat_pool_max_bytes']
+        op2.configuration['dat_pool_max_bytes'] = 0
+        try:
+            dset = op2.Set(nelems) ** 1
+            with op2.scratch_dat(dset):
+                pass
+            hits = base.dat_pool.hits
+            with op2.scratch_dat(dset):
+                pass
+            assert base.dat_pool.hits == hits
+        finally:
+            op2.configuration['dat_pool_max_bytes'] = max_bytes
+
+
+class TestMixedPrecision:
+
+    """
+    Test Dats stored with a lower precision than kernels compute in
+    """
+
+    def test_direct_loop(self, backend, x32, skip_cuda, skip_opencl):
+        """A kernel should see the data in the compute precision and its
+        result should be stored in the storage precision."""
+        k = """void k(double *x) { *x = *x / 3.0; }"""
+        op2.par_loop(op2.Kernel(k, 'k'), x32.dataset.set, x32(op2.RW))
+        assert x32.data_ro.dtype == np.float32
+        assert np.allclose(x32.data_ro, np.arange(nelems, dtype=np.float32) / 3)
+
+    def test_indirect_loop(self, backend, s, x32, skip_cuda, skip_opencl):
+        """Indirectly incremented mixed precision data should accumulate the
+        contributions of all iteration set elements."""
+        edges = op2.Set(nelems - 1)
+        m = op2.Map(edges, s, 2, [(i, i + 1) for i in range(nelems - 1)])
+        y = op2.Dat(s, dtype=np.float32, compute_dtype=np.float64)
+        k = """void k(double **y, double **x) {
+        y[0][0] += 0.5 * x[1][0];
+        y[1][0] += 0.5 * x[0][0];
+        }"""
+        op2.par_loop(op2.Kernel(k, 'k'), edges, y(op2.INC, m), x32(op2.READ, m))
+        xs = np.arange(nelems, dtype=np.float64)
+        expected = np.zeros(nelems)
+        expected[:-1] += 0.5 * xs[1:]
+        expected[1:] += 0.5 * xs[:-1]
+        assert np.allclose(y.data_ro, expected)
+
+    def test_inner_accumulates_in_compute_precision(self, backend, s, skip_cuda, skip_opencl):
+        """The inner product should be accumulated in the compute precision."""
+        x = op2.Dat(s, [1e8, 1.0, -1e8, 1.0, 1.0], dtype=np.float32,
+                    compute_dtype=np.float64)
+        y = op2.Dat(s, [1.0] * nelems, dtype=np.float32, compute_dtype=np.float64)
+        assert x.inner(y) == 3.0
+
+    def test_vec(self, backend, x32, skip_cuda, skip_opencl):
+        """Values set through the PETSc Vec should be converted back to the
+        storage precision."""
+        with x32.vec as v:
+            assert np.allclose(v.array_r, range(nelems))
+            v.scale(2.0)
+        assert x32.data_ro.dtype == np.float32
+        assert np.allclose(x32.data_ro, 2 * np.arange(nelems))
+
+    def test_mixed_precision_on_device(self, backend, s, skip_sequential, skip_openmp):
+        """Mixed precision Dats should be rejected by device backends."""
+        with pytest.raises(NotImplementedError):
+            op2.Dat(s, dtype=np.float32, compute_dtype=np.float64)
+
+
 if __name__ == '__main__':
     import os
     pytest.main(os.path.abspath(__file__))
@@ -211,7 +211,8 @@ class TestDirectLoop:
                      elems, soa(op2.WRITE))
         assert all(soa.data[:, 0] == 42) and all(soa.data[:, 1] == 43)
 
-    def test_soa_should_stay_c_contigous(self, backend, elems, soa):
+    def test_soa_should_stay_c_contigous(self, backend, elems, soa,
+                                         skip_sequential, skip_openmp):
         """Verify that a Dat in SoA order remains C contiguous after being
         written to in a par_loop."""
         k = "void dummy(unsigned int *x) {}"
@@ -220,6 +221,53 @@ class TestDirectLoop:
                      soa(op2.WRITE))
         assert soa.data.flags['C_CONTIGUOUS']
 
+    def test_soa_host_storage(self, backend, elems, soa, skip_cuda, skip_opencl):
+        """Verify that a Dat in SoA order stores each component contiguously
+        on the host, also after being written to in a par_loop."""
+        k = """void k(unsigned int *x) { OP2_STRIDE(x, 0) = 1; OP2_STRIDE(x, 1) = 2; }"""
+        assert soa.data_ro.flags['F_CONTIGUOUS']
+        op2.par_loop(op2.Kernel(k, "k"), elems, soa(op2.RW))
+        assert soa.data_ro.flags['F_CONTIGUOUS']
+        assert all(soa.data_ro[:, 0] == 1) and all(soa.data_ro[:, 1] == 2)
+
+    def test_soa_rw_aos(self, backend, elems, soa, y):
+        """Swap the components of a Dat in SoA order into a Dat in AoS order
+        and increment them."""
+        k = """void k(unsigned int *y, unsigned int *x) {
+          y[0] = OP2_STRIDE(x, 1); y[1] = OP2_STRIDE(x, 0);
+          OP2_STRIDE(x, 0) += 1; OP2_STRIDE(x, 1) += 2;
+        }"""
+        x0 = soa.data_ro.copy()
+        op2.par_loop(op2.Kernel(k, "k"), elems, y(op2.WRITE), soa(op2.RW))
+        assert all(y.data_ro[:, 0] == x0[:, 1]) and all(y.data_ro[:, 1] == x0[:, 0])
+        assert all(soa.data_ro[:, 0] == x0[:, 0] + 1)
+        assert all(soa.data_ro[:, 1] == x0[:, 1] + 2)
+
+    def test_soa_auto(self, backend, elems, delems2, skip_cuda, skip_opencl):
+        """Kernels should see the data of each element of a Dat whose layout
+        PyOP2 chose contiguously, also if they are stored in SoA order."""
+        min_cdim = op2.configuration['soa_min_cdim']
+        try:
+            op2.configuration['soa_min_cdim'] = 2
+            x = op2.Dat(delems2, [xarray(), xarray()], np.uint32, soa="auto")
+        finally:
+            op2.configuration['soa_min_cdim'] = min_cdim
+        assert x.data_ro.flags['F_CONTIGUOUS']
+        k = """void k(unsigned int *x) { x[0] += 1; x[1] += 2; }"""
+        x0 = x.data_ro.copy()
+        op2.par_loop(op2.Kernel(k, "k"), elems, x(op2.RW))
+        assert all(x.data_ro[:, 0] == x0[:, 0] + 1)
+        assert all(x.data_ro[:, 1] == x0[:, 1] + 2)
+
+    def test_soa_vec(self, backend, elems, soa, skip_cuda, skip_opencl):
+        """The PETSc Vec of a Dat in SoA order should hold the data of each
+        element contiguously."""
+        d = op2.Dat(soa.dataset, soa.data_ro, np.float64, soa=True)
+        with d.vec as v:
+            assert (v.array_r == d.data_ro.reshape(-1)).all()
+            v.scale(2.0)
+        assert (d.data_ro == 2 * soa.data_ro).all()
+
     def test_parloop_should_set_ro_flag(self, backend, elems, x):
         """Assert that a par_loop locks each Dat argument for writing."""
         kernel = """void k(unsigned int *x) { *x = 1; }"""
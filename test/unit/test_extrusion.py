@@ -432,6 +432,21 @@ void comp_vol(double A[1], double *x[], double *y[])
 
         assert sum(sum(dat_c.data)) == nums[0] * layers * 2
 
+    def test_indirect_coords_inc_soa(self, backend, elements, dat_coords,
+                                     coords_map, dat_c):
+        """Reading and incrementing Dats stored in SoA order in an extruded
+        loop should give the same result as for Dats stored in AoS order."""
+        k = op2.Kernel("""void k(double* x[], double* y[]) {
+          for (int i = 0; i < 6; i++) { y[i][0] += x[i][0]; y[i][1] += 2 * x[i][1]; }
+        }""", "k")
+        op2.par_loop(k, elements, dat_coords(op2.READ, coords_map),
+                     dat_c(op2.INC, coords_map))
+        coords_soa = op2.Dat(dat_coords.dataset, dat_coords.data_ro, numpy.float64, soa=True)
+        c_soa = op2.Dat(dat_coords.dataset, numpy.zeros_like(dat_c.data_ro), numpy.float64, soa=True)
+        op2.par_loop(k, elements, coords_soa(op2.READ, coords_map),
+                     c_soa(op2.INC, coords_map))
+        assert (c_soa.data_ro == dat_c.data_ro).all()
+
     def test_extruded_assemble_mat_rhs_solve(
         self, backend, xtr_mat, xtr_coords, xtr_elements,
         xtr_elem_node, extrusion_kernel, xtr_nodes, vol_comp,
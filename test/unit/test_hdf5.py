@@ -38,7 +38,7 @@ HDF5 API Unit Tests
 import numpy as np
 import pytest
 
-from pyop2 import op2
+from pyop2 import op2, exceptions
 
 # If h5py is not available this test module is skipped
 h5py = pytest.importorskip("h5py")
@@ -122,3 +122,69 @@ class TestHDF5:
         assert m.arity == 2
         assert m.values.sum() == sum((1, 2, 2, 3))
         assert m.name == 'map'
+
+
+class TestPartitionedHDF5:
+
+    @pytest.fixture(scope='module')
+    def meshfile(cls, request):
+        tmpdir = request.config._tmpdirhandler.mktemp(
+            'test_hdf5_partitioned', numbered=True)
+        f = h5py.File(str(tmpdir.join('mesh.h5')), 'w')
+        f.create_dataset('cells', data=np.array((4,)))
+        f.create_dataset('nodes', data=np.array((5,)))
+        f.create_dataset('cell_node', data=np.array(((0, 1), (1, 2),
+                                                     (2, 3), (3, 4))))
+        f.create_dataset('coords', data=np.arange(10, dtype=np.float64).reshape(5, 2))
+        f['coords'].attrs['type'] = 'double'
+        f.create_dataset('node_partition', data=np.zeros(5, dtype=np.int32))
+        request.addfinalizer(f.close)
+        return op2.PartitionedFile(f)
+
+    def test_load_partitioned(self, backend, meshfile):
+        "Loading a mesh on a single process should keep the global numbering."
+        cells, nodes, m = meshfile.load('cells', 'nodes', 'cell_node',
+                                        np.zeros(4, dtype=np.int32),
+                                        'node_partition')
+        assert cells.sizes == (4, 4, 4, 4) and nodes.sizes == (5, 5, 5, 5)
+        assert m.iterset == cells and m.toset == nodes and m.arity == 2
+        assert (m.values == meshfile.read_rows('cell_node', range(4))).all()
+        assert (meshfile.numbering(nodes) == np.arange(5)).all()
+
+    def test_dat_partitioned(self, backend, meshfile):
+        "Dats should be read in the local numbering of their set."
+        _, nodes, _ = meshfile.load('cells', 'nodes', 'cell_node',
+                                    np.zeros(4, dtype=np.int32),
+                                    'node_partition')
+        d = meshfile.dat(op2.DataSet(nodes, 2), 'coords')
+        assert d.dtype == np.float64
+        assert (d.data_ro == np.arange(10).reshape(5, 2)).all()
+
+    def test_read_rows_chunked(self, backend, meshfile):
+        "Reading rows in several slabs should return them in the order requested."
+        chunk_size = op2.configuration['hdf5_chunk_size']
+        try:
+            op2.configuration['hdf5_chunk_size'] = 16
+            rows = meshfile.read_rows('coords', [4, 0, 3, 1])
+        finally:
+            op2.configuration['hdf5_chunk_size'] = chunk_size
+        assert (rows == np.arange(10).reshape(5, 2)[[4, 0, 3, 1]]).all()
+
+    def test_load_partitioned_wrong_size(self, backend, meshfile):
+        "A partition vector not matching the set size should raise."
+        with pytest.raises(exceptions.SizeTypeError):
+            meshfile.load('cells', 'nodes', 'cell_node',
+                          np.zeros(3, dtype=np.int32), 'node_partition')
+
+    def test_load_partitioned_nonexistent_process(self, backend, meshfile):
+        "A partition vector referring to a nonexistent process should raise."
+        with pytest.raises(exceptions.SetValueError):
+            meshfile.load('cells', 'nodes', 'cell_node',
+                          np.ones(4, dtype=np.int32), 'node_partition')
+
+    def test_partition_owners(self, backend, meshfile):
+        "The owners of set elements should be looked up in the partition vector."
+        partition = meshfile._partition('node_partition', 5)
+        assert (partition.owned() == np.arange(5)).all()
+        owners = partition.owners([[4, 0], [2, 2]])
+        assert owners.shape == (2, 2) and (owners == 0).all()
@@ -200,6 +200,21 @@ class TestIndirectLoop:
                      x2(op2.WRITE, iterset2indset[0]))
         assert all(all(v == [42, 43]) for v in x2.data)
 
+    def test_soa_dat_vec_map(self, backend, iterset, iterset2indset2, x2,
+                             skip_cuda, skip_opencl):
+        """Reading and incrementing Dats stored in SoA order through a vector
+        map should give the same result as for Dats stored in AoS order."""
+        k = op2.Kernel("""void k(unsigned int **y, unsigned int **x) {
+          for (int i = 0; i < 2; ++i) { y[i][0] += x[i][0]; y[i][1] += 2 * x[i][1]; }
+        }""", "k")
+        y = op2.Dat(x2.dataset, dtype=np.uint32)
+        op2.par_loop(k, iterset, y(op2.INC, iterset2indset2), x2(op2.READ, iterset2indset2))
+        x2_soa = op2.Dat(x2.dataset, x2.data_ro, np.uint32, soa=True)
+        y_soa = op2.Dat(x2.dataset, dtype=np.uint32, soa=True)
+        op2.par_loop(k, iterset, y_soa(op2.INC, iterset2indset2),
+                     x2_soa(op2.READ, iterset2indset2))
+        assert (y_soa.data_ro == y.data_ro).all()
+
     def test_2d_map(self, backend):
         """Sum nodal values incident to a common edge."""
         nedges = nelems - 1
@@ -271,6 +286,19 @@ class TestMixedIndirectLoop:
                      d(op2.READ))
         assert all(mdat[0].data == 1.0) and mdat[1].data == 4096.0
 
+    def test_mixed_soa_dat(self, backend, indset, unitset, mmap, iterset):
+        """Increment into a MixedDat with a component stored in SoA order."""
+        mdat = op2.MixedDat((op2.Dat(indset ** 2, soa=True), op2.Dat(unitset)))
+        d = op2.Dat(iterset, np.ones(iterset.size))
+        kernel_inc = """void kernel_inc(double **d, double *x) {
+          d[0][0] += x[0]; d[0][1] += 2 * x[0]; d[1][0] += x[0];
+        }"""
+        op2.par_loop(op2.Kernel(kernel_inc, "kernel_inc"), iterset,
+                     mdat(op2.INC, mmap),
+                     d(op2.READ))
+        assert all(mdat[0].data[:, 0] == 1.0) and all(mdat[0].data[:, 1] == 2.0)
+        assert mdat[1].data == 4096.0
+
 if __name__ == '__main__':
     import os
     pytest.main(os.path.abspath(__file__))
@@ -288,6 +288,51 @@ class TestLinAlgIop:
         assert yi.data.dtype == np.int64
 
 
+class TestLinAlgLincomb:
+
+    """
+    Tests of fused linear combinations of Dats.
+    """
+
+    def test_lincomb(self, backend, x, y):
+        z = op2.Dat(y)
+        x.lincomb([2.0, -1.0, 0.5], [y, z, y])
+        assert np.allclose(x.data_ro, 1.5 * y.data_ro)
+
+    def test_lincomb_self(self, backend, x, y):
+        x._data = 2 * y.data
+        x.lincomb([3.0, 1.0], [x, y])
+        assert np.allclose(x.data_ro, 7 * y.data_ro)
+
+    def test_lincomb_versioning(self, backend, x, y):
+        x.lincomb([1.0], [y])
+        snapshot = x.create_snapshot()
+        x_dup = x.duplicate()
+        y_dup = y.duplicate()
+        x.lincomb([2.0], [y])
+        y_dup.lincomb([3.0], [y])
+        assert not snapshot.is_valid()
+        assert np.allclose(x_dup.data_ro, y.data_ro)
+        assert np.allclose(x.data_ro, 2 * y.data_ro)
+        assert np.allclose(y_dup.data_ro, 3 * y.data_ro)
+        assert np.allclose(y.data_ro, np.arange(1, nelems + 1))
+
+    def test_lincomb_mismatch(self, backend, x, y):
+        with pytest.raises(ValueError):
+            x.lincomb([1.0, 2.0], [y])
+
+    def test_lincomb_shape_mismatch(self, backend, x2, y2):
+        with pytest.raises(ValueError):
+            x2.lincomb([1.0], [y2])
+
+    def test_lincomb_mixed(self, backend):
+        s = op2.Set(1)
+        md = op2.MixedDat([op2.Dat(s, [3], np.float64), op2.Dat(s, [4], np.float64)])
+        md1 = op2.MixedDat([op2.Dat(s, [4], np.float64), op2.Dat(s, [5], np.float64)])
+        md.lincomb([2.0, 1.0], [md, md1])
+        assert np.allclose(np.concatenate(md.data_ro), [10, 13])
+
+
 class TestLinAlgScalar:
 
     """
@@ -312,6 +357,18 @@ class TestLinAlgScalar:
 
         assert abs(ret - 32) < 1e-12
 
+    def test_inner_many(self, backend, x, y):
+        """Batched inner products should match individual inner products."""
+        x._data = 2 * y.data
+        ret = op2.inner_many(x, [x, y, y])
+        assert np.allclose(ret, [x.inner(x), x.inner(y), x.inner(y)])
+
+    def test_inner_many_mixed(self, backend):
+        s = op2.Set(1)
+        md = op2.MixedDat([op2.Dat(s, [3], np.float64), op2.Dat(s, [4], np.float64)])
+        md1 = op2.MixedDat([op2.Dat(s, [4], np.float64), op2.Dat(s, [5], np.float64)])
+        assert np.allclose(op2.inner_many(md, [md, md1]), [25, 32])
+
     def test_norm_mixed(self, backend):
         s = op2.Set(1)
 
@@ -342,3 +399,78 @@ class TestLinAlgScalar:
         ret = md1.inner(md)
 
         assert abs(ret - 32) < 1e-12
+
+
+class TestHostLinAlg:
+
+    """
+    Tests of linear algebra computed with NumPy on the host data.
+    """
+
+    def expressions(self, x, y):
+        x._data = 2 * y.data
+        z = x * 3.0 - y / x
+        z += y
+        z *= 0.5
+        z = -z
+        return z.data_ro.copy(), z.inner(y), z.norm
+
+    def test_host_linalg_matches_generated(self, backend, x, y):
+        """Linear algebra computed with NumPy should give the same results as
+        computed by generated code."""
+        host = self.expressions(x, y)
+        op2.configuration['host_linalg'] = False
+        try:
+            generated = self.expressions(x, y)
+        finally:
+            op2.configuration['host_linalg'] = True
+        np.testing.assert_allclose(host[0], generated[0], 1e-14)
+        np.testing.assert_allclose(host[1:], generated[1:], 1e-14)
+
+    def test_host_linalg_mixed_precision(self, backend):
+        """Linear algebra on Dats stored with a lower precision should be
+        computed in the compute precision, as by generated code."""
+        s = op2.Set(nelems)
+        x = op2.Dat(s, dtype=np.float32, compute_dtype=np.float64)
+        y = op2.Dat(s, np.arange(1, nelems + 1), np.float32, compute_dtype=np.float64)
+        assert not x._use_host_linalg(y) and not y._use_host_linalg(1.0)
+        host = self.expressions(x, y)
+        op2.configuration['host_linalg'] = False
+        try:
+            generated = self.expressions(x, y)
+        finally:
+            op2.configuration['host_linalg'] = True
+        np.testing.assert_allclose(host[0], generated[0], 1e-14)
+        np.testing.assert_allclose(host[1:], generated[1:], 1e-14)
+
+    def test_host_linalg_inner_many_mixed(self, backend):
+        """Inner products of MixedDats reduced once over all components
+        should match those reduced per component."""
+        s = op2.Set(1)
+        md = op2.MixedDat([op2.Dat(s, [3], np.float64), op2.Dat(s, [4], np.float64)])
+        md1 = op2.MixedDat([op2.Dat(s, [4], np.float64), op2.Dat(s, [5], np.float64)])
+        host = md.inner_many([md, md1])
+        op2.configuration['host_linalg'] = False
+        try:
+            generated = md.inner_many([md, md1])
+        finally:
+            op2.configuration['host_linalg'] = True
+        np.testing.assert_allclose(host, [25, 32], 1e-14)
+        np.testing.assert_allclose(host, generated, 1e-14)
+
+    def test_host_linalg_lazy(self, backend, x, y):
+        """Linear algebra computed with NumPy should respect the order of
+        pending computation."""
+        k = op2.Kernel('void k(double *x) { *x = 1.0; }', 'k')
+        op2.par_loop(k, x.dataset.set, x(op2.WRITE))
+        x += y
+        op2.par_loop(k, y.dataset.set, y(op2.WRITE))
+        assert all(x.data_ro == np.arange(2, nelems + 2))
+        assert all(y.data_ro == 1.0)
+
+    def test_host_linalg_versioning(self, backend, x, y):
+        """Linear algebra computed with NumPy should bump the version of the
+        modified Dat."""
+        version = y._version
+        y += 1.0
+        assert y._version > version
@@ -36,7 +36,7 @@ import numpy as np
 from numpy.testing import assert_allclose
 
 from pyop2 import op2
-from pyop2.exceptions import MapValueError, ModeValueError
+from pyop2.exceptions import MapValueError, ModeValueError, MatTypeError
 
 from coffee.base import *
 
@@ -103,6 +103,26 @@ def g(request):
     return op2.Global(1, 1.0, np.float64, "g")
 
 
+@pytest.fixture
+def node_node(nodes):
+    return op2.Map(nodes, nodes, 1, np.arange(NUM_NODES), "node_node")
+
+
+@pytest.fixture
+def diag(nodes):
+    return op2.Dat(nodes, np.arange(1, NUM_NODES + 1, dtype=valuetype), valuetype, "diag")
+
+
+def assemble_diagonal(mat, node_node, diag):
+    """Assemble the diagonal matrix with the values of the Dat diag."""
+    mat.zero()
+    op2.par_loop(op2.Kernel("void diag(double A[1][1], double *d) { A[0][0] += *d; }", "diag"),
+                 node_node.iterset,
+                 mat(op2.INC, (node_node[op2.i[0]], node_node[op2.i[1]])),
+                 diag(op2.READ))
+    mat.assemble()
+
+
 @pytest.fixture
 def f(dnodes):
     f_vals = np.asarray([1.0, 2.0, 3.0, 4.0], dtype=valuetype)
@@ -580,6 +600,20 @@ class TestSparsity:
                                              2, 3, 4, 5, 6, 7, 2, 3, 4, 5, 6, 7,
                                              4, 5, 6, 7, 4, 5, 6, 7])
 
+    def test_build_block_sparsity(self, backend):
+        """Building a blocked sparsity on a vector DataSet should give the
+        rowptr and colidx of the block rows."""
+        elements = op2.Set(4)
+        nodes = op2.Set(5)
+        elem_node = op2.Map(elements, nodes, 3, [0, 4, 3, 0, 1, 4,
+                                                 1, 2, 4, 2, 3, 4])
+        sparsity = op2.Sparsity(nodes ** 2, elem_node, block_sparse=True)
+        assert sparsity.block_sparse
+        assert sparsity is not op2.Sparsity(nodes ** 2, elem_node)
+        assert all(sparsity._rowptr == [0, 4, 8, 12, 16, 21])
+        assert all(sparsity._colidx == [0, 1, 3, 4, 0, 1, 2, 4, 1, 2,
+                                        3, 4, 0, 2, 3, 4, 0, 1, 2, 3, 4])
+
     def test_sparsity_null_maps(self, backend):
         """Building sparsity from a pair of non-initialized maps should fail."""
         s = op2.Set(5)
@@ -609,6 +643,149 @@ class TestMatrices:
         mat.inc_local_diagonal_entries(range(nrows))
         assert (mat.values == np.identity(nrows * n)).all()
 
+    def test_mat_preallocated_from_sparsity(self, backend, nodes, elem_node, skip_cuda):
+        """A freshly created matrix should be assembled with exactly the
+        nonzero structure of its sparsity."""
+        sparsity = op2.Sparsity(nodes ** 2, elem_node)
+        mat = op2.Mat(sparsity, valuetype)
+        assert mat.handle.assembled
+        assert mat.handle.getInfo()['nz_used'] == sparsity.nz
+        assert (mat.values == 0).all()
+
+    def test_assemble_block_sparse_mat(self, backend, nodes, elements, elem_node,
+                                       skip_cuda, skip_opencl):
+        """Assembling into a blocked matrix should give the same result as
+        assembling into a scalar one."""
+        kernel = op2.Kernel("""
+void fill(double A[6][6]) {
+  for ( int i = 0; i < 6; i++ )
+    for ( int j = 0; j < 6; j++ )
+      A[i][j] += i + 0.1 * j;
+}""", "fill")
+        mats = [op2.Mat(op2.Sparsity(nodes ** 2, elem_node, block_sparse=b), valuetype)
+                for b in (False, True)]
+        for mat in mats:
+            op2.par_loop(kernel, elements,
+                         mat(op2.INC, (elem_node[op2.i[0]], elem_node[op2.i[1]]),
+                             flatten=True))
+        assert mats[1].sparsity.block_sparse
+        assert_allclose(mats[0].values, mats[1].values, 1e-12)
+
+    def test_block_sparse_mat_array(self, backend, nodes, elements, elem_node,
+                                    skip_cuda, skip_opencl):
+        """The non-zero values of an assembled blocked matrix should be those
+        of the scalar matrix in CSR order, and reading them should keep the
+        assembled values."""
+        kernel = op2.Kernel("""
+void fill(double A[6][6]) {
+  for ( int i = 0; i < 6; i++ )
+    for ( int j = 0; j < 6; j++ )
+      A[i][j] += i + 0.1 * j;
+}""", "fill")
+        mats = [op2.Mat(op2.Sparsity(nodes ** 2, elem_node, block_sparse=b), valuetype)
+                for b in (False, True)]
+        for mat in mats:
+            op2.par_loop(kernel, elements,
+                         mat(op2.INC, (elem_node[op2.i[0]], elem_node[op2.i[1]]),
+                             flatten=True))
+        handle = mats[1].handle
+        assert_allclose(mats[0].array, mats[1].array, 1e-12)
+        assert mats[1].handle is handle
+        assert_allclose(mats[0].values, mats[1].values, 1e-12)
+        assert abs(mats[1].values).max() > 0
+
+    @pytest.mark.parametrize('dim', [1, 2])
+    def test_fast_reassembly(self, backend, nodes, elements, elem_node, dim,
+                             skip_cuda, skip_opencl):
+        """Repeatedly assembling through precomputed CSR offsets should give
+        the same result as assembling through MatSetValues."""
+        kernel = op2.Kernel("""
+void fill(double A[%(n)d][%(n)d]) {
+  for ( int i = 0; i < %(n)d; i++ )
+    for ( int j = 0; j < %(n)d; j++ )
+      A[i][j] += i + 0.1 * j;
+}""" % {'n': 3 * dim}, "fill")
+        sparsity = op2.Sparsity(nodes ** dim, elem_node)
+        values = []
+        try:
+            for fast in (False, True):
+                op2.configuration['fast_reassembly'] = fast
+                mat = op2.Mat(sparsity, valuetype)
+                for _ in range(2):
+                    mat.zero()
+                    op2.par_loop(kernel, elements,
+                                 mat(op2.INC, (elem_node[op2.i[0]], elem_node[op2.i[1]]),
+                                     flatten=True))
+                    mat.assemble()
+                values.append(mat.values)
+        finally:
+            op2.configuration['fast_reassembly'] = False
+        assert_allclose(values[0], values[1], 1e-12)
+
+    def _assemble_fast(self, mat, elements, rmap, cmap):
+        kernel = op2.Kernel("""
+void fill(double A[3][3]) {
+  for ( int i = 0; i < 3; i++ )
+    for ( int j = 0; j < 3; j++ )
+      A[i][j] += 1.0;
+}""", "fill")
+        try:
+            op2.configuration['fast_reassembly'] = True
+            op2.par_loop(kernel, elements,
+                         mat(op2.INC, (rmap[op2.i[0]], cmap[op2.i[1]])))
+            mat.assemble()
+        finally:
+            op2.configuration['fast_reassembly'] = False
+
+    def test_fast_reassembly_masked_entries(self, backend, nodes, elements, elem_node,
+                                            skip_cuda, skip_opencl):
+        """Entries with a negative row or column index should be dropped by
+        fast reassembly, as by MatSetValues."""
+        masked = op2.Map(elements, nodes, 3, [0, 1, -1, 2, 3, 1],
+                         "masked", parent=elem_node)
+        mat = op2.Mat(op2.Sparsity(nodes, elem_node), valuetype)
+        self._assemble_fast(mat, elements, masked, elem_node)
+        expected = np.zeros((NUM_NODES, NUM_NODES))
+        for rows, cols in ([0, 1], [0, 1, 3]), ([2, 3, 1], [2, 3, 1]):
+            expected[np.ix_(rows, cols)] += 1.0
+        assert_allclose(mat.values, expected, 1e-12)
+
+    def test_fast_reassembly_entry_not_in_sparsity(self, backend, nodes, elements,
+                                                   elem_node, skip_cuda, skip_opencl):
+        """Fast reassembly through maps addressing an entry which is not in
+        the sparsity should raise."""
+        other = op2.Map(elements, nodes, 3, [0, 1, 2, 2, 3, 1],
+                        "other", parent=elem_node)
+        mat = op2.Mat(op2.Sparsity(nodes, elem_node), valuetype)
+        with pytest.raises(MapValueError):
+            self._assemble_fast(mat, elements, other, other)
+
+    def test_mat_mult_into_dat(self, backend, nodes, elements, elem_node, f,
+                               skip_cuda, skip_opencl):
+        """Matrix-vector products written into an existing Dat should
+        match the dense products, without replacing its storage."""
+        kernel = op2.Kernel("""
+void fill(double A[3][3]) {
+  for ( int i = 0; i < 3; i++ )
+    for ( int j = 0; j < 3; j++ )
+      A[i][j] += i + 0.1 * j;
+}""", "fill")
+        mat = op2.Mat(op2.Sparsity(nodes, elem_node), valuetype)
+        op2.par_loop(kernel, elements,
+                     mat(op2.INC, (elem_node[op2.i[0]], elem_node[op2.i[1]])))
+        mat.assemble()
+        A = mat.values
+        out = op2.Dat(nodes, dtype=valuetype)
+        data = out.data_ro
+        mat.mult(f, out)
+        assert_allclose(out.data_ro, np.dot(A, f.data_ro), 1e-12)
+        assert out.data_ro.ctypes.data == data.ctypes.data
+        mat.mult_add(f, out, out)
+        assert_allclose(out.data_ro, 2 * np.dot(A, f.data_ro), 1e-12)
+        mat.mult_transpose(f, out)
+        assert_allclose(out.data_ro, np.dot(A.T, f.data_ro), 1e-12)
+        assert_allclose((mat * f).data_ro, np.dot(A, f.data_ro), 1e-12)
+
     def test_minimal_zero_mat(self, backend, skip_cuda):
         """Assemble a matrix that is all zeros."""
 
@@ -663,6 +840,35 @@ class TestMatrices:
         eps = 1.e-8
         assert_allclose(x.data, f.data, eps)
 
+    def test_solver_reuses_preconditioner(self, backend, nodes, node_node, diag, skip_cuda):
+        """Solving repeatedly with an unmodified matrix and unchanged parameters
+        should reuse the Jacobi preconditioner, which is rebuilt once either
+        changes. CG converges in one iteration for a diagonal matrix
+        preconditioned with its diagonal, and in two if one entry of the
+        matrix changed since the preconditioner was set up."""
+        solver = op2.Solver()
+        if not hasattr(solver, 'setReusePreconditioner'):
+            pytest.skip("PETSc cannot reuse the preconditioner")
+        mat = op2.Mat(op2.Sparsity(nodes, node_node), valuetype)
+        assemble_diagonal(mat, node_node, diag)
+        b = op2.Dat(nodes, np.ones(NUM_NODES), valuetype)
+        x = op2.Dat(nodes, dtype=valuetype)
+
+        def iterations():
+            solver.solve(mat, x, b)
+            return solver.getIterationNumber()
+        assert iterations() == 1
+        # Changing values behind PyOP2's back keeps the preconditioner
+        mat.handle.setValue(0, 0, 10.0)
+        mat.handle.assemble()
+        assert iterations() == 2
+        solver.update_parameters({'ksp_rtol': 1e-10})
+        assert iterations() == 1
+        diag.data[0] = 20.0
+        assemble_diagonal(mat, node_node, diag)
+        assert iterations() == 1
+        assert_allclose(x.data_ro, 1.0 / diag.data_ro, 1e-8)
+
     def test_zero_matrix(self, backend, mat):
         """Test that the matrix is zeroed correctly."""
         mat.zero()
@@ -770,6 +976,117 @@ class TestMatrices:
             assert mat.handle[i, i] == v
 
 
+class TestImplicitMatrices:
+
+    """
+    Matrix-free matrix tests
+    """
+
+    @pytest.fixture
+    def mats(self, nodes, elements, elem_node):
+        """An assembled matrix and the equivalent matrix-free one, with
+        element matrices 1 + delta_ij."""
+        assemble = op2.Kernel("""
+void assemble(double A[3][3]) {
+  for ( int i = 0; i < 3; i++ )
+    for ( int j = 0; j < 3; j++ )
+      A[i][j] += (i == j) ? 2.0 : 1.0;
+}""", "assemble")
+        action = op2.Kernel("""
+void action(double **y, double **x) {
+  for ( int i = 0; i < 3; i++ )
+    for ( int j = 0; j < 3; j++ )
+      y[i][0] += ((i == j) ? 2.0 : 1.0) * x[j][0];
+}""", "action")
+        diagonal = op2.Kernel("""
+void diagonal(double **d) {
+  for ( int i = 0; i < 3; i++ )
+    d[i][0] += 2.0;
+}""", "diagonal")
+        mat = op2.Mat(op2.Sparsity(nodes, elem_node), valuetype)
+        op2.par_loop(assemble, elements,
+                     mat(op2.INC, (elem_node[op2.i[0]], elem_node[op2.i[1]])))
+        mat.assemble()
+        imat = op2.ImplicitMat(nodes, action, elements, elem_node,
+                               diagonal=diagonal, dtype=valuetype)
+        return mat, imat
+
+    @pytest.fixture
+    def x(self, nodes):
+        return op2.Dat(nodes, np.arange(1, NUM_NODES + 1, dtype=valuetype), valuetype)
+
+    def test_implicit_mat_mult(self, backend, mats, x, skip_cuda, skip_opencl):
+        """Multiplying a matrix-free matrix with a Dat should give the same
+        result as multiplying the assembled matrix."""
+        mat, imat = mats
+        assert_allclose((imat * x).data_ro, (mat * x).data_ro, 1e-12)
+
+    def test_implicit_mat_mult_versioning(self, backend, mats, x, nodes,
+                                          skip_cuda, skip_opencl):
+        """Multiplying into an existing Dat should version it and split its
+        copy-on-write duplicates."""
+        mat, imat = mats
+        y = op2.Dat(nodes, np.ones(NUM_NODES), valuetype)
+        y_dup = y.duplicate()
+        snapshot = y.create_snapshot()
+        imat.mult(x, y)
+        assert not snapshot.is_valid()
+        assert y._version != 0
+        assert_allclose(y.data_ro, (mat * x).data_ro, 1e-12)
+        assert_allclose(y_dup.data_ro, np.ones(NUM_NODES), 1e-12)
+
+    def test_implicit_mat_solve(self, backend, mats, x, nodes, skip_cuda, skip_opencl):
+        """Solving with a Jacobi preconditioned matrix-free matrix should
+        give the same solution as with the assembled matrix."""
+        mat, imat = mats
+        b = mat * x
+        y = op2.Dat(nodes, dtype=valuetype)
+        op2.Solver(ksp_type='cg', pc_type='jacobi', ksp_rtol=1e-12).solve(imat, y, b)
+        assert_allclose(y.data_ro, x.data_ro, 1e-8)
+
+    def test_implicit_mat_rebuilds_preconditioner(self, backend, nodes, node_node, diag,
+                                                  skip_cuda, skip_opencl):
+        """The action of a matrix-free matrix may change without PyOP2
+        noticing, hence its Jacobi preconditioner should be rebuilt on every
+        solve, also after solving with an assembled matrix. CG converges in
+        one iteration for a diagonal matrix preconditioned with its
+        diagonal."""
+        action = op2.Kernel("""
+void action(double **y, double **x, double *d) {
+  y[0][0] += d[0] * x[0][0];
+}""", "action")
+        diagonal = op2.Kernel("""
+void diagonal(double **D, double *d) {
+  D[0][0] += d[0];
+}""", "diagonal")
+        imat = op2.ImplicitMat(nodes, action, nodes, node_node, args=(diag(op2.READ),),
+                               diagonal=diagonal, dtype=valuetype)
+        mat = op2.Mat(op2.Sparsity(nodes, node_node), valuetype)
+        assemble_diagonal(mat, node_node, diag)
+        b = op2.Dat(nodes, np.ones(NUM_NODES), valuetype)
+        x = op2.Dat(nodes, dtype=valuetype)
+        solver = op2.Solver()
+        for A in mat, imat:
+            solver.solve(A, x, b)
+            assert solver.getIterationNumber() == 1
+        diag.data[0] = 10.0
+        solver.solve(imat, x, b)
+        assert solver.getIterationNumber() == 1
+        assert_allclose(x.data_ro, 1.0 / diag.data_ro, 1e-8)
+
+    def test_implicit_mat_fieldsplit_fails(self, backend, mats, x, nodes,
+                                           skip_cuda, skip_opencl):
+        """Field split preconditioning a matrix-free matrix should fail."""
+        y = op2.Dat(nodes, dtype=valuetype)
+        with pytest.raises(MatTypeError):
+            op2.Solver(pc_type='fieldsplit').solve(mats[1], y, x)
+
+    def test_implicit_mat_par_loop_fails(self, backend, mats, elem_node, skip_cuda, skip_opencl):
+        """Passing a matrix-free matrix to a par_loop should fail."""
+        with pytest.raises(MatTypeError):
+            mats[1](op2.INC, (elem_node[op2.i[0]], elem_node[op2.i[1]]))
+
+
 class TestMixedMatrices:
     """
     Matrix tests for mixed spaces
@@ -860,6 +1177,35 @@ class TestMixedMatrices:
         assert_allclose(dat[0].data_ro, b[0].data_ro, eps)
         assert_allclose(dat[1].data_ro, b[1].data_ro, eps)
 
+    def test_solve_mixed_contiguous(self, backend, mat, dat):
+        """Solving into a contiguous MixedDat should give the same result as
+        solving into a MixedDat with separate storage."""
+        x = op2.MixedDat(dat.dataset)
+        op2.solve(mat, x, dat)
+        y = op2.MixedDat(dat.dataset, contiguous=True)
+        op2.solve(mat, y, dat)
+        eps = 1.e-12
+        assert_allclose(x[0].data_ro, y[0].data_ro, eps)
+        assert_allclose(x[1].data_ro, y[1].data_ro, eps)
+
+    def test_contiguous_mixed_dat_vec(self, backend, mset):
+        """The PETSc Vec of a contiguous MixedDat should share its storage."""
+        dat = op2.MixedDat(mset, contiguous=True)
+        with dat.vec as v:
+            v.array[:] = np.arange(v.getLocalSize())
+            assert np.may_share_memory(v.array, dat[0].data_ro)
+        assert_allclose(np.concatenate(dat.data_ro), np.arange(v.getLocalSize()), 1e-12)
+
+    def test_mult_mixed_into_dat(self, backend, mat, dat):
+        """Multiplying into an existing MixedDat should match the blockwise
+        dense product."""
+        out = op2.MixedDat(dat.dataset)
+        mat.mult(dat, out)
+        eps = 1.e-12
+        for i in range(2):
+            expected = sum(np.dot(mat[i, j].values, dat[j].data_ro) for j in range(2))
+            assert_allclose(out[i].data_ro, expected, eps)
+
     def test_set_diagonal(self, backend, mat, dat):
         mat.zero()
         mat.set_diagonal(dat)
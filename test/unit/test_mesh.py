@@ -0,0 +1,151 @@
+# This file is part of PyOP2
+#
+# PyOP2 is Copyright (c) 2012, Imperial College London and
+# others. Please see the AUTHORS file in the main source directory for
+# a full list of copyright holders.  All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions
+# are met:
+#
+#     * Redistributions of source code must retain the above copyright
+#       notice, this list of conditions and the following disclaimer.
+#     * Redistributions in binary form must reproduce the above copyright
+#       notice, this list of conditions and the following disclaimer in the
+#       documentation and/or other materials provided with the distribution.
+#     * The name of Imperial College London or that of other
+#       contributors may not be used to endorse or promote products
+#       derived from this software without specific prior written
+#       permission.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTERS
+# ''AS IS'' AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT
+# LIMITED TO, THE IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS
+# FOR A PARTICULAR PURPOSE ARE DISCLAIMED. IN NO EVENT SHALL THE
+# COPYRIGHT HOLDERS OR CONTRIBUTORS BE LIABLE FOR ANY DIRECT,
+# INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES
+# (INCLUDING, BUT NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR
+# SERVICES; LOSS OF USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION)
+# HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT,
+# STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE)
+# ARISING IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED
+# OF THE POSSIBILITY OF SUCH DAMAGE.
+
+
+"""
+Mesh reader tests
+"""
+
+import os
+import pytest
+
+from pyop2 import op2, mesh
+
+NODE = """# A unit square
+4 2 0 1
+1 0.0 0.0 1
+2 1.0 0.0 1
+3 1.0 1.0 1   # corner
+4 0.0 1.0 1
+"""
+
+ELE = """2 3 0
+1 1 2 3
+2 1 3 4
+"""
+
+MSH = """$MeshFormat
+2.2 0 8
+$EndMeshFormat
+$Nodes
+4
+10 0 0 0
+20 1 0 0
+30 1 1 0
+40 0 1 0
+$EndNodes
+$Elements
+7
+1 15 2 0 10 10
+2 1 2 7 1 10 20
+3 1 2 7 2 20 30
+4 1 2 8 3 30 40
+5 1 2 8 4 40 10
+6 2 2 9 1 10 20 30
+7 2 2 9 1 10 30 40
+$EndElements
+"""
+
+
+@pytest.fixture
+def cache_dir(request, tmpdir):
+    old = op2.configuration['cache_dir']
+    op2.configuration['cache_dir'] = str(tmpdir.join('cache'))
+
+    def restore():
+        op2.configuration['cache_dir'] = old
+    request.addfinalizer(restore)
+    return op2.configuration['cache_dir']
+
+
+@pytest.fixture
+def triangle(tmpdir):
+    tmpdir.join('square.node').write(NODE)
+    tmpdir.join('square.ele').write(ELE)
+    return str(tmpdir.join('square'))
+
+
+@pytest.fixture
+def gmsh(tmpdir):
+    tmpdir.join('square.msh').write(MSH)
+    return str(tmpdir.join('square.msh'))
+
+
+class TestMeshReaders:
+
+    def test_triangle_arrays(self, triangle):
+        "The Triangle reader should number vertices from zero and skip comments."
+        arrays = mesh.read_triangle_arrays(triangle)
+        assert (arrays['coords'] == [[0, 0], [1, 0], [1, 1], [0, 1]]).all()
+        assert (arrays['cells'] == [[0, 1, 2], [0, 2, 3]]).all()
+
+    def test_gmsh_arrays(self, gmsh):
+        "The Gmsh reader should renumber vertices and split cells and facets."
+        arrays = mesh.read_gmsh_arrays(gmsh)
+        assert arrays['coords'].shape == (4, 2)
+        assert (arrays['cells'] == [[0, 1, 2], [0, 2, 3]]).all()
+        assert (arrays['cell_ids'] == 9).all()
+        assert (arrays['facets'] == [[0, 1], [1, 2], [2, 3], [3, 0]]).all()
+        assert (arrays['facet_ids'] == [7, 7, 8, 8]).all()
+
+    def test_read_triangle(self, backend, triangle, cache_dir):
+        "Reading a Triangle mesh should build the OP2 data structures."
+        nodes, coords, elements, elem_node = mesh.read_triangle(triangle)
+        assert nodes.size == 4 and elements.size == 2
+        assert coords.dataset.cdim == 2
+        assert elem_node.arity == 3 and elem_node.toset == nodes
+        assert (elem_node.values == [[0, 1, 2], [0, 2, 3]]).all()
+
+    def test_read_gmsh_extruded(self, backend, gmsh, cache_dir):
+        "Reading a Gmsh mesh with layers should extrude the elements."
+        _, _, elements, _ = mesh.read_gmsh(gmsh, layers=3)
+        assert elements.layers == 3
+
+    def test_cache(self, backend, triangle, cache_dir):
+        "A mesh read before should be memory mapped from the cache."
+        mesh.read_triangle(triangle)
+        assert len(os.listdir(cache_dir)) == 1
+        _, coords, _, _ = mesh.read_triangle(triangle)
+        assert not coords._numpy_data.flags.owndata
+        coords.data[:] = 0
+        _, coords, _, _ = mesh.read_triangle(triangle)
+        assert coords.data_ro.sum() == 4
+
+    def test_no_cache(self, backend, triangle, cache_dir):
+        "Reading without the cache should not write it."
+        mesh.read_triangle(triangle, cache=False)
+        assert not os.path.exists(cache_dir)
+
+
+if __name__ == '__main__':
+    pytest.main(os.path.abspath(__file__))
@@ -32,7 +32,13 @@
 # OF THE POSSIBILITY OF SUCH DAMAGE.
 
 import pytest
-from pyop2.profiling import tic, toc, get_timers, reset_timers, Timer
+import numpy as np
+
+from pyop2 import op2
+from pyop2.hwcounters import HardwareCounters, hw_summary
+from pyop2.profiling import tic, toc, get_timers, reset_timers, summary, \
+    memory_summary, timed_region, write_trace, Timer, LoopCounter, \
+    MemoryTracker, Tracer
 
 
 class TestProfiling:
@@ -67,6 +73,271 @@ class TestProfiling:
         reset_timers()
         assert get_timers().keys() == []
 
+    def test_statistics(self):
+        t = Timer('test_statistics')
+        for dt in [1.0, 2.0, 3.0, 6.0]:
+            t.add(dt)
+        assert t.ncalls == 4
+        assert t.total == 12.0
+        assert t.average == 3.0
+        assert t.min == 1.0 and t.max == 6.0
+        assert abs(t.std - np.std([1.0, 2.0, 3.0, 6.0])) < 1e-12
+
+    def test_call_tree(self):
+        reset_timers()
+        clock = iter(range(1, 100)).next
+        outer = Timer('test_outer', timer=clock)
+        inner = Timer('test_inner', timer=clock)
+        outer.start()
+        for i in range(2):
+            inner.start()
+            inner.stop()
+        outer.stop()
+        inner.start()
+        inner.stop()
+        assert Timer.call_tree() == [(('test_inner', ), 1, 1.0),
+                                     (('test_outer', ), 1, 5.0),
+                                     (('test_outer', 'test_inner'), 2, 2.0)]
+        assert inner.ncalls == 3 and inner.total == 3.0
+
+    def test_summary_json(self, tmpdir):
+        import json
+        reset_timers()
+        with timed_region('test_json_outer'):
+            with timed_region('test_json_inner'):
+                pass
+        filename = str(tmpdir.join('timers.json'))
+        summary(filename)
+        out = json.load(open(filename))
+        assert [t['Timer'] for t in out['timers']] == ['test_json_inner', 'test_json_outer']
+        assert [n['path'] for n in out['tree']] == [['test_json_outer'],
+                                                    ['test_json_outer', 'test_json_inner']]
+
+    def test_summary_csv(self, tmpdir):
+        reset_timers()
+        Timer('test_csv').add(2.0)
+        filename = str(tmpdir.join('timers.csv'))
+        summary(filename)
+        lines = open(filename).read().splitlines()
+        assert lines[0].startswith('Timer,Total time,Calls,Average time')
+        assert lines[1].split(',')[:3] == ['test_csv', '2.0', '1']
+
+
+@pytest.fixture
+def profiling(request, tmpdir):
+    """Enable the profiling configuration option given as parameter, with
+    the records of its class reset before and after the test. Returns the
+    value of the option."""
+    option = request.param
+    cls, value, default = {'loop_counters': (LoopCounter, True, False),
+                           'trace_file': (Tracer, str(tmpdir.join('trace.json')), ""),
+                           'hw_counters': (HardwareCounters, True, False)}[option]
+    cls.reset_all()
+    op2.configuration[option] = value
+
+    def reset():
+        op2.configuration[option] = default
+        cls.reset_all()
+    request.addfinalizer(reset)
+    return value
+
+
+loop_counters = pytest.mark.parametrize('profiling', ['loop_counters'], indirect=True)
+tracing = pytest.mark.parametrize('profiling', ['trace_file'], indirect=True)
+hw_counters = pytest.mark.parametrize('profiling', ['hw_counters'], indirect=True)
+
+
+class TestLoopCounters:
+
+    """Per kernel performance counter tests."""
+
+    @loop_counters
+    def test_direct(self, backend, profiling):
+        s = op2.Set(10)
+        d = op2.Dat(s, np.zeros(10))
+        k = op2.Kernel("void count_direct(double *x) { *x += 1.0; }", "count_direct")
+        for i in range(3):
+            op2.par_loop(k, s, d(op2.RW))
+        d.data_ro
+        (c, ) = [c for c in LoopCounter.get_counters().values() if c.name == 'count_direct']
+        assert c.calls == 3
+        assert c.elements == 30
+        # Each entry is read and written
+        assert c.bytes == 3 * 10 * 2 * 8
+
+    @loop_counters
+    def test_indirect(self, backend, profiling):
+        s = op2.Set(4)
+        t = op2.Set(2)
+        m = op2.Map(s, t, 1, [0, 1, 0, 1])
+        d = op2.Dat(t, np.zeros(2))
+        k = op2.Kernel("void count_indirect(double *x) { *x += 1.0; }", "count_indirect")
+        op2.par_loop(k, s, d(op2.INC, m[0]))
+        d.data_ro
+        (c, ) = [c for c in LoopCounter.get_counters().values() if c.name == 'count_indirect']
+        assert c.calls == 1 and c.elements == 4
+        # Both target entries are incremented and the map values read
+        assert c.bytes == 2 * 2 * 8 + 4 * 4
+
+    def test_disabled(self, backend):
+        LoopCounter.reset_all()
+        s = op2.Set(10)
+        d = op2.Dat(s, np.zeros(10))
+        k = op2.Kernel("void count_disabled(double *x) { *x = 1.0; }", "count_disabled")
+        op2.par_loop(k, s, d(op2.WRITE))
+        d.data_ro
+        assert not LoopCounter.get_counters()
+
+    def test_summary_csv(self, tmpdir):
+        LoopCounter.reset_all()
+        LoopCounter('kernel', 'key').add('core', 1.0, 10, 2e9)
+        filename = str(tmpdir.join('loops.csv'))
+        LoopCounter.summary(filename, peak_bandwidth=4)
+        lines = open(filename).read().splitlines()
+        assert lines[0].startswith('Kernel,Key,Calls')
+        assert lines[1].split(',')[-2:] == ['2.0', '50.0']
+        LoopCounter.reset_all()
+
+
+class TestTracer:
+
+    """Runtime event tracing tests."""
+
+    @tracing
+    def test_timed_region(self, profiling):
+        with timed_region('test_trace_region'):
+            pass
+        (e, ) = [e for e in Tracer.get_events() if e['name'] == 'test_trace_region']
+        assert e['ph'] == 'X' and e['cat'] == 'timer' and e['dur'] >= 0
+
+    def test_disabled(self):
+        Tracer.reset_all()
+        with timed_region('test_trace_disabled'):
+            pass
+        assert not Tracer.get_events()
+
+    @tracing
+    def test_par_loop(self, backend, profiling):
+        s = op2.Set(10)
+        d = op2.Dat(s, np.zeros(10))
+        k = op2.Kernel("void trace_kernel(double *x) { *x = 1.0; }", "trace_kernel")
+        op2.par_loop(k, s, d(op2.WRITE))
+        d.data_ro
+        events = [(e['cat'], e['ph']) for e in Tracer.get_events()
+                  if e['name'] == 'trace_kernel']
+        assert ('kernel', 'X') in events
+        if op2.configuration['lazy_evaluation']:
+            assert ('enqueue', 'i') in events
+            assert 'Trace evaluation' in [ev['name'] for ev in Tracer.get_events()]
+
+    @tracing
+    def test_write(self, profiling):
+        import json
+        with timed_region('test_trace_write'):
+            pass
+        write_trace()
+        trace = json.load(open(profiling))['traceEvents']
+        (e, ) = [e for e in trace if e['name'] == 'test_trace_write']
+        assert e['ts'] >= 0 and e['pid'] == 0
+        assert 'process_name' in [ev['name'] for ev in trace]
+
+
+class TestMemoryTracker:
+
+    """Memory accounting tests."""
+
+    def test_dat(self, backend):
+        import gc
+        live = MemoryTracker.live('Dat')
+        d = op2.Dat(op2.Set(10), dtype=np.float64)
+        d.data_ro
+        assert MemoryTracker.live('Dat') == live + 80
+        assert MemoryTracker.peak('Dat') >= live + 80
+        del d
+        gc.collect()
+        assert MemoryTracker.live('Dat') == live
+
+    def test_map(self, backend):
+        live = MemoryTracker.live('Map')
+        op2.Map(op2.Set(3), op2.Set(2), 2, np.zeros(6))
+        assert MemoryTracker.live('Map') == live
+        m = op2.Map(op2.Set(3), op2.Set(2), 2, np.zeros(6))
+        assert MemoryTracker.live('Map') == live + 24
+        assert MemoryTracker.count('Map') >= 1 and m.values.nbytes == 24
+
+    def test_track_once(self):
+        live = MemoryTracker.live('test')
+        a = np.zeros(4)
+        MemoryTracker.track('test', a)
+        MemoryTracker.track('test', a)
+        assert MemoryTracker.live('test') == live + 32
+        del a
+        assert MemoryTracker.live('test') == live
+
+    def test_disabled(self, backend):
+        op2.configuration['track_memory'] = False
+        try:
+            live = MemoryTracker.live()
+            d = op2.Dat(op2.Set(10), dtype=np.float64)
+            d.data_ro
+            assert MemoryTracker.live() == live
+        finally:
+            op2.configuration['track_memory'] = True
+
+    def test_summary_csv(self, tmpdir):
+        MemoryTracker.track('test_csv', np.zeros(1000))
+        filename = str(tmpdir.join('memory.csv'))
+        memory_summary(filename)
+        lines = open(filename).read().splitlines()
+        assert lines[0] == 'Rank,Category,Objects,Live MB,Peak MB'
+        assert [l for l in lines if ',test_csv,' in l] == ['0,test_csv,0,0.0,0.008']
+
+
+class TestHardwareCounters:
+
+    """Hardware counter tests."""
+
+    @hw_counters
+    def test_par_loop(self, backend, skip_cuda, skip_opencl, profiling):
+        if not HardwareCounters.available():
+            pytest.skip("Hardware counters not available")
+        k = op2.Kernel("void hw_kernel(double *x) { *x = 1.0; }", "hw_kernel")
+        instructions = []
+        for n in (1000, 100000):
+            HardwareCounters.reset_all()
+            s = op2.Set(n)
+            d = op2.Dat(s, np.zeros(n))
+            op2.par_loop(k, s, d(op2.WRITE))
+            d.data_ro
+            calls, counts = HardwareCounters.get_counts()['hw_kernel']
+            if 'cycles' not in counts or 'instructions' not in counts:
+                pytest.skip("Cycles or instructions cannot be counted")
+            assert calls >= 1
+            assert counts['cycles'] > 0 and counts['instructions'] > 0
+            instructions.append(counts['instructions'])
+        # A hundred times the elements take more instructions
+        assert instructions[1] > instructions[0]
+
+    def test_disabled(self, backend):
+        HardwareCounters.reset_all()
+        s = op2.Set(10)
+        d = op2.Dat(s, np.zeros(10))
+        k = op2.Kernel("void hw_disabled(double *x) { *x = 1.0; }", "hw_disabled")
+        op2.par_loop(k, s, d(op2.WRITE))
+        d.data_ro
+        assert not HardwareCounters.get_counts()
+
+    def test_summary_csv(self, tmpdir):
+        HardwareCounters.reset_all()
+        HardwareCounters.add('kernel', {'cycles': 100, 'instructions': 200,
+                                        'cache misses': 4})
+        filename = str(tmpdir.join('hw.csv'))
+        hw_summary(filename)
+        lines = open(filename).read().splitlines()
+        assert lines[0] == 'Kernel,Calls,Cycles,Instructions,Cache misses,IPC,Misses/kinstr'
+        assert lines[1] == 'kernel,1,100,200,4,2.0,20.0'
+        HardwareCounters.reset_all()
+
 
 if __name__ == '__main__':
     import os